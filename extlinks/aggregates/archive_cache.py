@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger("django")
+
+DEFAULT_MAX_SIZE_MB = 1024
+
+
+class ArchiveCache:
+    """
+    ArchiveCache keeps archives downloaded from object storage on the local
+    disk, for archives which are too big for memcached or were evicted from
+    it.
+
+    Each archive is a file in the cache's directory, named after the archive.
+    Reading an archive updates its modification time, and once the files add
+    up to more than the size budget the least recently used ones are removed.
+    Archives are checked against their Swift ETags, the MD5 of their
+    contents, so corrupted or replaced archives are downloaded again.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get_many(
+        self, names: Iterable[str], hashes: Optional[Dict[str, str]] = None
+    ) -> Dict[str, bytes]:
+        """
+        Returns the contents of the given archives which are in the cache.
+
+        Parameters
+        ----------
+        names : Iterable[str]
+            The names of the archives.
+
+        hashes : Dict[str, str], optional
+            The ETags of the archives in object storage. Cached archives
+            which don't match them are removed from the cache.
+        """
+
+        result = {}
+        for name in names:
+            path = self._get_path(name)
+            try:
+                with open(path, "rb") as archive:
+                    contents = archive.read()
+            except FileNotFoundError:
+                continue
+
+            if not self._matches(name, contents, hashes):
+                logger.info("Removing stale archive %s from the disk cache", name)
+                self._remove(path)
+                continue
+
+            # Mark the archive as recently used.
+            os.utime(path)
+            result[name] = contents
+
+        return result
+
+    def set_many(
+        self, archives: Dict[str, bytes], hashes: Optional[Dict[str, str]] = None
+    ):
+        """
+        Adds the given archives to the cache, then evicts the least recently
+        used archives if the cache is over its size budget.
+
+        Parameters
+        ----------
+        archives : Dict[str, bytes]
+            The contents of the archives, by name.
+
+        hashes : Dict[str, str], optional
+            The ETags of the archives in object storage. Archives which don't
+            match them aren't cached.
+        """
+
+        for name, contents in archives.items():
+            if not self._matches(name, contents, hashes):
+                logger.warning(
+                    "Not caching archive %s as it doesn't match its ETag", name
+                )
+                continue
+
+            # Write to a temporary file first so other processes never read
+            # a partially written archive.
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as archive:
+                archive.write(contents)
+            os.replace(temp_path, self._get_path(name))
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used archives until the cache fits in its
+        size budget.
+        """
+
+        entries = []
+        size = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                size += stat.st_size
+
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            self._remove(path)
+            size -= entry_size
+
+    def _get_path(self, name: str) -> str:
+        return os.path.join(self.directory, os.path.basename(name))
+
+    @staticmethod
+    def _matches(
+        name: str, contents: bytes, hashes: Optional[Dict[str, str]]
+    ) -> bool:
+        expected = (hashes or {}).get(name)
+        return not expected or hashlib.md5(contents).hexdigest() == expected
+
+    @staticmethod
+    def _remove(path: str):
+        # Another process may have removed it already.
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_archive_cache() -> Optional[ArchiveCache]:
+    """
+    Returns the disk cache of archives configured by the ARCHIVE_CACHE_DIR
+    and ARCHIVE_CACHE_SIZE_MB environment variables, or None if
+    ARCHIVE_CACHE_DIR isn't set.
+    """
+
+    directory = os.environ.get("ARCHIVE_CACHE_DIR")
+    if not directory:
+        return None
+
+    max_size_mb = int(os.environ.get("ARCHIVE_CACHE_SIZE_MB", DEFAULT_MAX_SIZE_MB))
+    return ArchiveCache(directory, max_size_mb * 1024 * 1024)
@@ -11,6 +11,7 @@ class Command(AggregateArchiveCommand):
 
     help = "Dump & delete or load data from the LinkAggregate table"
     name = "LinkAggregate"
+    totals_fields = ("year", "month")
 
     def get_model(self) -> Type[models.Model]:
         return LinkAggregate
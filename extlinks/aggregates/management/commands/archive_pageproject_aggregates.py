@@ -11,6 +11,8 @@ class Command(AggregateArchiveCommand):
 
     help = "Dump & delete or load data from the PageProjectAggregate table"
     name = "PageProjectAggregate"
+    sketch_field = "project_name"
+    totals_fields = ("project_name", "page_name")
 
     def get_model(self) -> Type[models.Model]:
         return PageProjectAggregate
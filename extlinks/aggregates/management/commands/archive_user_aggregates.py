@@ -11,6 +11,8 @@ class Command(AggregateArchiveCommand):
 
     help = "Dump & delete or load data from the UserAggregate table"
     name = "UserAggregate"
+    sketch_field = "username"
+    totals_fields = ("username",)
 
     def get_model(self) -> Type[models.Model]:
         return UserAggregate
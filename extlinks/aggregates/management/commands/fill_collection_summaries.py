@@ -0,0 +1,103 @@
+import logging
+
+from collections import defaultdict
+from datetime import date
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from extlinks.aggregates.models import (
+    ChangedCollectionMonth,
+    CollectionMonthlySummary,
+    LinkAggregate,
+    PageProjectAggregate,
+    UserAggregate,
+)
+from extlinks.common.helpers import batch_iterator
+from extlinks.common.management.commands import BaseCommand
+
+logger = logging.getLogger("django")
+
+AGGREGATE_MODELS = (LinkAggregate, UserAggregate, PageProjectAggregate)
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes the CollectionMonthlySummary rows of the months whose "
+        "aggregates changed since the last run, as recorded in "
+        "ChangedCollectionMonth. --all recomputes every month in the "
+        "aggregate tables instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute the summaries of every month in the aggregate tables",
+        )
+        parser.add_argument(
+            "--collections",
+            nargs="+",
+            type=int,
+            help="A list of collection IDs that will be processed instead of every collection",
+        )
+
+    def _handle(self, *args, **options):
+        if options["all"]:
+            self._refresh_all(options["collections"])
+        else:
+            self._refresh_changed(options["collections"])
+
+        close_old_connections()
+
+    def _refresh_all(self, collections):
+        months = set()
+        for model in AGGREGATE_MODELS:
+            aggregates = model.objects.all()
+            if collections:
+                aggregates = aggregates.filter(collection_id__in=collections)
+            months.update(
+                aggregates.values_list("collection_id", "year", "month")
+                .distinct()
+                .order_by()
+            )
+
+        for batch in batch_iterator(sorted(months)):
+            CollectionMonthlySummary.objects.refresh(
+                (collection_id, date(year, month, 1))
+                for collection_id, year, month in batch
+            )
+        logger.info("Refreshed %d collection monthly summaries", len(months))
+
+    def _refresh_changed(self, collections):
+        started = timezone.now()
+        changes = ChangedCollectionMonth.objects.filter(changed_at__lte=started)
+        if collections:
+            changes = changes.filter(collection_id__in=collections)
+
+        changes = list(
+            changes.values_list(
+                "pk", "changed_at", "aggregate", "collection_id", "full_date"
+            )
+        )
+        months_by_model = defaultdict(set)
+        for _, _, aggregate, collection_id, full_date in changes:
+            months_by_model[aggregate].add((collection_id, full_date))
+
+        # Only the summary fields derived from the tables which changed are
+        # recomputed.
+        for model in AGGREGATE_MODELS:
+            months = months_by_model.get(model.__name__, set())
+            for batch in batch_iterator(sorted(months)):
+                CollectionMonthlySummary.objects.refresh(batch, [model])
+            if months:
+                logger.info(
+                    "Refreshed %d collection monthly summaries from %s",
+                    len(months),
+                    model.__name__,
+                )
+
+        # Months changed while this ran are left for the next run.
+        ChangedCollectionMonth.objects.delete_read(
+            (pk, changed_at) for pk, changed_at, *_ in changes
+        )
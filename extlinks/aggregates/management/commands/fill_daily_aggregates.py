@@ -0,0 +1,12 @@
+from extlinks.aggregates.management.helpers import DailyAggregateCommand
+from extlinks.aggregates.models import (
+    LinkAggregate,
+    PageProjectAggregate,
+    UserAggregate,
+)
+
+
+class Command(DailyAggregateCommand):
+    help = "Adds aggregated data into the LinkAggregate, UserAggregate and PageProjectAggregate tables"
+
+    aggregate_models = (LinkAggregate, UserAggregate, PageProjectAggregate)
@@ -0,0 +1,69 @@
+import logging
+import time
+
+from django.db import close_old_connections
+
+from extlinks.aggregates.management.helpers import DailyAggregateCommand
+from extlinks.aggregates.models import (
+    LinkAggregate,
+    PageProjectAggregate,
+    UserAggregate,
+)
+
+logger = logging.getLogger("django")
+
+DEFAULT_INTERVAL = 60
+
+
+class Command(DailyAggregateCommand):
+    help = (
+        "Keeps the LinkAggregate, UserAggregate and PageProjectAggregate daily "
+        "tables up to date by adding new LinkEvents to them every minute"
+    )
+
+    aggregate_models = (LinkAggregate, UserAggregate, PageProjectAggregate)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=DEFAULT_INTERVAL,
+            help="Seconds between adding new LinkEvents to the aggregates",
+        )
+
+    def _handle(self, *args, **options):
+        interval = options["interval"]
+        logger.info("Following LinkEvents every %d seconds", interval)
+        last_link_event_id = self._get_last_link_event_id()
+        while True:
+            time.sleep(interval)
+            last_link_event_id = self._follow(last_link_event_id)
+
+    def _follow(self, last_link_event_id):
+        """
+        Adds the LinkEvents up to last_link_event_id to the aggregates, and
+        returns the id to count up to on the next pass.
+
+        LinkEvents are only counted up to the last id seen on the previous
+        pass, so any collector transaction holding a lower id has committed
+        by the time they are counted.
+
+        Parameters
+        ----------
+        last_link_event_id : int|None
+            The id of the last LinkEvent seen on the previous pass.
+
+        Returns
+        -------
+        int|None
+        """
+        started = time.monotonic()
+        self._aggregate_new_link_events(last_link_event_id)
+        logger.info(
+            "Aggregated LinkEvents up to %s in %.1fs",
+            last_link_event_id,
+            time.monotonic() - started,
+        )
+        next_link_event_id = self._get_last_link_event_id()
+        close_old_connections()
+        return next_link_event_id
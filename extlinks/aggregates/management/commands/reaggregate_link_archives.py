@@ -1,23 +1,41 @@
 import gzip
-import json
 import os
 import logging
+from collections import defaultdict
 from datetime import datetime, timedelta, date
 
 from django.db import transaction
+from django.utils import timezone
 
+from extlinks.aggregates.management.helpers.aggregation_plan import (
+    AggregationPlan,
+    get_command_name,
+)
 from extlinks.aggregates.models import (
+    AggregationRun,
     LinkAggregate,
     PageProjectAggregate,
     UserAggregate,
 )
 from extlinks.common import swift
+from extlinks.common.columnar import is_archive_name, iter_records
 from extlinks.common.management.commands import BaseCommand
 from extlinks.links.models import URLPattern, LinkEvent
 from extlinks.organisations.models import Organisation, User
 
 logger = logging.getLogger("django")
 
+# The LinkEvent fields read from archives when re-aggregating them.
+ARCHIVED_EVENT_FIELDS = (
+    "link",
+    "timestamp",
+    "domain",
+    "user_id",
+    "page_title",
+    "change",
+    "on_user_list",
+)
+
 
 class Command(BaseCommand):
     help = "Loads, parses, and fixes daily or monthly aggregates for a given organisation. "
@@ -41,6 +59,11 @@ class Command(BaseCommand):
         parser.add_argument(
             "--dir", help="The directory from which to parse archives.", type=str
         )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="Report the archived link events, aggregates and estimated runtime of each collection without writing anything.",
+        )
 
     def _handle(self, *args, **options):
         directory = options["dir"]
@@ -97,9 +120,15 @@ class Command(BaseCommand):
                     "Organisation already has aggregates or link events for month."
                 )
                 return
+            if options["plan"]:
+                self._plan_monthly_aggregates(
+                    directory, month_to_fix, url_patterns, last_day_of_month
+                )
+                return
             # otherwise, attempt re-aggregation
+            started = timezone.now()
             with transaction.atomic():
-                self._process_monthly_aggregates(
+                events = self._process_monthly_aggregates(
                     directory, month_to_fix, organisation, url_patterns, last_day_of_month
                 )
         else:
@@ -112,12 +141,21 @@ class Command(BaseCommand):
                     "Organisation already has aggregates or link events for day."
                 )
                 return
+            if options["plan"]:
+                self._plan_daily_aggregates(
+                    collections, day_to_fix, directory, url_patterns
+                )
+                return
             # otherwise, attempt re-aggregation
+            started = timezone.now()
             with transaction.atomic():
-                self._process_daily_aggregates(
+                events = self._process_daily_aggregates(
                     collections, day_to_fix, directory, url_patterns
                 )
 
+        if events:
+            AggregationRun.objects.record(get_command_name(self), events, started)
+
     def _get_existing_aggregates(self, conn):
         """
         This function gets existing link aggregates from object storage.
@@ -220,7 +258,55 @@ class Command(BaseCommand):
 
         Returns
         -------
-        None
+        int: the number of link events counted
+        """
+        totals = self._count_daily_aggregates(
+            collections, day_to_fix, directory, url_patterns
+        )
+
+        # Add the counts to any existing daily aggregates
+        for model in (PageProjectAggregate, UserAggregate, LinkAggregate):
+            model.objects.bulk_upsert(
+                (
+                    model(
+                        total_links_added=links_added,
+                        total_links_removed=links_removed,
+                        **dict(fields),
+                    )
+                    for (aggregate_model, fields), (
+                        links_added,
+                        links_removed,
+                    ) in totals.items()
+                    if aggregate_model is model
+                ),
+                increment=True,
+            )
+
+        # Every link event is counted in exactly one LinkAggregate
+        return sum(
+            links_added + links_removed
+            for (aggregate_model, _), (links_added, links_removed) in totals.items()
+            if aggregate_model is LinkAggregate
+        )
+
+    def _count_daily_aggregates(
+        self, collections, day_to_fix, directory, url_patterns
+    ):
+        """
+        This function counts the link events of the day to fix towards the daily aggregates of each collection.
+        Parameters
+        ----------
+        collections :  An array of collections
+
+        day_to_fix :  str
+
+        directory :  str
+
+        url_patterns :  An array of url patterns
+
+        Returns
+        -------
+        dict of links added and removed, keyed by aggregate model and fields
         """
         # pull month string from day input parameter
         month_to_fix = day_to_fix[:-2]
@@ -228,6 +314,8 @@ class Command(BaseCommand):
         events_split_by_url_pattern = self._load_events_from_archives(
             directory, month_to_fix, [i.url for i in url_patterns]
         )
+        # links added and removed, keyed by aggregate model and fields
+        totals = defaultdict(lambda: [0, 0])
         # loop through each collection
         for collection in collections:
             collection_url_pattern_strings = [
@@ -241,14 +329,63 @@ class Command(BaseCommand):
                     events_split_by_url_pattern,
                     int(day_to_fix[-2:]),
                 ):
-                    # create daily aggregates
-                    self._fill_daily_aggregate(collection, link_event)
+                    # count the event towards its daily aggregates
+                    self._fill_daily_aggregate(totals, collection, link_event)
+        return totals
+
+    def _plan_daily_aggregates(
+        self, collections, day_to_fix, directory, url_patterns
+    ):
+        """
+        This function writes how many archived link events of the day to fix each collection would count,
+        towards how many daily aggregates, and how many of those already exist.
+        Parameters
+        ----------
+        collections :  An array of collections
+
+        day_to_fix :  str
+
+        directory :  str
+
+        url_patterns :  An array of url patterns
+
+        Returns
+        -------
+        None
+        """
+        plan = AggregationPlan(get_command_name(self))
+        totals = self._count_daily_aggregates(
+            collections, day_to_fix, directory, url_patterns
+        )
+        keys = defaultdict(set)
+        for (model, fields), (links_added, links_removed) in totals.items():
+            collection_id = dict(fields)["collection_id"]
+            keys[model].add(fields)
+            plan.add(
+                collection_id,
+                events=(links_added + links_removed) if model is LinkAggregate else 0,
+                groups=1,
+            )
 
-    def _fill_daily_aggregate(self, collection, link_event):
+        day = datetime.fromisoformat(day_to_fix).date()
+        for model, model_keys in keys.items():
+            field_names = [name for name, _ in next(iter(model_keys))]
+            existing = model.objects.filter(
+                collection__in=collections, full_date=day
+            ).values(*field_names)
+            for row in existing.iterator():
+                if tuple(sorted(row.items())) in model_keys:
+                    plan.add(row["collection_id"], existing=1)
+
+        plan.write(self.stdout)
+
+    def _fill_daily_aggregate(self, totals, collection, link_event):
         """
-        This function updates or creates a daily LinkAggregate for a collection and a parsed JSON object(LinkEvent).
+        This function counts a parsed JSON object(LinkEvent) towards the daily aggregates for a collection.
         Parameters
         ----------
+        totals :  dict of links added and removed, keyed by aggregate model and fields
+
         collection :  Collection
 
         link_event :  obj
@@ -258,15 +395,44 @@ class Command(BaseCommand):
         None
         """
         change_number = link_event["fields"]["change"]
-        self._fill_daily_pageproject_aggregates(change_number, collection, link_event)
-        self._fill_daily_user_aggregate(change_number, collection, link_event)
-        self._fill_daily_link_aggregate(change_number, collection, link_event)
+        self._fill_daily_pageproject_aggregates(
+            totals, change_number, collection, link_event
+        )
+        self._fill_daily_user_aggregate(totals, change_number, collection, link_event)
+        self._fill_daily_link_aggregate(totals, change_number, collection, link_event)
+
+    def _count_daily_aggregate(self, totals, model, change_number, **fields):
+        """
+        This function counts a link added or removed towards the daily aggregate with the given fields.
+        Parameters
+        ----------
+        totals :  dict of links added and removed, keyed by aggregate model and fields
+
+        model :  the aggregate model
+
+        change_number :  int
+
+        fields :  the fields identifying the aggregate
+
+        Returns
+        -------
+        None
+        """
+        key = (model, tuple(sorted(fields.items())))
+        if change_number == 0:
+            totals[key][1] += 1
+        else:
+            totals[key][0] += 1
 
-    def _fill_daily_pageproject_aggregates(self, change_number, collection, link_event):
+    def _fill_daily_pageproject_aggregates(
+        self, totals, change_number, collection, link_event
+    ):
         """
-        This function updates or creates a daily PageProjectAggregate for a collection and a parsed JSON (LinkEvent).
+        This function counts a parsed JSON (LinkEvent) towards a daily PageProjectAggregate for a collection.
         Parameters
         ----------
+        totals :  dict of links added and removed, keyed by aggregate model and fields
+
         change_number :  int
 
         collection :  Collection
@@ -277,44 +443,25 @@ class Command(BaseCommand):
         -------
         None
         """
-        existing_pageproject_aggregate = PageProjectAggregate.objects.filter(
-            organisation=collection.organisation,
-            collection=collection,
-            page_name=link_event['fields']["page_title"],
-            project_name=link_event['fields']["domain"],
-            full_date=datetime.fromisoformat(
-                link_event["fields"]["timestamp"]
-            ).date(),
-            on_user_list=link_event['fields']["on_user_list"],
-        ).exclude(day=0).first()
-        if existing_pageproject_aggregate:
-            if change_number == 0:
-                existing_pageproject_aggregate.total_links_removed += 1
-            else:
-                existing_pageproject_aggregate.total_links_added += 1
-            existing_pageproject_aggregate.save()
-        else:
-            # Create a new page project aggregate
-            links_added = change_number if change_number > 0 else 0
-            links_removed = 1 if change_number == 0 else 0
-            PageProjectAggregate.objects.get_or_create(
-                organisation=collection.organisation,
-                collection=collection,
-                page_name=link_event['fields']["page_title"],
-                project_name=link_event['fields']["domain"],
-                full_date=datetime.fromisoformat(
-                    link_event["fields"]["timestamp"]
-                ).date(),
-                total_links_added=links_added,
-                total_links_removed=links_removed,
-                on_user_list=link_event['fields']["on_user_list"],
-            )
+        self._count_daily_aggregate(
+            totals,
+            PageProjectAggregate,
+            change_number,
+            organisation_id=collection.organisation_id,
+            collection_id=collection.id,
+            page_name=link_event["fields"]["page_title"],
+            project_name=link_event["fields"]["domain"],
+            full_date=datetime.fromisoformat(link_event["fields"]["timestamp"]).date(),
+            on_user_list=link_event["fields"]["on_user_list"],
+        )
 
-    def _fill_daily_user_aggregate(self, change_number, collection, link_event):
+    def _fill_daily_user_aggregate(self, totals, change_number, collection, link_event):
         """
-        This function updates or creates a daily UserAggregate for a collection and a parsed JSON (LinkEvent).
+        This function counts a parsed JSON (LinkEvent) towards a daily UserAggregate for a collection.
         Parameters
         ----------
+        totals :  dict of links added and removed, keyed by aggregate model and fields
+
         change_number :  int
 
         collection :  Collection
@@ -329,46 +476,24 @@ class Command(BaseCommand):
             user_retrieved = User.objects.get(pk=link_event["fields"]["user_id"])
         except User.DoesNotExist:
             return
-        exisiting_user_aggregate = (
-            UserAggregate.objects.filter(
-                organisation=collection.organisation,
-                collection=collection,
-                username=user_retrieved.username,
-                full_date=datetime.fromisoformat(
-                    link_event["fields"]["timestamp"]
-                ).date(),
-                on_user_list=link_event["fields"]["on_user_list"],
-            )
-            .exclude(day=0)
-            .first()
+        self._count_daily_aggregate(
+            totals,
+            UserAggregate,
+            change_number,
+            organisation_id=collection.organisation_id,
+            collection_id=collection.id,
+            username=user_retrieved.username,
+            full_date=datetime.fromisoformat(link_event["fields"]["timestamp"]).date(),
+            on_user_list=link_event["fields"]["on_user_list"],
         )
-        if exisiting_user_aggregate:
-            if change_number == 0:
-                exisiting_user_aggregate.total_links_removed += 1
-            else:
-                exisiting_user_aggregate.total_links_added += 1
-            exisiting_user_aggregate.save()
-        else:
-            # Create a new link aggregate
-            links_added = change_number if change_number > 0 else 0
-            links_removed = 1 if change_number == 0 else 0
-            UserAggregate.objects.create(
-                organisation=collection.organisation,
-                collection=collection,
-                username=user_retrieved.username,
-                full_date=datetime.fromisoformat(
-                    link_event["fields"]["timestamp"]
-                ).date(),
-                total_links_added=links_added,
-                total_links_removed=links_removed,
-                on_user_list=link_event["fields"]["on_user_list"],
-            )
 
-    def _fill_daily_link_aggregate(self, change_number, collection, link_event):
+    def _fill_daily_link_aggregate(self, totals, change_number, collection, link_event):
         """
-        This function updates or creates a daily LinkAggregate for a collection and a parsed JSON (LinkEvent).
+        This function counts a parsed JSON (LinkEvent) towards a daily LinkAggregate for a collection.
         Parameters
         ----------
+        totals :  dict of links added and removed, keyed by aggregate model and fields
+
         change_number :  int
 
         collection :  Collection
@@ -379,36 +504,15 @@ class Command(BaseCommand):
         -------
         None
         """
-        existing_link_aggregate = (
-            LinkAggregate.objects.filter(
-                organisation=collection.organisation.id,
-                collection=collection.id,
-                full_date=datetime.fromisoformat(link_event["fields"]["timestamp"]),
-                on_user_list=link_event["fields"]["on_user_list"],
-            )
-            .exclude(day=0)
-            .first()
+        self._count_daily_aggregate(
+            totals,
+            LinkAggregate,
+            change_number,
+            organisation_id=collection.organisation_id,
+            collection_id=collection.id,
+            full_date=datetime.fromisoformat(link_event["fields"]["timestamp"]).date(),
+            on_user_list=link_event["fields"]["on_user_list"],
         )
-        if existing_link_aggregate is None:
-            # Create a new link aggregate
-            links_added = change_number if change_number > 0 else 0
-            links_removed = 1 if change_number == 0 else 0
-            LinkAggregate.objects.create(
-                organisation=collection.organisation,
-                collection=collection,
-                full_date=datetime.fromisoformat(
-                    link_event["fields"]["timestamp"]
-                ).date(),
-                total_links_added=links_added,
-                total_links_removed=links_removed,
-                on_user_list=link_event["fields"]["on_user_list"],
-            )
-        else:
-            if change_number == 0:
-                existing_link_aggregate.total_links_removed += 1
-            else:
-                existing_link_aggregate.total_links_added += 1
-            existing_link_aggregate.save()
 
     def _process_monthly_aggregates(
         self, directory, month_to_fix, organisation, url_patterns, last_day_of_month
@@ -427,42 +531,103 @@ class Command(BaseCommand):
 
         Returns
         -------
-        None
+        int: the number of link events loaded
         """
         # load and split link events by url pattern
         events_split_by_url_pattern = self._load_events_from_archives(
             directory, month_to_fix, [i.url for i in url_patterns]
         )
-        # get the first and last day of the month to fix
+        # Merge the link events of every url pattern of a collection, as the
+        # monthly aggregates are replaced with their totals. Links matching
+        # several of a collection's url patterns are only counted once.
+        events_by_collection = defaultdict(dict)
         for url_pattern, link_events in events_split_by_url_pattern.items():
+            collection = url_patterns.filter(url=url_pattern).first().collection
+            for link_event in link_events:
+                events_by_collection[collection][link_event["pk"]] = link_event
+
+        for collection, link_events in events_by_collection.items():
             # create monthly aggregates
             self._fill_monthly_aggregate(
-                url_pattern, last_day_of_month, organisation, url_patterns, link_events
+                collection, last_day_of_month, organisation, list(link_events.values())
             )
+        return sum(len(link_events) for link_events in events_by_collection.values())
+
+    def _plan_monthly_aggregates(
+        self, directory, month_to_fix, url_patterns, last_day_of_month
+    ):
+        """
+        This function writes how many archived link events of the month to fix each collection would count,
+        towards how many monthly aggregates, and how many monthly aggregates already exist.
+        Parameters
+        ----------
+        directory :  str
+
+        month_to_fix :  str
+
+        url_patterns :  An array of url patterns
+
+        last_day_of_month :  date
+
+        Returns
+        -------
+        None
+        """
+        plan = AggregationPlan(get_command_name(self))
+        events_split_by_url_pattern = self._load_events_from_archives(
+            directory, month_to_fix, [i.url for i in url_patterns]
+        )
+        collection_ids = set()
+        for url_pattern, link_events in events_split_by_url_pattern.items():
+            collection_id = url_patterns.filter(url=url_pattern).first().collection_id
+            collection_ids.add(collection_id)
+            fields = [event["fields"] for event in link_events]
+            # one LinkAggregate per on_user_list flag, and a PageProjectAggregate
+            # and UserAggregate per page and user for each flag
+            groups = set()
+            for field in fields:
+                groups.add((LinkAggregate, field["on_user_list"]))
+                groups.add(
+                    (
+                        PageProjectAggregate,
+                        field["on_user_list"],
+                        field["page_title"],
+                        field["domain"],
+                    )
+                )
+                groups.add((UserAggregate, field["on_user_list"], field["user_id"]))
+            plan.add(collection_id, events=len(fields), groups=len(groups))
+
+        for model in (PageProjectAggregate, UserAggregate, LinkAggregate):
+            existing = model.objects.filter(
+                collection_id__in=collection_ids,
+                full_date=last_day_of_month,
+                day=0,
+            ).values_list("collection_id", flat=True)
+            for collection_id in existing.iterator():
+                plan.add(collection_id, existing=1)
+
+        plan.write(self.stdout)
 
     def _fill_monthly_aggregate(
-        self, url_pattern, last_day_of_month, organisation, url_patterns, link_events
+        self, collection, last_day_of_month, organisation, link_events
     ):
         """
-        This function fills monthly LinkAggregates for an organisation and a parsed JSON object(LinkEvent).
+        This function fills monthly LinkAggregates for a collection and its parsed JSON objects(LinkEvent).
         Parameters
         ----------
-        url_pattern :  str
+        collection :  Collection
 
         last_day_of_month :  date
 
         organisation :  Organisation
 
-        url_patterns :  An array of url patterns
-
-        link_events :  an array of link event JSON objects
+        link_events :  an array of the collection's link event JSON objects
 
         Returns
         -------
         None
         """
-        # find the collection associated with this url
-        collection = url_patterns.filter(url=url_pattern).first().collection
         self._process_monthly_events(
             True, link_events, collection, organisation, last_day_of_month
         )
@@ -512,29 +677,48 @@ class Command(BaseCommand):
         # set of user ids to fill user aggregates for
         users = list(set([i["fields"]["user_id"] for i in events]))
         try:
-            for page_project in page_projects:
-                self._fill_monthly_page_project_aggregates(collection, events, last_day_of_month, on_user_list_flag,
-                                                           page_project)
-            for user in users:
+            PageProjectAggregate.objects.bulk_upsert(
+                self._fill_monthly_page_project_aggregates(
+                    collection,
+                    events,
+                    last_day_of_month,
+                    on_user_list_flag,
+                    page_project,
+                )
+                for page_project in page_projects
+            )
+            user_aggregates = [
                 self._fill_monthly_user_aggregates(
                     collection, last_day_of_month, link_events, on_user_list_flag, user
                 )
-            self._fill_monthly_link_aggregates(
-                collection,
-                last_day_of_month,
-                on_user_list_flag,
-                organisation,
-                total_added,
-                total_removed,
+                for user in users
+            ]
+            UserAggregate.objects.bulk_upsert(
+                aggregate for aggregate in user_aggregates if aggregate is not None
+            )
+            LinkAggregate.objects.bulk_upsert(
+                [
+                    self._fill_monthly_link_aggregates(
+                        collection,
+                        last_day_of_month,
+                        on_user_list_flag,
+                        organisation,
+                        total_added,
+                        total_removed,
+                    )
+                ]
+            )
+        except Exception:
+            logger.exception(
+                "Unable to save the monthly aggregates of collection %s", collection.pk
             )
-        except Exception as e:
-            print(e)
+            raise
 
 
     def _fill_monthly_page_project_aggregates(self, collection, events, last_day_of_month, on_user_list_flag,
                                               page_project):
         """
-        This function updates or creates monthly PageProjectAggregate for collection and a parsed array of JSON(LinkEvents).
+        This function returns the monthly PageProjectAggregate to upsert for collection and a parsed array of JSON(LinkEvents).
         Parameters
         ----------
         collection :  Collection
@@ -549,7 +733,7 @@ class Command(BaseCommand):
 
         Returns
         -------
-        None
+        PageProjectAggregate
         """
         events_for_page_project = [
             i
@@ -559,31 +743,17 @@ class Command(BaseCommand):
         ]
         total_added_page_project = sum(1 for i in events_for_page_project if i["fields"]["change"] == 1)
         total_removed_page_project = sum(1 for i in events_for_page_project if i["fields"]["change"] == 0)
-        existing_page_project_aggregate = PageProjectAggregate.objects.filter(
+        return PageProjectAggregate(
             organisation=collection.organisation,
             collection=collection,
             page_name=page_project[0],
             project_name=page_project[1],
-            day=0,
             full_date=last_day_of_month,
+            day=0,
+            total_links_added=total_added_page_project,
+            total_links_removed=total_removed_page_project,
             on_user_list=on_user_list_flag,
-        ).first()
-        if existing_page_project_aggregate:
-            existing_page_project_aggregate.total_links_added = total_added_page_project
-            existing_page_project_aggregate.total_links_removed = total_removed_page_project
-            existing_page_project_aggregate.save()
-        else:
-            PageProjectAggregate.objects.get_or_create(
-                organisation=collection.organisation,
-                collection=collection,
-                page_name=page_project[0],
-                project_name=page_project[1],
-                full_date=last_day_of_month,
-                day=0,
-                total_links_added=total_added_page_project,
-                total_links_removed=total_removed_page_project,
-                on_user_list=on_user_list_flag,
-            )
+        )
 
     def _fill_monthly_link_aggregates(
         self,
@@ -595,7 +765,7 @@ class Command(BaseCommand):
         total_removed,
     ):
         """
-        This function updates or creates monthly LinkAggregate for collection.
+        This function returns the monthly LinkAggregate to upsert for collection.
         Parameters
         ----------
         collection :  Collection
@@ -612,35 +782,23 @@ class Command(BaseCommand):
 
         Returns
         -------
-        None
+        LinkAggregate
         """
-        existing_link_aggregate = LinkAggregate.objects.filter(
+        return LinkAggregate(
             organisation_id=organisation.id,
             collection_id=collection.id,
             on_user_list=on_user_list_flag,
             full_date=last_day_of_month,
             day=0,
+            total_links_added=total_added,
+            total_links_removed=total_removed,
         )
-        if existing_link_aggregate.exists():
-            existing_link_aggregate.update(
-                total_links_added=total_added,
-                total_links_removed=total_removed,
-            )
-        else:
-            LinkAggregate.objects.create(
-                organisation_id=organisation.id,
-                collection_id=collection.id,
-                on_user_list=on_user_list_flag,
-                full_date=last_day_of_month,
-                day=0,
-                total_links_added=total_added,
-                total_links_removed=total_removed,
-            )
+
     def _fill_monthly_user_aggregates(
         self, collection, last_day_of_month, link_events, on_user_list_flag, user
     ):
         """
-         This function updates or creates monthly UserAggregate for user and collection.
+         This function returns the monthly UserAggregate to upsert for user and collection.
          Parameters
          ----------
          collection :  Collection
@@ -655,12 +813,12 @@ class Command(BaseCommand):
 
          Returns
          -------
-         None
+         UserAggregate|None
          """
         try:
             user_retrieved = User.objects.get(pk=user)
         except User.DoesNotExist:
-            return
+            return None
         events_for_user = [i for i in link_events if i["fields"]["user_id"] is user]
         total_added_by_user = sum(
             1 for i in events_for_user if i["fields"]["change"] == 1
@@ -668,33 +826,16 @@ class Command(BaseCommand):
         total_removed_by_user = sum(
             1 for i in events_for_user if i["fields"]["change"] == 0
         )
-        exisiting_user_aggregate = (
-            UserAggregate.objects.filter(
-                organisation_id=collection.organisation.id,
-                collection_id=collection.id,
-                username=user_retrieved.username,
-                full_date=last_day_of_month,
-                day=0,
-                on_user_list=on_user_list_flag,
-            )
-            .first()
+        return UserAggregate(
+            organisation_id=collection.organisation.id,
+            collection_id=collection.id,
+            username=user_retrieved.username,
+            full_date=last_day_of_month,
+            day=0,
+            total_links_added=total_added_by_user,
+            total_links_removed=total_removed_by_user,
+            on_user_list=on_user_list_flag,
         )
-        if exisiting_user_aggregate:
-            exisiting_user_aggregate.total_links_added = total_added_by_user
-            exisiting_user_aggregate.total_links_removed = total_removed_by_user
-            exisiting_user_aggregate.save()
-        else:
-            # Create a new link aggregate
-            UserAggregate.objects.create(
-                organisation_id=collection.organisation.id,
-                collection_id=collection.id,
-                username=user_retrieved.username,
-                full_date=last_day_of_month,
-                day=0,
-                total_links_added=total_added_by_user,
-                total_links_removed=total_removed_by_user,
-                on_user_list=on_user_list_flag,
-            )
 
     def _get_link_events_for_day(
         self, collection_url: str, events_split_by_url_pattern, day: int
@@ -750,7 +891,7 @@ class Command(BaseCommand):
     def _load_events_from_archives(
         self, directory: object, month_to_fix: str, url_pattern_strings
     ) -> object:
-        """Parse archived .json.gz files and split the link events by URL pattern.
+        """Parse archived .json.gz and .columnar.gz files and split the link events by URL pattern.
         Parameters
         ----------
         directory :  str
@@ -766,15 +907,14 @@ class Command(BaseCommand):
         events_split_by_url_pattern = {url: [] for url in url_pattern_strings}
         for filename in os.listdir(directory):
             if (
-                filename.endswith(".json.gz")
+                is_archive_name(filename)
                 and filename.startswith("links_linkevent_")
                 and month_to_fix in filename
             ):
                 try:
                     file_path = os.path.join(directory, filename)
                     with gzip.open(file_path, "rt", encoding="utf-8") as f:
-                        data = json.load(f)
-                        for event in data:
+                        for event in iter_records(f, fields=ARCHIVED_EVENT_FIELDS):
                             link = event["fields"]["link"]
                             for url_pattern in url_pattern_strings:
                                 if url_pattern in link:
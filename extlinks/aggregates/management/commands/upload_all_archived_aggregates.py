@@ -1,5 +1,6 @@
 import os
 
+from extlinks.common.columnar import is_archive_name
 from extlinks.common.management.commands import BaseCommand
 from django.core.management import call_command
 
@@ -19,7 +20,7 @@ class Command(BaseCommand):
         path = options["dir"]
         container = options["container"]
         for filename in os.listdir(path):
-            if filename.endswith(".json.gz") and filename.startswith("aggregates_"):
+            if is_archive_name(filename) and filename.startswith("aggregates_"):
                 file_path = os.path.join(path, filename)
                 if os.path.isfile(file_path):
                     call_command(
@@ -14,6 +14,16 @@ from extlinks.aggregates.models import (
 from extlinks.aggregates.management.helpers.aggregate_archive_command import (
     AggregateArchiveCommand,
 )
+from extlinks.aggregates.management.helpers.daily_aggregate_command import (
+    DailyAggregateCommand,
+)
+from extlinks.aggregates.management.helpers.monthly_aggregate_command import (
+    MonthlyAggregateCommand,
+)
+from extlinks.aggregates.management.helpers.top_totals_command import (
+    TopTotalsCommand,
+)
+from extlinks.aggregates.management.helpers.workers import run_in_workers
 
 
 def decode_archive(filename: str):
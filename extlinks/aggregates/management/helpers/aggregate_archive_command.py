@@ -1,19 +1,34 @@
 import datetime
 import gzip
+import json
 import logging
 import os
+import re
 
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from dateutil.relativedelta import relativedelta
-from typing import List, Optional, Type, cast
+from typing import List, Optional, Tuple, Type, cast
 
 from django.core import serializers
-from django.core.management import call_command
 from django.core.management.base import CommandError, CommandParser
 from django.db import models, close_old_connections
 
+from extlinks.aggregates.sketches import HyperLogLog
+from extlinks.aggregates.storage import (
+    get_archive_pattern,
+    get_sketch_name,
+    get_totals_name,
+    summarise_totals,
+)
 from extlinks.common import swift
+from extlinks.common.columnar import (
+    ARCHIVE_FORMATS,
+    ARCHIVE_SUFFIXES,
+    iter_records,
+    load_archive,
+    write_columnar,
+)
 from extlinks.common.management.commands import BaseCommand
 
 logger = logging.getLogger("django")
@@ -34,6 +49,12 @@ class AggregateArchiveCommand(ABC, BaseCommand):
 
     help = "Dump & delete or load data from aggregate tables"
     name = "aggregate"
+    # The field whose distinct values are sketched alongside each uploaded
+    # archive, if any.
+    sketch_field: Optional[str] = None
+    # The fields the totals uploaded alongside each archive are grouped by,
+    # in addition to the overall total.
+    totals_fields: Tuple[str, ...] = ()
 
     def log_msg(self, msg, *args, level="info"):
         """
@@ -108,10 +129,16 @@ class AggregateArchiveCommand(ABC, BaseCommand):
             action="store_true",
             help="If enabled, archives will only be stored in Swift and deleted from local storage after upload.",
         )
+        dump_parser.add_argument(
+            "--format",
+            choices=ARCHIVE_FORMATS,
+            default="json",
+            help=f"The format {self.name} archives are written in. Archives in either format can be loaded.",
+        )
 
         load_parser = subparsers.add_parser(
             "load",
-            help=f"Import {self.name} data into the database from gzipped JSON files.",
+            help=f"Import {self.name} data into the database from gzipped JSON or columnar files.",
         )
         load_parser.add_argument(
             "filenames",
@@ -148,6 +175,7 @@ class AggregateArchiveCommand(ABC, BaseCommand):
                 output=options["output"],
                 container=options["container"],
                 object_storage_only=options["object_storage_only"],
+                archive_format=options["format"],
             )
         elif subcommand == "load":
             self.load(filenames=options["filenames"])
@@ -163,10 +191,11 @@ class AggregateArchiveCommand(ABC, BaseCommand):
         output: Optional[str] = None,
         container: Optional[str] = None,
         object_storage_only=False,
+        archive_format="json",
     ):
         """
-        Dump aggregate data to gzipped JSON files that are grouped by month,
-        and then delete them from the database.
+        Dump aggregate data to gzipped JSON or columnar files that are grouped
+        by month, and then delete them from the database.
 
         Parameters
         ----------
@@ -185,6 +214,9 @@ class AggregateArchiveCommand(ABC, BaseCommand):
         object_storage_only : bool, optional
             If enabled, archives will only be stored in Swift and deleted from
             local storage after upload.
+
+        archive_format : str, optional
+            One of ARCHIVE_FORMATS, defaults to 'json'.
         """
 
         # Pick the earliest possible date if one is not provided on the CLI.
@@ -213,7 +245,9 @@ class AggregateArchiveCommand(ABC, BaseCommand):
             cursor = start
 
             while cursor <= end:
-                archives = self.archive(cursor, output=output)
+                archives = self.archive(
+                    cursor, output=output, archive_format=archive_format
+                )
                 cursor += relativedelta(months=1)
 
                 # Upload archives to object storage if a container was specified.
@@ -223,7 +257,9 @@ class AggregateArchiveCommand(ABC, BaseCommand):
                     if object_storage_only:
                         self._remove_archives(archives)
         else:
-            archives = self.archive(start, output=output)
+            archives = self.archive(
+                start, output=output, archive_format=archive_format
+            )
 
             # Upload archives to object storage if a container was specified.
             if container and len(archives) > 0:
@@ -246,7 +282,7 @@ class AggregateArchiveCommand(ABC, BaseCommand):
 
     def load(self, filenames: List[str]):
         """
-        Import data from gzipped JSON files.
+        Import data from gzipped JSON or columnar files.
 
         Parameters
         ----------
@@ -260,9 +296,7 @@ class AggregateArchiveCommand(ABC, BaseCommand):
 
         for filename in sorted(filenames):
             self.log_msg("Loading %s...", filename)
-
-            # loaddata supports gzipped fixtures and handles relationships properly.
-            call_command("loaddata", filename)
+            load_archive(filename)
 
     def upload(self, container: str, filenames: List[str]):
         """
@@ -308,6 +342,11 @@ class AggregateArchiveCommand(ABC, BaseCommand):
                 len(filenames),
             )
 
+            sidecar_archives = self.get_sidecar_archives(successful)
+            if self.sketch_field:
+                self.upload_sketches(conn, container, sidecar_archives)
+            self.upload_totals(conn, container, sidecar_archives)
+
             if len(failed) > 0:
                 raise CommandError(
                     f"The following {failed} archives failed to upload: {','.join(failed)}"
@@ -316,10 +355,101 @@ class AggregateArchiveCommand(ABC, BaseCommand):
             self.log_msg(f"Failed to upload to Swift: {e}", level="error")
             return False
 
+    def upload_sketches(self, conn, container: str, filenames: List[str]):
+        """
+        Upload a sketch of the distinct values of sketch_field next to each
+        of the given archives, so distinct counts don't need to download them.
+
+        Parameters
+        ----------
+        conn : swiftclient.Connection
+            A connection to the Swift object storage.
+
+        container : str
+            The name of the Swift container to upload to.
+
+        filenames : List[str]
+            The paths of the uploaded archives.
+        """
+
+        for filename in filenames:
+            with gzip.open(filename, "rt", encoding="utf-8") as archive:
+                sketch = HyperLogLog.from_values(
+                    record["fields"][self.sketch_field]
+                    for record in iter_records(archive, fields=[self.sketch_field])
+                )
+
+            conn.put_object(
+                container,
+                get_sketch_name(os.path.basename(filename)),
+                contents=sketch.to_bytes(),
+                content_type="application/octet-stream",
+            )
+
+        self.log_msg("Uploaded %d sketches to object storage", len(filenames))
+
+    def upload_totals(self, conn, container: str, filenames: List[str]):
+        """
+        Upload the totals of each of the given archives, overall and grouped
+        by totals_fields, next to it, so views which only need the totals
+        don't need to download the archives.
+
+        Parameters
+        ----------
+        conn : swiftclient.Connection
+            A connection to the Swift object storage.
+
+        container : str
+            The name of the Swift container to upload to.
+
+        filenames : List[str]
+            The paths of the uploaded archives.
+        """
+
+        fields = [
+            *self.totals_fields,
+            "full_date",
+            "total_links_added",
+            "total_links_removed",
+        ]
+        for filename in filenames:
+            with gzip.open(filename, "rt", encoding="utf-8") as archive:
+                totals = summarise_totals(
+                    (
+                        record["fields"]
+                        for record in iter_records(archive, fields=fields)
+                    ),
+                    self.totals_fields,
+                )
+
+            conn.put_object(
+                container,
+                get_totals_name(os.path.basename(filename)),
+                contents=json.dumps(totals),
+                content_type="application/json",
+            )
+
+        self.log_msg("Uploaded %d totals to object storage", len(filenames))
+
+    def get_sidecar_archives(self, filenames: List[str]) -> List[str]:
+        """
+        Returns the given archives which can have sketches and totals
+        uploaded alongside them: archives of this command's model, named the
+        way storage.find_archives expects.
+        """
+
+        pattern = get_archive_pattern(f"aggregates_{self.name.lower()}")
+        return [
+            filename
+            for filename in filenames
+            if re.search(pattern, os.path.basename(filename))
+        ]
+
     def archive(
         self,
         date: datetime.date,
         output: Optional[str] = None,
+        archive_format="json",
     ) -> List[str]:
         """
         Archives a month's worth of data defined by 'date' and returns a list
@@ -333,6 +463,9 @@ class AggregateArchiveCommand(ABC, BaseCommand):
         output : str, optional
             The directory to output the archives to. If not provided, the
             archives will be output to $HOST_BACKUP_DIR.
+
+        archive_format : str, optional
+            One of ARCHIVE_FORMATS, defaults to 'json'.
         """
 
         AggregateModel = self.get_model()
@@ -379,7 +512,8 @@ class AggregateArchiveCommand(ABC, BaseCommand):
             params = "_".join(map(lambda x: str(x), k))
             filename = os.path.join(
                 output_dir,
-                f"aggregates_{self.name.lower()}_{params}.json.gz",
+                f"aggregates_{self.name.lower()}_{params}"
+                + ARCHIVE_SUFFIXES[archive_format],
             )
             self.log_msg(
                 "Dumping %d %s records into %s",
@@ -389,7 +523,10 @@ class AggregateArchiveCommand(ABC, BaseCommand):
             )
             # Serialize the records directly in the writer to conserve memory.
             with gzip.open(filename, "wt", encoding="utf-8") as archive:
-                archive.write(serializers.serialize("json", v))
+                if archive_format == "columnar":
+                    write_columnar(archive, serializers.serialize("python", v))
+                else:
+                    archive.write(serializers.serialize("json", v))
             archives.append(filename)
 
         return archives
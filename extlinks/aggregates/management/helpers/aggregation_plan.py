@@ -0,0 +1,87 @@
+import datetime
+
+from collections import defaultdict
+from typing import Optional
+
+from extlinks.aggregates.models import AggregationRun
+
+
+def get_command_name(command) -> str:
+    """
+    Returns the name a management command is run by, which its runs are
+    recorded under in AggregationRun.
+    """
+    return type(command).__module__.rsplit(".", 1)[-1]
+
+
+class AggregationPlan:
+    """
+    AggregationPlan collects what an aggregation command would do for each
+    collection, for the commands' --plan option, which reports it instead
+    of writing anything.
+
+    For each collection it counts the events which would be read, the
+    aggregate rows they would be grouped into and how many of those rows
+    already exist and would be updated. The runtime is estimated from the
+    throughput of the command's recorded runs (AggregationRun).
+    """
+
+    def __init__(self, command: str, unit: str = "events"):
+        self.command = command
+        # What the command reads, e.g. LinkEvents or daily aggregates.
+        self.unit = unit
+        self.collections = defaultdict(lambda: [0, 0, 0])
+
+    def add(self, collection_id: int, events=0, groups=0, existing=0):
+        counts = self.collections[collection_id]
+        counts[0] += events
+        counts[1] += groups
+        counts[2] += existing
+
+    @property
+    def events(self) -> int:
+        return sum(counts[0] for counts in self.collections.values())
+
+    def estimate(self, workers=1) -> Optional[datetime.timedelta]:
+        """
+        Returns the estimated runtime of the plan split between the given
+        number of processes, or None if the command has no recorded runs.
+        """
+        throughput = AggregationRun.objects.throughput(self.command)
+        if throughput is None:
+            return None
+        return datetime.timedelta(seconds=round(self.events / throughput / workers))
+
+    def write(self, stdout, workers=1):
+        """
+        Writes the plan as a table with a row per collection, followed by
+        the totals and the estimated runtime.
+        """
+        rows = [("Collection", self.unit.capitalize(), "Groups", "Existing rows")]
+        rows += [
+            (str(collection_id), *map(str, counts))
+            for collection_id, counts in sorted(self.collections.items())
+        ]
+        rows.append(
+            (
+                "Total",
+                *(
+                    str(sum(column))
+                    for column in zip(*self.collections.values(), (0, 0, 0))
+                ),
+            )
+        )
+        widths = [max(len(row[index]) for row in rows) for index in range(4)]
+        for row in rows:
+            stdout.write(
+                "  ".join(
+                    value.ljust(width) if index == 0 else value.rjust(width)
+                    for index, (value, width) in enumerate(zip(row, widths))
+                )
+            )
+
+        estimate = self.estimate(workers)
+        if estimate is None:
+            stdout.write(f"No recorded runs of {self.command} to estimate a runtime from")
+        else:
+            stdout.write(f"Estimated runtime: {estimate}")
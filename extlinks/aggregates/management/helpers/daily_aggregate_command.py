@@ -0,0 +1,671 @@
+import logging
+import time
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence, Type
+
+from django.core.management.base import CommandError
+from django.db import close_old_connections, models, transaction
+from django.db.models import Count, Max, Min, Q
+from django.db.models.fields import DateField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from extlinks.aggregates.models import (
+    AggregateCheckpoint,
+    AggregationRun,
+    LinkAggregate,
+    PageProjectAggregate,
+    UserAggregate,
+)
+from extlinks.common.management.commands import BaseCommand
+from extlinks.links.models import LinkEvent, StreamCheckpoint
+from extlinks.organisations.models import Collection
+
+from .aggregation_plan import AggregationPlan, get_command_name
+from .workers import COLLECTIONS_PER_CHUNK, run_in_workers
+
+logger = logging.getLogger("django")
+
+# How long the collectors' transactions may take to commit. LinkEvent ids
+# are allocated on insert, so a lower id may commit after a higher one is
+# already visible, for up to this long.
+COMMIT_GRACE_SECONDS = 60
+COMMIT_POLL_SECONDS = 1
+
+# The fields which identify a daily aggregate besides its organisation,
+# collection, full_date and on_user_list, mapped to the LinkEvent values
+# they are grouped by. They must match the model's unique constraint, which
+# the monthly aggregation (monthly_aggregate_command.py) groups by.
+AGGREGATE_KEY_FIELDS = {
+    LinkAggregate: {},
+    UserAggregate: {"username": "username__username"},
+    PageProjectAggregate: {"project_name": "domain", "page_name": "page_title"},
+}
+
+
+class DailyAggregateCommand(BaseCommand):
+    """
+    DailyAggregateCommand is a helper class for the commands filling the
+    daily aggregate tables from LinkEvents.
+
+    New LinkEvents are read in a single grouped query for every collection
+    at once, and the daily rows of every table in 'aggregate_models' are
+    derived from the same results, then upserted in bulk.
+
+    Each table's AggregateCheckpoint records the last LinkEvent counted in
+    it, so a run only counts the LinkEvents added since and adds them to
+    the existing rows, once any LinkEvents still being written before the
+    latest one have committed. Tables without a checkpoint, and single
+    collections passed with --collections, are recounted from their latest
+    aggregated date instead. Recounts can be split between --workers
+    processes, and hold the checkpoints' lock while they replace each chunk
+    of collections' rows, so they can't overwrite LinkEvents added by
+    follow_daily_aggregates meanwhile.
+
+    --plan reports the LinkEvents each collection would have counted, and
+    the aggregates they would be saved to, without writing anything.
+    """
+
+    aggregate_models: Sequence[Type[models.Model]] = (
+        LinkAggregate,
+        UserAggregate,
+        PageProjectAggregate,
+    )
+    workers = 1
+
+    def add_arguments(self, parser):
+        # Named (optional) arguments
+        parser.add_argument(
+            "--collections",
+            nargs="+",
+            type=int,
+            help="A list of collection IDs that will be processed instead of every collection",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes to split collections between when recounting them",
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="Report the link events, aggregates and estimated runtime of each collection without writing anything",
+        )
+
+    def _handle(self, *args, **options):
+        self.workers = options["workers"]
+        last_link_event_id = self._get_last_link_event_id()
+        if last_link_event_id is None:
+            logger.info("No link events to aggregate.")
+            return
+
+        if options["collections"]:
+            collections = []
+            for col_id in options["collections"]:
+                collection = Collection.objects.filter(
+                    pk=col_id, organisation__isnull=False
+                ).first()
+                if collection is None:
+                    raise CommandError(f"Collection '{col_id}' does not exist")
+                collections.append(collection)
+            if options["plan"]:
+                self._plan(collections, last_link_event_id)
+            else:
+                self._recount_collections(collections, last_link_event_id)
+        elif options["plan"]:
+            self._plan(None, last_link_event_id)
+        else:
+            self._wait_for_commits(last_link_event_id)
+            self._aggregate_new_link_events(last_link_event_id)
+
+        close_old_connections()
+
+    def _recount_collections(self, collections, last_link_event_id):
+        """
+        Recounts the given collections from their latest aggregated date,
+        up to each table's checkpoint. LinkEvents after the checkpoint are
+        left for the next incremental run to add.
+
+        Parameters
+        ----------
+        collections : List[Collection]
+            The collections to recount.
+
+        last_link_event_id : int
+            The id of the last LinkEvent to count in tables which have no
+            checkpoint.
+
+        Returns
+        -------
+        None
+        """
+
+        def get_filters(chunk, checkpoints):
+            for collection in chunk:
+                for link_event_filter, aggregate_models in self._get_recount_filters(
+                    collection, checkpoints, last_link_event_id
+                ):
+                    yield link_event_filter, [collection], aggregate_models
+
+        self._recount(collections, get_filters)
+
+    def _recount(self, collections, get_filters):
+        """
+        Replaces the daily aggregates of the given collections with a
+        recount, a chunk of collections at a time, split between the
+        --workers processes.
+
+        Each chunk is recounted in a transaction holding the lock of the
+        checkpoints, up to the locked checkpoints. LinkEvents added by
+        follow_daily_aggregates, which moves the checkpoints, are then
+        either part of the recount or added after it, rather than
+        overwritten by it.
+
+        Parameters
+        ----------
+        collections : List[Collection]
+            The collections to recount.
+
+        get_filters : Callable
+            Called with a chunk of collections and the locked checkpoints,
+            as returned by _get_checkpoints. Yields the LinkEvent filter,
+            collections and aggregate tables of each recount.
+
+        Returns
+        -------
+        None
+        """
+
+        def recount(share):
+            for start in range(0, len(share), COLLECTIONS_PER_CHUNK):
+                chunk = share[start : start + COLLECTIONS_PER_CHUNK]
+                with transaction.atomic():
+                    checkpoints = self._get_checkpoints(lock=True)
+                    for link_event_filter, chunk_collections, aggregate_models in (
+                        get_filters(chunk, checkpoints)
+                    ):
+                        self._process_collections(
+                            link_event_filter, chunk_collections, aggregate_models
+                        )
+
+        run_in_workers(recount, collections, self.workers)
+
+    def _get_recount_filters(self, collection, checkpoints, last_link_event_id):
+        """
+        Yields the LinkEvent filter recounting a collection in each group of
+        aggregate tables sharing a checkpoint, with the group's tables.
+        """
+        for checkpoint, aggregate_models in checkpoints.items():
+            yield self._get_linkevent_filter(aggregate_models, collection) & Q(
+                pk__lte=checkpoint or last_link_event_id
+            ), aggregate_models
+
+    def _plan(self, collections, last_link_event_id):
+        """
+        Writes what recounting the given collections, or adding the new
+        LinkEvents of every collection if collections is None, would do.
+
+        Parameters
+        ----------
+        collections : List[Collection]|None
+            The collections passed with --collections.
+
+        last_link_event_id : int
+            The id of the last LinkEvent to count.
+
+        Returns
+        -------
+        None
+        """
+        plan = AggregationPlan(get_command_name(self))
+        checkpoints = self._get_checkpoints()
+
+        if collections is not None:
+            for collection in collections:
+                for link_event_filter, aggregate_models in self._get_recount_filters(
+                    collection, checkpoints, last_link_event_id
+                ):
+                    self._plan_collections(
+                        plan, link_event_filter, [collection], aggregate_models
+                    )
+        else:
+            collections = list(Collection.objects.exclude(organisation__isnull=True))
+            for checkpoint, aggregate_models in checkpoints.items():
+                if checkpoint is None:
+                    link_event_filter = self._get_linkevent_filter(
+                        aggregate_models
+                    ) & Q(pk__lte=last_link_event_id)
+                elif checkpoint < last_link_event_id:
+                    link_event_filter = Q(
+                        pk__gt=checkpoint, pk__lte=last_link_event_id
+                    )
+                else:
+                    continue
+                self._plan_collections(
+                    plan, link_event_filter, collections, aggregate_models
+                )
+
+        plan.write(self.stdout, self.workers)
+
+    def _plan_collections(
+        self, plan, link_event_filter, collections, aggregate_models
+    ):
+        """
+        Adds the LinkEvents of the given collections matching
+        link_event_filter to plan, with the daily aggregates they would be
+        saved to and how many of those already exist.
+        """
+        keys = defaultdict(set)
+        for row in self._count_link_events(
+            link_event_filter, collections, aggregate_models
+        ):
+            plan.add(
+                row["collection_id"], events=row["links_added"] + row["links_removed"]
+            )
+            for model, key in self._get_keys(row, aggregate_models):
+                keys[row["collection_id"], model].add(key)
+
+        for (collection_id, model), model_keys in keys.items():
+            dates = [key[2] for key in model_keys]
+            existing = (
+                model.objects.filter(
+                    collection_id=collection_id,
+                    full_date__gte=min(dates),
+                    full_date__lte=max(dates),
+                )
+                .values_list(*self._get_key_fields(model))
+                .order_by()
+            )
+            plan.add(
+                collection_id,
+                groups=len(model_keys),
+                existing=sum(1 for key in existing.iterator() if key in model_keys),
+            )
+
+    @staticmethod
+    def _get_last_link_event_id():
+        return LinkEvent.objects.aggregate(Max("pk"))["pk__max"]
+
+    def _wait_for_commits(self, last_link_event_id):
+        """
+        Waits for LinkEvents up to last_link_event_id which may still be
+        being written to commit, so moving the checkpoints to it can't skip
+        them. follow_daily_aggregates instead only counts up to the id seen
+        on its previous pass.
+
+        A LinkEvent which hasn't committed leaves a gap in the ids after
+        the checkpoints, so there is nothing to wait for if there is none.
+        Gaps are also left by LinkEvents which were never written, though,
+        so rather than waiting for them to fill, this waits for each
+        collector which wrote recently to commit its StreamCheckpoint
+        again: LinkEventWriter saves it in the transaction writing the
+        LinkEvents, one transaction at a time, so anything it was writing
+        when last_link_event_id was read has committed by then.
+
+        Parameters
+        ----------
+        last_link_event_id : int
+            The id of the last LinkEvent to count.
+
+        Returns
+        -------
+        None
+        """
+        if not self._count_missing_link_events(last_link_event_id):
+            return
+
+        started = timezone.now()
+        deadline = time.monotonic() + COMMIT_GRACE_SECONDS
+        writing = StreamCheckpoint.objects.filter(
+            updated__gte=started - timedelta(seconds=COMMIT_GRACE_SECONDS),
+            updated__lte=started,
+        )
+        while writing.exists():
+            if time.monotonic() >= deadline:
+                logger.warning(
+                    "Collectors %s didn't commit within %ds, LinkEvents up to "
+                    "%d they were writing may be skipped",
+                    ", ".join(writing.values_list("stream", flat=True)),
+                    COMMIT_GRACE_SECONDS,
+                    last_link_event_id,
+                )
+                break
+            time.sleep(COMMIT_POLL_SECONDS)
+
+        missing = self._count_missing_link_events(last_link_event_id)
+        if missing:
+            logger.info(
+                "%d LinkEvent ids up to %d were never committed",
+                missing,
+                last_link_event_id,
+            )
+
+    def _count_missing_link_events(self, last_link_event_id):
+        """
+        Returns the number of ids after the lowest checkpoint, up to
+        last_link_event_id, with no LinkEvent.
+        """
+        checkpoints = self._get_checkpoints()
+        if None in checkpoints:
+            since = LinkEvent.objects.aggregate(Min("pk"))["pk__min"] - 1
+        else:
+            since = min(checkpoints)
+        if since >= last_link_event_id:
+            return 0
+
+        visible = LinkEvent.objects.filter(
+            pk__gt=since, pk__lte=last_link_event_id
+        ).count()
+        return last_link_event_id - since - visible
+
+    def _aggregate_new_link_events(self, last_link_event_id):
+        """
+        Adds the LinkEvents up to last_link_event_id which haven't been
+        counted yet to every table in aggregate_models, and moves their
+        checkpoints to last_link_event_id.
+
+        Tables without a checkpoint are given one at last_link_event_id,
+        then recounted up to it with _recount. The checkpoints are then
+        locked while adding new LinkEvents, so concurrent runs can't count
+        the same LinkEvents twice.
+
+        Parameters
+        ----------
+        last_link_event_id : int
+            The id of the last LinkEvent to count.
+
+        Returns
+        -------
+        None
+        """
+        if last_link_event_id is None:
+            return
+        collections = list(Collection.objects.exclude(organisation__isnull=True))
+
+        aggregate_models = self._get_checkpoints().get(None)
+        if aggregate_models:
+            link_event_filter = self._get_linkevent_filter(aggregate_models)
+            # The checkpoints are set before recounting, so LinkEvents after
+            # them can be added by follow_daily_aggregates meanwhile, and
+            # each chunk is recounted up to wherever they have moved to.
+            self._set_checkpoints(aggregate_models, last_link_event_id)
+
+            def get_filters(chunk, checkpoints):
+                for checkpoint, models in checkpoints.items():
+                    models = [model for model in models if model in aggregate_models]
+                    if models:
+                        yield link_event_filter & Q(pk__lte=checkpoint), chunk, models
+
+            self._recount(collections, get_filters)
+
+        with transaction.atomic():
+            for checkpoint, aggregate_models in self._get_checkpoints(
+                lock=True
+            ).items():
+                if checkpoint is None or checkpoint >= last_link_event_id:
+                    continue
+                link_event_filter = Q(pk__gt=checkpoint, pk__lte=last_link_event_id)
+
+                self._process_collections(
+                    link_event_filter, collections, aggregate_models, incremental=True
+                )
+                self._set_checkpoints(aggregate_models, last_link_event_id)
+
+    @staticmethod
+    def _set_checkpoints(aggregate_models, last_link_event_id):
+        for model in aggregate_models:
+            AggregateCheckpoint.objects.update_or_create(
+                aggregate=model.__name__,
+                defaults={"last_link_event_id": last_link_event_id},
+            )
+
+    def _get_checkpoints(self, lock=False):
+        """
+        Groups the aggregate tables by the id of the last LinkEvent counted
+        in them, which is None for tables which haven't been filled
+        incrementally yet.
+
+        Parameters
+        ----------
+        lock : bool
+            If True, the checkpoints are locked until the end of the
+            transaction.
+
+        Returns
+        -------
+        Dict[int|None, List[Type[models.Model]]]
+        """
+        checkpoints = AggregateCheckpoint.objects.filter(
+            aggregate__in=[model.__name__ for model in self.aggregate_models]
+        )
+        if lock:
+            checkpoints = checkpoints.select_for_update()
+        last_ids = dict(checkpoints.values_list("aggregate", "last_link_event_id"))
+        grouped = defaultdict(list)
+        for model in self.aggregate_models:
+            grouped[last_ids.get(model.__name__)].append(model)
+        return grouped
+
+    def _get_linkevent_filter(self, aggregate_models, collection=None):
+        """
+        This function checks if there is information in the aggregate tables
+        to see what filters it should apply to the link events further on in
+        the process. Every table is refreshed from the earliest of their
+        latest aggregated dates.
+
+        Parameters
+        ----------
+        aggregate_models : List[Type[models.Model]]
+            The aggregate tables being filled
+
+        collection : Collection|None
+            A collection to filter the aggregate tables. Is None by default
+
+        Returns
+        -------
+        Q object
+        """
+        if collection is not None:
+            aggregate_filter = Q(collection=collection)
+        else:
+            aggregate_filter = Q()
+
+        latest_dates = []
+        for model in aggregate_models:
+            latest_aggregate = (
+                model.objects.filter(aggregate_filter).order_by("full_date").last()
+            )
+            if latest_aggregate is None:
+                # There are no aggregates, getting all LinkEvents
+                return Q()
+            latest_dates.append(latest_aggregate.full_date)
+
+        earliest_date = min(latest_dates)
+        return Q(
+            timestamp__gte=datetime(
+                earliest_date.year, earliest_date.month, earliest_date.day
+            ),
+        )
+
+    def _process_collections(
+        self, link_event_filter, collections, aggregate_models, incremental=False
+    ):
+        """
+        This function counts the link events of the given collections matching
+        link_event_filter, and saves the daily aggregates for them.
+
+        Parameters
+        ----------
+        link_event_filter : Q
+            A Q query object to filter LinkEvents by.
+
+        collections: List[Collection]
+            The collections to aggregate link events for. They must all
+            belong to an organisation.
+
+        aggregate_models : List[Type[models.Model]]
+            The aggregate tables to fill.
+
+        incremental : bool
+            If True, the counts are added to the existing aggregates rather
+            than replacing them.
+
+        Returns
+        -------
+        None
+        """
+        started = timezone.now()
+        events = 0
+        totals = {model: defaultdict(lambda: [0, 0]) for model in aggregate_models}
+        for row in self._count_link_events(
+            link_event_filter, collections, aggregate_models
+        ):
+            events += row["links_added"] + row["links_removed"]
+            for model, key in self._get_keys(row, aggregate_models):
+                totals[model][key][0] += row["links_added"]
+                totals[model][key][1] += row["links_removed"]
+
+        for model in aggregate_models:
+            self._save_daily_aggregates(model, totals[model], incremental)
+
+        if events:
+            AggregationRun.objects.record(get_command_name(self), events, started)
+
+    @staticmethod
+    def _get_key_fields(model):
+        return [
+            "organisation_id",
+            "collection_id",
+            "full_date",
+            "on_user_list",
+            *AGGREGATE_KEY_FIELDS[model],
+        ]
+
+    @staticmethod
+    def _get_keys(row, aggregate_models):
+        """
+        Yields the aggregate tables a row of _count_link_events is counted
+        in, with the key of its daily aggregate, which holds the values of
+        the table's _get_key_fields.
+        """
+        base_key = (
+            row["organisation_id"],
+            row["collection_id"],
+            row["timestamp_date"],
+            row["on_user_list"],
+        )
+        for model in aggregate_models:
+            key = base_key + tuple(
+                row[value] for value in AGGREGATE_KEY_FIELDS[model].values()
+            )
+            if any(attr is None for attr in key):
+                continue
+            yield model, key
+
+    def _count_link_events(self, link_event_filter, collections, aggregate_models):
+        """
+        Counts the link events added and removed for each collection, day,
+        on_user_list value and every other field the aggregate tables are
+        keyed by, in one pass over LinkEvent.
+
+        URL patterns belong to collections through URLPattern.collections.
+        Collections which have none of those fall back to the patterns
+        pointing at them through URLPattern.collection.
+
+        Parameters
+        ----------
+        link_event_filter : Q
+            A Q query object to filter LinkEvents by.
+
+        collections: List[Collection]
+            The collections to count link events for.
+
+        aggregate_models : List[Type[models.Model]]
+            The aggregate tables whose key fields to count by.
+
+        Returns
+        -------
+        Iterator of dicts
+        """
+        organisations = {
+            collection.pk: collection.organisation_id for collection in collections
+        }
+        linked = set(
+            Collection.objects.filter(
+                pk__in=organisations, urlpatterns__isnull=False
+            ).values_list("pk", flat=True)
+        )
+        group_by = sorted(
+            {
+                value
+                for model in aggregate_models
+                for value in AGGREGATE_KEY_FIELDS[model].values()
+            }
+        )
+
+        for collection_field, collection_ids in (
+            ("url_pattern__collections", linked),
+            ("url_pattern__collection", set(organisations) - linked),
+        ):
+            if not collection_ids:
+                continue
+            rows = (
+                LinkEvent.objects.filter(link_event_filter)
+                .filter(**{collection_field + "__in": collection_ids})
+                .annotate(timestamp_date=Cast("timestamp", DateField()))
+                .values(collection_field, "timestamp_date", "on_user_list", *group_by)
+                .annotate(
+                    links_added=Count("pk", filter=Q(change=LinkEvent.ADDED)),
+                    links_removed=Count("pk", filter=Q(change=LinkEvent.REMOVED)),
+                )
+                .order_by()
+            )
+            for row in rows.iterator():
+                row["collection_id"] = row.pop(collection_field)
+                row["organisation_id"] = organisations[row["collection_id"]]
+                yield row
+
+    def _save_daily_aggregates(
+        self, model, totals: Dict[tuple, List[int]], incremental=False
+    ):
+        """
+        Upserts the daily aggregates, in bulk.
+
+        Parameters
+        ----------
+        model : Type[models.Model]
+            The aggregate table to save to.
+
+        totals : Dict[tuple, List[int]]
+            The links added and removed, keyed by organisation_id,
+            collection_id, full_date, on_user_list and the model's
+            AGGREGATE_KEY_FIELDS.
+
+        incremental : bool
+            If True, totals are added to the existing aggregates rather than
+            replacing them.
+
+        Returns
+        -------
+        None
+        """
+        if not totals:
+            return
+
+        key_fields = self._get_key_fields(model)
+        model.objects.bulk_upsert(
+            (
+                model(
+                    total_links_added=links_added,
+                    total_links_removed=links_removed,
+                    **dict(zip(key_fields, key)),
+                )
+                for key, (links_added, links_removed) in totals.items()
+            ),
+            increment=incremental,
+        )
+
+        logger.info("%s: saved %d daily aggregates", model.__name__, len(totals))
@@ -0,0 +1,234 @@
+import calendar
+import logging
+
+from datetime import date, timedelta
+from typing import Type
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import CommandError
+from django.db import close_old_connections, models, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from extlinks.aggregates.models import AggregationRun
+from extlinks.common.management.commands import BaseCommand
+
+from .aggregation_plan import AggregationPlan, get_command_name
+from .workers import run_in_workers
+
+logger = logging.getLogger("django")
+
+
+class MonthlyAggregateCommand(BaseCommand):
+    """
+    MonthlyAggregateCommand is a helper class for the commands compacting
+    the daily rows of an aggregate table into monthly (day=0) rows.
+
+    A month is rolled up with one INSERT ... SELECT ... GROUP BY adding the
+    daily totals to the monthly rows, and one DELETE of the daily rows, in
+    a single transaction which is rolled back unless every daily row
+    counted was deleted.
+
+    --plan reports the daily rows of each collection which would be rolled
+    up, and the monthly rows they would be saved to, without writing
+    anything.
+    """
+
+    aggregate_model: Type[models.Model]
+
+    def add_arguments(self, parser):
+        # Option to filter by specific collection(s)
+        parser.add_argument(
+            "--collections",
+            nargs="+",
+            type=int,
+            help="A list of collection IDs that will be processed instead of every collection",
+        )
+
+        # Option to filter by specific YYYY-MM
+        parser.add_argument(
+            "--year-month",
+            type=str,
+            help="A specific year-month (YYYY-MM) to aggregate data for. Example: '2024-01'",
+        )
+
+        # Option to split collections between processes
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes to split collections between",
+        )
+
+        # Option to report what would be aggregated without writing it
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="Report the daily aggregates, monthly aggregates and estimated runtime of each collection without writing anything",
+        )
+
+    def _handle(self, *args, **options):
+        """
+        Default execution of this job is to process all collections for
+        the oldest month.
+
+        Additional options are specified in `add_arguments` so you can
+        run by specific collection, year/month, or a full scan of the
+        historic data.
+        """
+        model_name = self.aggregate_model.__name__
+        logger.info(f"Monthly {model_name} job started")
+
+        if options["year_month"]:
+            try:
+                selected_year, selected_month = map(
+                    int, options["year_month"].split("-")
+                )
+                first_day_of_month = date(selected_year, selected_month, 1)
+                last_day_of_month = (
+                    first_day_of_month + relativedelta(months=1) - timedelta(days=1)
+                )
+            except ValueError:
+                raise CommandError(
+                    "Invalid format for --year-month. Use YYYY-MM (e.g., 2024-01)."
+                )
+        else:
+            today = date.today()
+            try:
+                oldest_agg = self.aggregate_model.objects.exclude(day=0).earliest(
+                    "full_date"
+                )
+            except self.aggregate_model.DoesNotExist:
+                logger.info("No data to process.")
+                return
+            oldest_date = oldest_agg.full_date
+            monthrange = calendar.monthrange(oldest_date.year, oldest_date.month)
+            first_day_of_month = oldest_date.replace(day=1)
+            last_day_of_month = oldest_date.replace(day=monthrange[1])
+            no_later_than_date = today - timedelta(days=10)
+            if last_day_of_month > no_later_than_date:
+                logger.info(
+                    f"No data within allowed date range: {no_later_than_date} falls within the month of {oldest_date}"
+                )
+                return
+
+        logger.info(f"Processing data from {first_day_of_month} to {last_day_of_month}")
+        month_filter = Q(
+            full_date__gte=first_day_of_month, full_date__lte=last_day_of_month
+        )
+
+        if options["collections"]:
+            month_filter &= Q(collection_id__in=options["collections"])
+
+        if options["plan"]:
+            self._plan(month_filter, options["workers"])
+            return
+
+        if options["workers"] > 1:
+            collection_ids = list(
+                self.aggregate_model.objects.filter(month_filter)
+                .exclude(day=0)
+                .values_list("collection_id", flat=True)
+                .distinct()
+                .order_by("collection_id")
+            )
+            run_in_workers(
+                lambda chunk: self._process_aggregation(
+                    Q(collection_id__in=chunk) & month_filter, last_day_of_month
+                ),
+                collection_ids,
+                options["workers"],
+            )
+        else:
+            self._process_aggregation(month_filter, last_day_of_month)
+
+        logger.info(f"Monthly {model_name} job ended")
+        close_old_connections()
+
+    def _process_aggregation(self, main_filter_query, last_day_of_month):
+        """
+        Rolls the daily aggregates matching main_filter_query up into
+        monthly aggregates, and deletes them.
+
+        Monthly aggregation sums total_links_added and total_links_removed
+        for the entire month for each group of the fields in the table's
+        unique constraint, which is the same granularity as the daily
+        aggregation (daily_aggregate_command.py).
+
+        Parameters
+        ---------
+        main_filter_query : Q
+            The daily aggregates of a single month to roll up.
+
+        last_day_of_month : date
+            The date of the monthly aggregates.
+
+        Returns
+        -------
+        None
+        """
+        started = timezone.now()
+        daily_aggregates = self.aggregate_model.objects.filter(
+            main_filter_query
+        ).exclude(day=0)
+
+        with transaction.atomic():
+            expected_delete_count = daily_aggregates.count()
+            if not expected_delete_count:
+                logger.info("No daily aggregations to process")
+                return
+
+            self.aggregate_model.objects.rollup_monthly(
+                daily_aggregates, last_day_of_month
+            )
+            deleted_count, _ = daily_aggregates.delete()
+
+            if deleted_count != expected_delete_count:
+                raise CommandError(
+                    f"Delete count mismatch: Expected to delete {expected_delete_count} records, "
+                    f"but actually deleted {deleted_count} - month ending {last_day_of_month}"
+                )
+
+        AggregationRun.objects.record(get_command_name(self), deleted_count, started)
+        logger.info(
+            f"Rolled up a total of {deleted_count} daily aggregations into month ending {last_day_of_month}"
+        )
+
+    def _plan(self, month_filter, workers):
+        """
+        Writes how many daily aggregates of each collection matching
+        month_filter would be rolled up, into how many monthly aggregates,
+        and how many of those already exist.
+
+        Parameters
+        ----------
+        month_filter : Q
+            The aggregates of a single month to plan for.
+
+        workers : int
+            The number of processes the roll up would be split between.
+
+        Returns
+        -------
+        None
+        """
+        plan = AggregationPlan(get_command_name(self), unit="daily aggregates")
+        aggregates = self.aggregate_model.objects.filter(month_filter).order_by()
+        daily_aggregates = aggregates.exclude(day=0)
+
+        for row in daily_aggregates.values("collection_id").annotate(
+            count=Count("pk")
+        ):
+            plan.add(row["collection_id"], events=row["count"])
+        for row in (
+            daily_aggregates.values(*self.aggregate_model.objects.monthly_group_by())
+            .distinct()
+            .iterator()
+        ):
+            plan.add(row["collection"], groups=1)
+        for row in (
+            aggregates.filter(day=0).values("collection_id").annotate(count=Count("pk"))
+        ):
+            plan.add(row["collection_id"], existing=row["count"])
+
+        plan.write(self.stdout, workers)
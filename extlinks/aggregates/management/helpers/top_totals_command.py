@@ -0,0 +1,199 @@
+import datetime
+import logging
+
+from collections import defaultdict
+from typing import Dict, Iterable, Set, Tuple, Type
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import CommandParser
+from django.db import models, transaction
+from django.db.models.aggregates import Sum
+from django.utils import timezone
+
+from extlinks.aggregates.models import ChangedAggregateMonth, last_day_of_month
+from extlinks.common.management.commands import BaseCommand
+from extlinks.organisations.models import Organisation
+
+logger = logging.getLogger("django")
+
+CHUNK_SIZE = 10_000
+
+
+class TopTotalsCommand(BaseCommand):
+    """
+    TopTotalsCommand is a helper class for the commands filling a program
+    totals table from the monthly sums of an aggregate table.
+
+    By default, only the months of programs whose organisations' aggregates
+    changed since the last run, as recorded in ChangedAggregateMonth, are
+    recomputed. --date recomputes every month from the given one instead.
+    Each program's month is replaced in a single transaction, so totals
+    which no longer exist are removed. Months without any aggregates left,
+    such as months whose aggregates have been archived, keep their totals.
+    """
+
+    # The aggregate table the totals are summed from.
+    aggregate_model: Type[models.Model]
+    # The program totals table.
+    total_model: Type[models.Model]
+    # The field both tables are grouped by besides on_user_list.
+    group_field: str
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "-d",
+            "--date",
+            nargs="?",
+            type=lambda arg: datetime.datetime.strptime(arg, "%Y-%m").date(),
+            help="A date formatted as YYYY-MM to recompute every month's totals from.",
+            required=False,
+        )
+
+    def _handle(self, *args, **options):
+        started = timezone.now()
+        changes = ChangedAggregateMonth.objects.filter(
+            aggregate=self.aggregate_model.__name__, changed_at__lte=started
+        )
+
+        if options["date"]:
+            changes = changes.filter(full_date__gte=options["date"])
+        changes = list(
+            changes.values_list("pk", "changed_at", "organisation_id", "full_date")
+        )
+
+        if options["date"]:
+            months = self._get_months_from(options["date"])
+        else:
+            months = self._get_changed_months(
+                (organisation_id, full_date)
+                for _, _, organisation_id, full_date in changes
+            )
+            if not months:
+                logger.info(
+                    "No %s changes to compute totals for",
+                    self.aggregate_model.__name__,
+                )
+
+        for program_id, full_date in sorted(months):
+            self.calculate_totals(program_id, full_date)
+
+        # Months changed while this ran are left for the next run.
+        ChangedAggregateMonth.objects.delete_read(
+            (pk, changed_at) for pk, changed_at, *_ in changes
+        )
+
+    @staticmethod
+    def _get_program_organisations() -> Dict[int, Set[int]]:
+        program_organisations = defaultdict(set)
+        memberships = Organisation.program.through.objects.values_list(
+            "program_id", "organisation_id"
+        )
+        for program_id, organisation_id in memberships:
+            program_organisations[program_id].add(organisation_id)
+        return program_organisations
+
+    def _get_months_from(
+        self, start: datetime.date
+    ) -> Set[Tuple[int, datetime.date]]:
+        """
+        Returns every program and month from start to the current month.
+        """
+        program_ids = list(self._get_program_organisations())
+        now = datetime.datetime.now(datetime.timezone.utc).date()
+        months = set()
+        full_date = last_day_of_month(start)
+        while full_date <= last_day_of_month(now):
+            months.update((program_id, full_date) for program_id in program_ids)
+            full_date = last_day_of_month(full_date + relativedelta(months=1))
+        return months
+
+    def _get_changed_months(
+        self, changes: Iterable[Tuple[int, datetime.date]]
+    ) -> Set[Tuple[int, datetime.date]]:
+        """
+        Returns the programs and months whose organisations' aggregates
+        changed.
+        """
+        organisation_programs = defaultdict(set)
+        program_organisations = self._get_program_organisations()
+        for program_id, organisation_ids in program_organisations.items():
+            for organisation_id in organisation_ids:
+                organisation_programs[organisation_id].add(program_id)
+
+        return {
+            (program_id, full_date)
+            for organisation_id, full_date in changes
+            for program_id in organisation_programs[organisation_id]
+        }
+
+    def calculate_totals(self, program_id: int, full_date: datetime.date):
+        """
+        Replaces a program's totals for a month with the sums of its
+        organisations' aggregates.
+
+        Parameters
+        ----------
+        program_id : int
+            The program to calculate totals for.
+
+        full_date : datetime.date
+            The last day of the month to calculate totals for. Totals are
+            dated with the last day of the month, so daily and monthly
+            aggregates of the month end up in the same totals.
+        """
+        first_day = full_date.replace(day=1)
+        aggregates = self.aggregate_model.objects.filter(
+            full_date__gte=first_day,
+            full_date__lte=full_date,
+            organisation__program=program_id,
+        )
+        # The totals of archived months can't be recomputed, and aren't
+        # archived themselves.
+        if not aggregates.exists():
+            logger.info(
+                "No %s left for program %d (%04d-%02d), keeping its totals",
+                self.aggregate_model.__name__,
+                program_id,
+                full_date.year,
+                full_date.month,
+            )
+            return
+
+        totals = (
+            aggregates.values(self.group_field, "on_user_list")
+            .annotate(
+                total_links_added=Sum("total_links_added"),
+                total_links_removed=Sum("total_links_removed"),
+            )
+            .order_by()
+        )
+
+        with transaction.atomic():
+            self.total_model.objects.filter(
+                program_id=program_id,
+                full_date__gte=first_day,
+                full_date__lte=full_date,
+            ).delete()
+            created = self.total_model.objects.bulk_create(
+                (
+                    self.total_model(
+                        program_id=program_id,
+                        full_date=full_date,
+                        on_user_list=total["on_user_list"],
+                        total_links_added=total["total_links_added"],
+                        total_links_removed=total["total_links_removed"],
+                        **{self.group_field: total[self.group_field]},
+                    )
+                    for total in totals.iterator()
+                ),
+                batch_size=CHUNK_SIZE,
+            )
+
+        logger.info(
+            "Saved %d %s for program %d (%04d-%02d)",
+            len(created),
+            self.total_model.__name__,
+            program_id,
+            full_date.year,
+            full_date.month,
+        )
@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import queue
+
+from typing import Callable, List, Sequence
+
+from django.core.cache import caches
+from django.core.management.base import CommandError
+from django.db import connections
+
+logger = logging.getLogger("django")
+
+# Number of collections a worker aggregates between reporting progress.
+COLLECTIONS_PER_CHUNK = 10
+
+
+def split_collections(collections: Sequence, workers: int) -> List[list]:
+    """
+    Deals the collections out between the workers, so collections which
+    are next to each other (and usually of a similar size) end up in
+    different workers. Workers left without collections are dropped.
+    """
+    shares = [list(collections[index::workers]) for index in range(workers)]
+    return [share for share in shares if share]
+
+
+def run_in_workers(
+    aggregate: Callable[[list], None], collections: Sequence, workers: int = 1
+):
+    """
+    Calls aggregate with every collection, splitting the collections
+    between the given number of forked processes which each open their own
+    database connection. Progress is reported back to, and logged by, the
+    calling process.
+
+    Parameters
+    ----------
+    aggregate : callable
+        Aggregates the list of collections (or collection ids) it is
+        called with. With more than one worker it runs in the worker
+        processes, so it must not rely on an open transaction.
+
+    collections : Sequence
+        The collections, or collection ids, to aggregate.
+
+    workers : int
+        The number of processes to run. With one, aggregate is simply
+        called with every collection.
+
+    Returns
+    -------
+    None
+    """
+    shares = split_collections(collections, workers)
+    if len(shares) <= 1:
+        aggregate(list(collections))
+        return
+
+    context = multiprocessing.get_context("fork")
+    # Forked workers must open their own database and cache connections.
+    connections.close_all()
+    caches.close_all()
+
+    progress = context.Queue()
+    processes = [
+        context.Process(
+            target=_aggregate_share,
+            args=(aggregate, share, progress),
+            name="aggregates-{}".format(index),
+        )
+        for index, share in enumerate(shares)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(
+        "Started %d aggregation workers for %d collections",
+        len(processes),
+        len(collections),
+    )
+
+    done = 0
+    try:
+        while any(process.is_alive() for process in processes) or not progress.empty():
+            try:
+                done += progress.get(timeout=1)
+            except queue.Empty:
+                continue
+            logger.info("Aggregated %d/%d collections", done, len(collections))
+    finally:
+        for process in processes:
+            process.join()
+
+    exit_codes = [process.exitcode for process in processes]
+    if any(exit_codes):
+        raise CommandError(
+            "Aggregation workers stopped with exit codes {}".format(exit_codes)
+        )
+
+
+def _aggregate_share(aggregate, share, progress):
+    try:
+        for start in range(0, len(share), COLLECTIONS_PER_CHUNK):
+            chunk = share[start : start + COLLECTIONS_PER_CHUNK]
+            aggregate(chunk)
+            progress.put(len(chunk))
+    finally:
+        connections.close_all()
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aggregates', '0012_programtopuserstotal_programtopprojectstotal_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregateCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aggregate', models.CharField(max_length=64, unique=True)),
+                ('last_link_event_id', models.PositiveBigIntegerField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
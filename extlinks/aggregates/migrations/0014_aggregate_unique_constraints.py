@@ -0,0 +1,82 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+AGGREGATE_KEYS = {
+    "LinkAggregate": [],
+    "UserAggregate": ["username"],
+    "PageProjectAggregate": ["project_name", "page_name"],
+}
+
+
+def delete_duplicate_aggregates(apps, schema_editor):
+    """
+    Keeps the most recently created aggregate for every combination of
+    fields the unique constraints are added for.
+    """
+    for model_name, keys in AGGREGATE_KEYS.items():
+        Aggregate = apps.get_model("aggregates", model_name)
+        fields = [
+            "organisation_id",
+            "collection_id",
+            *keys,
+            "full_date",
+            "on_user_list",
+            "day",
+        ]
+        duplicates = (
+            Aggregate.objects.values(*fields)
+            .annotate(count=Count("id"), last_id=Max("id"))
+            .filter(count__gt=1)
+            .order_by()
+        )
+        for duplicate in duplicates.iterator():
+            Aggregate.objects.filter(
+                **{field: duplicate[field] for field in fields}
+            ).exclude(id=duplicate["last_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("aggregates", "0013_aggregatecheckpoint"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_aggregates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="linkaggregate",
+            constraint=models.UniqueConstraint(
+                fields=("organisation", "collection", "full_date", "on_user_list", "day"),
+                name="unique_linkaggregate",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="pageprojectaggregate",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "organisation",
+                    "collection",
+                    "project_name",
+                    "page_name",
+                    "full_date",
+                    "on_user_list",
+                    "day",
+                ),
+                name="unique_pageprojectaggregate",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="useraggregate",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "organisation",
+                    "collection",
+                    "username",
+                    "full_date",
+                    "on_user_list",
+                    "day",
+                ),
+                name="unique_useraggregate",
+            ),
+        ),
+    ]
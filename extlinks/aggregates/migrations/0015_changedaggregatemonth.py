@@ -0,0 +1,68 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:02
+
+import calendar
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+AGGREGATE_MODELS = ("LinkAggregate", "UserAggregate", "PageProjectAggregate")
+BATCH_SIZE = 1000
+
+
+def mark_existing_months(apps, schema_editor):
+    """
+    Marks every month already in the aggregate tables as changed, so the
+    first runs of the program totals commands, which only recompute changed
+    months, compute them all.
+    """
+    ChangedAggregateMonth = apps.get_model("aggregates", "ChangedAggregateMonth")
+    changed_at = timezone.now()
+    for model_name in AGGREGATE_MODELS:
+        Aggregate = apps.get_model("aggregates", model_name)
+        months = (
+            Aggregate.objects.values_list("organisation_id", "year", "month")
+            .distinct()
+            .order_by()
+        )
+        ChangedAggregateMonth.objects.bulk_create(
+            (
+                ChangedAggregateMonth(
+                    aggregate=model_name,
+                    organisation_id=organisation_id,
+                    full_date=datetime.date(
+                        year, month, calendar.monthrange(year, month)[1]
+                    ),
+                    changed_at=changed_at,
+                )
+                for organisation_id, year, month in months.iterator()
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisations', '0009_organisation_username_list_updated'),
+        ('aggregates', '0014_aggregate_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangedAggregateMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aggregate', models.CharField(max_length=64)),
+                ('full_date', models.DateField()),
+                ('changed_at', models.DateTimeField()),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='organisations.organisation')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='changedaggregatemonth',
+            constraint=models.UniqueConstraint(fields=('aggregate', 'organisation', 'full_date'), name='unique_changedaggregatemonth'),
+        ),
+        migrations.RunPython(mark_existing_months, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisations', '0009_organisation_username_list_updated'),
+        ('aggregates', '0015_changedaggregatemonth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionMonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('full_date', models.DateField()),
+                ('on_user_list', models.BooleanField(default=False)),
+                ('total_links_added', models.PositiveIntegerField()),
+                ('total_links_removed', models.PositiveIntegerField()),
+                ('editors', models.BinaryField()),
+                ('projects', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='organisations.collection')),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='organisations.organisation')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='collectionmonthlysummary',
+            constraint=models.UniqueConstraint(fields=('collection', 'full_date', 'on_user_list'), name='unique_collectionmonthlysummary'),
+        ),
+    ]
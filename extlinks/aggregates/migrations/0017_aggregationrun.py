@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aggregates', '0016_collectionmonthlysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(db_index=True, max_length=64)),
+                ('events', models.PositiveBigIntegerField()),
+                ('seconds', models.FloatField()),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
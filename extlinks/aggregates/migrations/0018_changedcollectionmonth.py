@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisations', '0009_organisation_username_list_updated'),
+        ('aggregates', '0017_aggregationrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangedCollectionMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aggregate', models.CharField(max_length=64)),
+                ('full_date', models.DateField()),
+                ('changed_at', models.DateTimeField()),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='organisations.collection')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='changedcollectionmonth',
+            constraint=models.UniqueConstraint(fields=('aggregate', 'collection', 'full_date'), name='unique_changedcollectionmonth'),
+        ),
+    ]
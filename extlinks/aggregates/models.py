@@ -1,13 +1,237 @@
-from django.db import models
-from django.core.exceptions import ValidationError
+import calendar
+import datetime
 
+from collections import defaultdict
+
+from django.db import connections, models, router, transaction
+from django.db.models import Sum, Value
+from django.utils import timezone
+
+from extlinks.common.helpers import batch_iterator, extract_queryset_filter
 from extlinks.organisations.models import Collection, Organisation, User
 from extlinks.programs.models import Program
 
+from .sketches import HyperLogLog
+
+
+BATCH_SIZE = 1000
+
+
+class AggregateManager(models.Manager):
+    """
+    Manager for the aggregate tables, whose rows are unique per the fields
+    of the model's UniqueConstraint.
+    """
+
+    def _unique_fields(self):
+        for constraint in self.model._meta.constraints:
+            if isinstance(constraint, models.UniqueConstraint):
+                return list(constraint.fields)
+
+    def bulk_upsert(self, objs, increment=False, batch_size=BATCH_SIZE):
+        """
+        Inserts the given aggregates in batches, updating the totals of the
+        existing rows they conflict with instead. Rows aren't validated one
+        by one like save() does. The months changed are recorded in
+        ChangedAggregateMonth and ChangedCollectionMonth.
+
+        Parameters
+        ----------
+        objs : Iterable[models.Model]
+            Unsaved aggregates.
+
+        increment : bool
+            If True, the totals are added to those of the existing rows
+            rather than replacing them.
+
+        batch_size : int
+            The number of rows written per statement.
+
+        Returns
+        -------
+        None
+        """
+        objs = list(objs)
+        for obj in objs:
+            obj.set_date_fields()
+
+        connection = connections[router.db_for_write(self.model)]
+        update_fields = ["total_links_added", "total_links_removed", "updated_at"]
+        if not increment:
+            self.bulk_create(
+                objs,
+                batch_size=batch_size,
+                update_conflicts=True,
+                update_fields=update_fields,
+                unique_fields=(
+                    self._unique_fields()
+                    if connection.features.supports_update_conflicts_with_target
+                    else None
+                ),
+            )
+        else:
+            fields, upsert = self._increment_sql(connection)
+            qn = connection.ops.quote_name
+            table = qn(self.model._meta.db_table)
+            columns = ", ".join(qn(field.column) for field in fields)
+            placeholders = "({})".format(", ".join(["%s"] * len(fields)))
+
+            with connection.cursor() as cursor:
+                for start in range(0, len(objs), batch_size):
+                    batch = objs[start : start + batch_size]
+                    params = [
+                        field.get_db_prep_save(
+                            field.pre_save(obj, add=True), connection
+                        )
+                        for obj in batch
+                        for field in fields
+                    ]
+                    cursor.execute(
+                        "INSERT INTO {} ({}) VALUES {} {}".format(
+                            table,
+                            columns,
+                            ", ".join([placeholders] * len(batch)),
+                            upsert,
+                        ),
+                        params,
+                    )
+
+        self._record_changes(objs)
+
+    def _record_changes(self, objs):
+        """
+        Marks the months of the given aggregates as changed, for the program
+        totals and the collections' monthly summaries to be recomputed.
+        """
+        ChangedAggregateMonth.objects.mark(
+            self.model, ((obj.organisation_id, obj.full_date) for obj in objs)
+        )
+        ChangedCollectionMonth.objects.mark(
+            self.model, ((obj.collection_id, obj.full_date) for obj in objs)
+        )
+
+    def monthly_group_by(self):
+        """
+        Returns the fields the daily aggregates of a month are grouped by
+        when rolled up into monthly aggregates.
+        """
+        return [
+            name for name in self._unique_fields() if name not in ("full_date", "day")
+        ]
+
+    def rollup_monthly(self, daily_aggregates, full_date):
+        """
+        Adds the totals of the given daily aggregates to the monthly
+        aggregates dated full_date, in a single INSERT ... SELECT ...
+        GROUP BY. The daily aggregates are left in place.
 
-class LinkAggregate(models.Model):
+        Parameters
+        ----------
+        daily_aggregates : QuerySet
+            The daily aggregates of a single month to roll up.
+
+        full_date : date
+            The last day of the month.
+
+        Returns
+        -------
+        None
+        """
+        connection = connections[daily_aggregates.db]
+        _, upsert = self._increment_sql(connection)
+        group_by = self.monthly_group_by()
+        values = {
+            "full_date": Value(full_date, output_field=models.DateField()),
+            "day": Value(0),
+            "month": Value(full_date.month),
+            "year": Value(full_date.year),
+            "total_links_added": Sum("total_links_added"),
+            "total_links_removed": Sum("total_links_removed"),
+            "created_at": Value(timezone.now(), output_field=models.DateTimeField()),
+            "updated_at": Value(timezone.now(), output_field=models.DateTimeField()),
+        }
+        monthly = (
+            daily_aggregates.order_by()
+            .values(*group_by)
+            # Annotations can't share the name of a model field.
+            .annotate(**{"monthly_" + name: value for name, value in values.items()})
+        )
+        sql, params = monthly.query.sql_with_params()
+
+        qn = connection.ops.quote_name
+        columns = [self.model._meta.get_field(name).column for name in group_by]
+        columns += [self.model._meta.get_field(name).column for name in values]
+        with connection.cursor() as cursor:
+            # The WHERE clause tells SQLite the ON CONFLICT isn't a join.
+            cursor.execute(
+                "INSERT INTO {} ({}) SELECT * FROM ({}) monthly WHERE 1 = 1 {}".format(
+                    qn(self.model._meta.db_table),
+                    ", ".join(qn(column) for column in columns),
+                    sql,
+                    upsert,
+                ),
+                params,
+            )
+
+    def _increment_sql(self, connection):
+        """
+        Returns the concrete fields to insert, and the clause adding the
+        totals of inserted rows to those of the existing rows they conflict
+        with.
+        """
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        fields = [field for field in opts.concrete_fields if not field.primary_key]
+        table = qn(opts.db_table)
+        if connection.vendor == "mysql":
+            conflict = "ON DUPLICATE KEY UPDATE"
+            new_value = "VALUES({})"
+        else:
+            conflict = "ON CONFLICT ({}) DO UPDATE SET".format(
+                ", ".join(
+                    qn(opts.get_field(name).column) for name in self._unique_fields()
+                )
+            )
+            new_value = "excluded.{}"
+        assignments = ", ".join(
+            "{column} = {table}.{column} + {value}".format(
+                column=qn(name), table=table, value=new_value.format(qn(name))
+            )
+            for name in ("total_links_added", "total_links_removed")
+        ) + ", {column} = {value}".format(
+            column=qn("updated_at"), value=new_value.format(qn("updated_at"))
+        )
+        return fields, "{} {}".format(conflict, assignments)
+
+
+class AggregateMixin:
+    def set_date_fields(self):
+        # day is 0 for monthly aggregates, dated the last day of the month.
+        if self.day is None or self.day != 0:
+            self.day = self.full_date.day
+        self.month = self.full_date.month
+        self.year = self.full_date.year
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        type(self).objects._record_changes([self])
+
+
+class LinkAggregate(AggregateMixin, models.Model):
     class Meta:
         app_label = "aggregates"
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    "organisation",
+                    "collection",
+                    "full_date",
+                    "on_user_list",
+                    "day",
+                ],
+                name="unique_linkaggregate",
+            )
+        ]
         indexes = [
             models.Index(fields=["full_date"]),
             models.Index(fields=["collection"]),
@@ -23,6 +247,7 @@ class LinkAggregate(models.Model):
             ),
         ]
 
+    objects = AggregateManager()
     organisation = models.ForeignKey(Organisation, on_delete=models.CASCADE)
     collection = models.ForeignKey(
         Collection, on_delete=models.CASCADE, blank=False, null=False
@@ -38,33 +263,28 @@ class LinkAggregate(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
-        if self.day is None or self.day != 0:
-            self.day = self.full_date.day
-        self.month = self.full_date.month
-        self.year = self.full_date.year
+        self.set_date_fields()
         if self.pk is None:
             self.full_clean(validate_unique=True)
         super().save(*args, **kwargs)
 
-    def validate_unique(self, *args, **kwargs):
-        super(LinkAggregate, self).validate_unique(*args, **kwargs)
-
-        if self.__class__.objects.filter(
-            organisation=self.organisation,
-            collection=self.collection,
-            full_date=self.full_date,
-            on_user_list=self.on_user_list,
-            day=self.day,  # day can be 0 if the aggregation is a monthly one
-        ).exists():
-            raise ValidationError(
-                message="LinkAggregate with this combination (organisation, collection, full_date, on_user_list) already exists.",
-                code="unique_together",
-            )
-
 
-class UserAggregate(models.Model):
+class UserAggregate(AggregateMixin, models.Model):
     class Meta:
         app_label = "aggregates"
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    "organisation",
+                    "collection",
+                    "username",
+                    "full_date",
+                    "on_user_list",
+                    "day",
+                ],
+                name="unique_useraggregate",
+            )
+        ]
         indexes = [
             models.Index(fields=["full_date"]),
             models.Index(fields=["collection"]),
@@ -83,6 +303,7 @@ class UserAggregate(models.Model):
             models.Index(fields=["collection", "username"]),
         ]
 
+    objects = AggregateManager()
     organisation = models.ForeignKey(Organisation, on_delete=models.CASCADE)
     collection = models.ForeignKey(
         Collection, on_delete=models.CASCADE, blank=False, null=False
@@ -99,34 +320,29 @@ class UserAggregate(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
-        if self.day is None or self.day != 0:
-            self.day = self.full_date.day
-        self.month = self.full_date.month
-        self.year = self.full_date.year
+        self.set_date_fields()
         if self.pk is None:
             self.full_clean(validate_unique=True)
         super().save(*args, **kwargs)
 
-    def validate_unique(self, *args, **kwargs):
-        super().validate_unique(*args, **kwargs)
-
-        if self.__class__.objects.filter(
-            organisation=self.organisation,
-            collection=self.collection,
-            username=self.username,
-            full_date=self.full_date,
-            on_user_list=self.on_user_list,
-            day=self.day,  # day can be 0 if the aggregation is a monthly one
-        ).exists():
-            raise ValidationError(
-                message="UserAggregate with this combination (organisation, collection, username, full_date, on_user_list) already exists.",
-                code="unique_together",
-            )
 
-
-class PageProjectAggregate(models.Model):
+class PageProjectAggregate(AggregateMixin, models.Model):
     class Meta:
         app_label = "aggregates"
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    "organisation",
+                    "collection",
+                    "project_name",
+                    "page_name",
+                    "full_date",
+                    "on_user_list",
+                    "day",
+                ],
+                name="unique_pageprojectaggregate",
+            )
+        ]
         indexes = [
             models.Index(fields=["full_date"]),
             models.Index(fields=["collection"]),
@@ -149,6 +365,7 @@ class PageProjectAggregate(models.Model):
             models.Index(fields=["collection", "project_name", "page_name"]),
         ]
 
+    objects = AggregateManager()
     organisation = models.ForeignKey(Organisation, on_delete=models.CASCADE)
     collection = models.ForeignKey(
         Collection, on_delete=models.CASCADE, blank=False, null=False
@@ -166,30 +383,469 @@ class PageProjectAggregate(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
-        if self.day is None or self.day != 0:
-            self.day = self.full_date.day
-        self.month = self.full_date.month
-        self.year = self.full_date.year
+        self.set_date_fields()
         if self.pk is None:
             self.full_clean(validate_unique=True)
         super().save(*args, **kwargs)
 
-    def validate_unique(self, *args, **kwargs):
-        super().validate_unique(*args, **kwargs)
-
-        if self.__class__.objects.filter(
-            organisation=self.organisation,
-            collection=self.collection,
-            project_name=self.project_name,
-            page_name=self.page_name,
-            full_date=self.full_date,
-            on_user_list=self.on_user_list,
-            day=self.day,  # day can be 0 if the aggregation is a monthly one
-        ).exists():
-            raise ValidationError(
-                message="PageProjectAggregate with this combination (organisation, collection, project_name, page_name, full_date, on_user_list) already exists.",
-                code="unique_together",
+
+class AggregateCheckpoint(models.Model):
+    """
+    The id of the last LinkEvent counted in an aggregate table's daily rows,
+    so the daily fill only has to count LinkEvents added since.
+    """
+
+    class Meta:
+        app_label = "aggregates"
+
+    aggregate = models.CharField(max_length=64, unique=True)
+    last_link_event_id = models.PositiveBigIntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.aggregate
+
+
+class AggregationRunManager(models.Manager):
+    # The number of runs of each command kept to measure throughput over.
+    RECENT_RUNS = 20
+
+    def record(self, command, events, started):
+        """
+        Records how many events a run of an aggregation command processed
+        since started, keeping the command's RECENT_RUNS latest runs.
+
+        Parameters
+        ----------
+        command : str
+            The name of the management command.
+
+        events : int
+            The number of LinkEvents, or daily aggregates for monthly roll
+            ups, processed.
+
+        started : datetime
+            When the run started.
+
+        Returns
+        -------
+        None
+        """
+        self.create(
+            command=command,
+            events=events,
+            seconds=(timezone.now() - started).total_seconds(),
+        )
+        stale = list(
+            self.filter(command=command)
+            .order_by("-finished_at", "-pk")
+            .values_list("pk", flat=True)[self.RECENT_RUNS :]
+        )
+        if stale:
+            self.filter(pk__in=stale).delete()
+
+    def throughput(self, command):
+        """
+        Returns the events processed per second over the recorded runs of
+        command, or None if there are none.
+        """
+        totals = self.filter(command=command).aggregate(
+            events=Sum("events"), seconds=Sum("seconds")
+        )
+        if not totals["events"] or not totals["seconds"]:
+            return None
+        return totals["events"] / totals["seconds"]
+
+
+class AggregationRun(models.Model):
+    """
+    The number of events a run of an aggregation command processed and how
+    long it took, which the commands' --plan option estimates runtimes from.
+    """
+
+    class Meta:
+        app_label = "aggregates"
+
+    objects = AggregationRunManager()
+    command = models.CharField(max_length=64, db_index=True)
+    events = models.PositiveBigIntegerField()
+    seconds = models.FloatField()
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.command
+
+
+class ChangedMonthManager(models.Manager):
+    def delete_read(self, changes):
+        """
+        Deletes the given changes, as they were read, once they have been
+        processed. Changes marked again since they were read have a later
+        changed_at and are kept for the next run.
+
+        Parameters
+        ----------
+        changes : Iterable[Tuple[int, datetime]]
+            The ids and changed_at values of the changes read.
+
+        Returns
+        -------
+        None
+        """
+        for batch in batch_iterator(changes, BATCH_SIZE):
+            query = models.Q()
+            for pk, changed_at in batch:
+                query |= models.Q(pk=pk, changed_at=changed_at)
+            self.filter(query).delete()
+
+
+class ChangedAggregateMonthManager(ChangedMonthManager):
+    def mark(self, aggregate_model, changes):
+        """
+        Records that the aggregates of the given organisations and months
+        changed.
+
+        Parameters
+        ----------
+        aggregate_model : Type[models.Model]
+            The aggregate table which changed.
+
+        changes : Iterable[Tuple[int, date]]
+            The organisation ids and dates of the changed aggregates.
+
+        Returns
+        -------
+        None
+        """
+        months = {
+            (organisation_id, last_day_of_month(full_date))
+            for organisation_id, full_date in changes
+        }
+        if not months:
+            return
+        connection = connections[router.db_for_write(self.model)]
+        changed_at = timezone.now()
+        self.bulk_create(
+            [
+                self.model(
+                    aggregate=aggregate_model.__name__,
+                    organisation_id=organisation_id,
+                    full_date=full_date,
+                    changed_at=changed_at,
+                )
+                for organisation_id, full_date in months
+            ],
+            update_conflicts=True,
+            update_fields=["changed_at"],
+            unique_fields=(
+                ["aggregate", "organisation", "full_date"]
+                if connection.features.supports_update_conflicts_with_target
+                else None
+            ),
+        )
+
+
+class ChangedAggregateMonth(models.Model):
+    """
+    A month of an organisation's rows in an aggregate table which changed
+    since the program totals were last computed from them.
+    """
+
+    class Meta:
+        app_label = "aggregates"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["aggregate", "organisation", "full_date"],
+                name="unique_changedaggregatemonth",
+            )
+        ]
+
+    objects = ChangedAggregateMonthManager()
+    aggregate = models.CharField(max_length=64)
+    organisation = models.ForeignKey(Organisation, on_delete=models.CASCADE)
+    # The last day of the month.
+    full_date = models.DateField()
+    changed_at = models.DateTimeField()
+
+
+class ChangedCollectionMonthManager(ChangedMonthManager):
+    def matching(self, queryset_filter, aggregate_model):
+        """
+        Returns the changes to aggregate_model not refreshed in the
+        summaries yet, of the months matching a filter built for the
+        aggregate tables by build_queryset_filters.
+        """
+        filters = get_monthly_filters(queryset_filter)
+        # Changes are recorded for both values of on_user_list.
+        filters.pop("on_user_list", None)
+        return self.filter(aggregate=aggregate_model.__name__, **filters)
+
+    def mark(self, aggregate_model, changes):
+        """
+        Records that the aggregates of the given collections and months
+        changed.
+
+        Parameters
+        ----------
+        aggregate_model : Type[models.Model]
+            The aggregate table which changed.
+
+        changes : Iterable[Tuple[int, date]]
+            The collection ids and dates of the changed aggregates.
+
+        Returns
+        -------
+        None
+        """
+        months = {
+            (collection_id, last_day_of_month(full_date))
+            for collection_id, full_date in changes
+        }
+        if not months:
+            return
+        connection = connections[router.db_for_write(self.model)]
+        changed_at = timezone.now()
+        self.bulk_create(
+            [
+                self.model(
+                    aggregate=aggregate_model.__name__,
+                    collection_id=collection_id,
+                    full_date=full_date,
+                    changed_at=changed_at,
+                )
+                for collection_id, full_date in months
+            ],
+            update_conflicts=True,
+            update_fields=["changed_at"],
+            unique_fields=(
+                ["aggregate", "collection", "full_date"]
+                if connection.features.supports_update_conflicts_with_target
+                else None
+            ),
+        )
+
+
+class ChangedCollectionMonth(models.Model):
+    """
+    A month of a collection's rows in an aggregate table which changed
+    since its CollectionMonthlySummary was last refreshed.
+    """
+
+    class Meta:
+        app_label = "aggregates"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["aggregate", "collection", "full_date"],
+                name="unique_changedcollectionmonth",
+            )
+        ]
+
+    objects = ChangedCollectionMonthManager()
+    aggregate = models.CharField(max_length=64)
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    # The last day of the month.
+    full_date = models.DateField()
+    changed_at = models.DateTimeField()
+
+
+class CollectionMonthlySummaryManager(models.Manager):
+    def refresh(self, changes, aggregate_models=None):
+        """
+        Recomputes the summaries of the given collections and months from
+        the aggregate tables.
+
+        Parameters
+        ----------
+        changes : Iterable[Tuple[int, date]]
+            The collection ids and dates of the changed aggregates.
+
+        aggregate_models : List[Type[models.Model]]|None
+            The aggregate tables to recompute the summaries' fields from.
+            The fields derived from the other tables are kept as they are.
+            Every table is read by default.
+
+        Returns
+        -------
+        None
+        """
+        if aggregate_models is None:
+            aggregate_models = list(SUMMARY_FIELDS)
+        update_fields = [
+            field for model in aggregate_models for field in SUMMARY_FIELDS[model]
+        ]
+
+        collections_by_month = defaultdict(set)
+        for collection_id, full_date in changes:
+            collections_by_month[last_day_of_month(full_date)].add(collection_id)
+
+        for full_date, collection_ids in collections_by_month.items():
+            month_filter = models.Q(
+                collection_id__in=collection_ids,
+                full_date__gte=full_date.replace(day=1),
+                full_date__lte=full_date,
+            )
+            summaries = {
+                (summary.collection_id, summary.on_user_list): summary
+                for summary in self.filter(
+                    collection_id__in=collection_ids, full_date=full_date
+                )
+            }
+            existing = set(summaries)
+            for summary in summaries.values():
+                summary.reset(update_fields)
+
+            def get_summary(collection_id, organisation_id, on_user_list):
+                key = (collection_id, on_user_list)
+                if key not in summaries:
+                    summaries[key] = self.model(
+                        organisation_id=organisation_id,
+                        collection_id=collection_id,
+                        full_date=full_date,
+                        on_user_list=on_user_list,
+                    )
+                    summaries[key].reset()
+                return summaries[key]
+
+            if LinkAggregate in aggregate_models:
+                link_totals = (
+                    LinkAggregate.objects.filter(month_filter)
+                    .values("collection_id", "organisation_id", "on_user_list")
+                    .annotate(
+                        links_added=Sum("total_links_added"),
+                        links_removed=Sum("total_links_removed"),
+                    )
+                    .order_by()
+                )
+                for total in link_totals:
+                    summary = get_summary(
+                        total["collection_id"],
+                        total["organisation_id"],
+                        total["on_user_list"],
+                    )
+                    summary.total_links_added = total["links_added"]
+                    summary.total_links_removed = total["links_removed"]
+
+            for model, field in (
+                (UserAggregate, "username"),
+                (PageProjectAggregate, "project_name"),
+            ):
+                if model not in aggregate_models:
+                    continue
+                (summary_field,) = SUMMARY_FIELDS[model]
+                sketches = defaultdict(HyperLogLog)
+                values = (
+                    model.objects.filter(month_filter)
+                    .values_list(
+                        "collection_id", "organisation_id", "on_user_list", field
+                    )
+                    .distinct()
+                    .order_by()
+                )
+                for collection_id, organisation_id, on_user_list, value in (
+                    values.iterator()
+                ):
+                    get_summary(collection_id, organisation_id, on_user_list)
+                    sketches[(collection_id, on_user_list)].add(value)
+                for key, sketch in sketches.items():
+                    setattr(summaries[key], summary_field, sketch.to_bytes())
+
+            connection = connections[router.db_for_write(self.model)]
+            with transaction.atomic(using=connection.alias):
+                self.bulk_update(
+                    [summaries[key] for key in existing], update_fields + ["updated_at"]
+                )
+                # Another process may have created the same summaries since.
+                self.bulk_create(
+                    [summaries[key] for key in summaries.keys() - existing],
+                    update_conflicts=True,
+                    update_fields=update_fields + ["updated_at"],
+                    unique_fields=(
+                        ["collection", "full_date", "on_user_list"]
+                        if connection.features.supports_update_conflicts_with_target
+                        else None
+                    ),
+                )
+
+    def matching(self, queryset_filter):
+        """
+        Returns the summaries matching a filter built for the aggregate
+        tables by build_queryset_filters. Summaries are monthly, so the
+        months overlapping the filter's date range are included.
+        """
+        return self.filter(**get_monthly_filters(queryset_filter))
+
+
+class CollectionMonthlySummary(models.Model):
+    """
+    The totals of a collection's aggregates for a month, and sketches of
+    its distinct editors and projects, so the organisation pages don't
+    need to read every aggregate. Refreshed by fill_collection_summaries
+    from the months recorded in ChangedCollectionMonth, and kept when the
+    aggregates are archived.
+    """
+
+    class Meta:
+        app_label = "aggregates"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["collection", "full_date", "on_user_list"],
+                name="unique_collectionmonthlysummary",
             )
+        ]
+
+    objects = CollectionMonthlySummaryManager()
+    organisation = models.ForeignKey(Organisation, on_delete=models.CASCADE)
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    # The last day of the month.
+    full_date = models.DateField()
+    on_user_list = models.BooleanField(default=False)
+    total_links_added = models.PositiveIntegerField()
+    total_links_removed = models.PositiveIntegerField()
+    # Serialized HyperLogLog sketches of the distinct usernames and
+    # project names.
+    editors = models.BinaryField()
+    projects = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def reset(self, fields=None):
+        """
+        Empties the given summary fields, or all of them.
+        """
+        if fields is None:
+            fields = [field for fs in SUMMARY_FIELDS.values() for field in fs]
+        for field in fields:
+            if field in ("editors", "projects"):
+                setattr(self, field, HyperLogLog().to_bytes())
+            else:
+                setattr(self, field, 0)
+
+
+# The CollectionMonthlySummary fields derived from each aggregate table.
+SUMMARY_FIELDS = {
+    LinkAggregate: ["total_links_added", "total_links_removed"],
+    UserAggregate: ["editors"],
+    PageProjectAggregate: ["projects"],
+}
+
+
+def get_monthly_filters(queryset_filter):
+    """
+    Returns the fields of a filter built for the aggregate tables by
+    build_queryset_filters, with its end date moved to the end of its
+    month, to filter the tables with a row per month.
+    """
+    filters = extract_queryset_filter(queryset_filter)
+    if "full_date__lte" in filters:
+        end_date = filters["full_date__lte"]
+        if isinstance(end_date, str):
+            end_date = datetime.date.fromisoformat(end_date)
+        filters["full_date__lte"] = last_day_of_month(end_date)
+    return filters
+
+
+def last_day_of_month(full_date):
+    _, last_day = calendar.monthrange(full_date.year, full_date.month)
+    return full_date.replace(day=last_day)
 
 
 class ProgramTopOrganisationsTotal(models.Model):
@@ -0,0 +1,85 @@
+import hashlib
+import math
+import zlib
+
+from typing import Iterable, Optional
+
+# 2 ** 12 registers give counts within about 1.6% of the real number.
+DEFAULT_PRECISION = 12
+
+
+class HyperLogLog:
+    """
+    A HyperLogLog sketch estimating the number of distinct values added to
+    it. Sketches can be merged, so the distinct count of several months is
+    the count of their merged sketches, and are small enough to store.
+    """
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = (
+            bytearray(registers)
+            if registers is not None
+            else bytearray(2**precision)
+        )
+
+    @classmethod
+    def from_values(cls, values: Iterable[str], precision: int = DEFAULT_PRECISION):
+        sketch = cls(precision)
+        sketch.update(values)
+        return sketch
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]):
+        """
+        Loads a sketch serialized with to_bytes. Empty data gives an empty
+        sketch.
+        """
+        if not data:
+            return cls()
+        data = bytes(data)
+        return cls(data[0], zlib.decompress(data[1:]))
+
+    def to_bytes(self) -> bytes:
+        # Registers of small sketches are mostly zero, so compress well.
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    def add(self, value: str):
+        hashed = int.from_bytes(
+            hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        index = hashed >> (64 - self.precision)
+        remaining = (hashed << self.precision) & 0xFFFFFFFFFFFFFFFF
+        # The position of the first set bit of the rest of the hash.
+        rank = min(64 - remaining.bit_length() + 1, 64 - self.precision + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[str]):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("Can't merge sketches of different precisions")
+        self.registers = bytearray(
+            max(mine, theirs) for mine, theirs in zip(self.registers, other.registers)
+        )
+
+    def count(self) -> int:
+        registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        estimate = (
+            alpha
+            * registers**2
+            / sum(2.0**-register for register in self.registers)
+        )
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * registers and zeros:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = registers * math.log(registers / zeros)
+        return round(estimate)
+
+    def __len__(self):
+        # Lets a sketch stand in for the set of values it was built from.
+        return self.count()
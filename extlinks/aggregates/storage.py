@@ -1,16 +1,33 @@
+import concurrent.futures
 import datetime
 import gzip
+import io
 import itertools
 import json
 import logging
 import os
 import re
 
-from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set
+from collections import deque
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 from django.core.cache import cache
 from django.db.models import Q
 
+from extlinks.aggregates.archive_cache import get_archive_cache
+from extlinks.aggregates.sketches import HyperLogLog
+from extlinks.common.columnar import ARCHIVE_SUFFIX_PATTERN, iter_records
 from extlinks.common.helpers import extract_queryset_filter
 from extlinks.common.swift import (
     batch_download_files,
@@ -21,6 +38,14 @@ from extlinks.common.swift import (
 logger = logging.getLogger("django")
 
 DEFAULT_EXPIRATION_SECS = 60 * 60
+# Memcached's default item size limit. Bigger archives are only cached on disk.
+MAX_CACHED_ARCHIVE_BYTES = 1024 * 1024
+# How many archives iter_archives downloads ahead of the one being read.
+ARCHIVE_PREFETCH = 4
+# Suffix of the sketches of distinct values uploaded alongside archives.
+SKETCH_SUFFIX = ".hll"
+# Suffix of the precomputed totals uploaded alongside archives.
+TOTALS_SUFFIX = ".totals.json"
 
 
 def get_archive_list(prefix: str, expiration=DEFAULT_EXPIRATION_SECS) -> List[Dict]:
@@ -49,10 +74,17 @@ def get_archive_list(prefix: str, expiration=DEFAULT_EXPIRATION_SECS) -> List[Di
 
 
 def get_archives(
-    archives: Iterable[str], expiration=DEFAULT_EXPIRATION_SECS
+    archives: Iterable[str],
+    expiration=DEFAULT_EXPIRATION_SECS,
+    hashes: Optional[Dict[str, str]] = None,
 ) -> Dict[str, bytes]:
     """
-    Retrieves the requested archives from objects storage or cache.
+    Retrieves the requested archives from cache, the disk cache (see
+    get_archive_cache) or object storage, in that order.
+
+    hashes maps archive names to their ETags in object storage, as listed by
+    get_archive_list. Archives on disk which don't match them are downloaded
+    again.
     """
 
     # Retrieve as many of the archives from cache as possible.
@@ -65,42 +97,130 @@ def get_archives(
         if archive not in result:
             missing.add(archive)
 
-    # Download and cache missing archives.
+    if len(missing) == 0:
+        return result
+
+    # Then from the disk cache, and download the rest.
+    archive_cache = get_archive_cache()
+    fetched = {}
+    if archive_cache:
+        fetched = archive_cache.get_many(missing, hashes)
+        missing -= fetched.keys()
+
     if len(missing) > 0:
         downloaded_archives = batch_download_files(
-            swift_connection(), os.environ.get("SWIFT_CONTAINER_AGGREGATES", "archive-aggregates"), archives
+            swift_connection(), os.environ.get("SWIFT_CONTAINER_AGGREGATES", "archive-aggregates"), missing
         )
-        cache.set_many(downloaded_archives, expiration)
-        result |= downloaded_archives
+        if archive_cache:
+            archive_cache.set_many(downloaded_archives, hashes)
+        fetched |= downloaded_archives
+
+    # Archives too big for memcached would only be rejected by it.
+    cache.set_many(
+        {
+            name: contents
+            for name, contents in fetched.items()
+            if len(contents) <= MAX_CACHED_ARCHIVE_BYTES
+        },
+        expiration,
+    )
+    result |= fetched
 
     return result
 
 
-def decode_archive(archive: bytes) -> List[Dict]:
+def iter_archives(
+    archives: Iterable[str], hashes: Optional[Dict[str, str]] = None
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Retrieves the requested archives like get_archives, in order, while
+    downloading up to ARCHIVE_PREFETCH of the following ones, so only those
+    and the archive being read are held in memory if the caller lets go of
+    each before the next.
+    """
+
+    archives = iter(archives)
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=ARCHIVE_PREFETCH
+    ) as executor:
+
+        def fetch(names):
+            return [
+                (name, executor.submit(get_archives, [name], hashes=hashes))
+                for name in names
+            ]
+
+        window = deque(fetch(itertools.islice(archives, ARCHIVE_PREFETCH)))
+        while window:
+            name, future = window.popleft()
+            contents = future.result().get(name)
+            window.extend(fetch(itertools.islice(archives, 1)))
+            if contents is not None:
+                yield name, contents
+
+
+def get_archive_hashes(prefix: str) -> Dict[str, str]:
     """
-    Decodes a gzipped archive into a list of dictionaries (row records).
+    Returns the ETags of the archives with the given prefix in object
+    storage, for get_archives to check the disk cache against.
+    """
+
+    return {
+        archive["name"]: archive.get("hash") for archive in get_archive_list(prefix)
+    }
+
+
+def iter_archive(
+    archive: bytes, fields: Optional[Iterable[str]] = None
+) -> Iterator[Dict]:
+    """
+    Decodes a gzipped JSON or columnar archive into dictionaries (row
+    records), yielding them as the archive is decompressed. Only the given
+    fields are decoded from columnar archives.
     """
     if archive is None or not isinstance(archive, (bytes, bytearray)):
-        return []
+        return
 
-    decompressed_archive = gzip.decompress(archive)
-    if decompressed_archive is None or not isinstance(decompressed_archive, str):
-        return []
+    with gzip.open(io.BytesIO(archive), "rt", encoding="utf-8") as decompressed:
+        yield from iter_records(decompressed, fields)
 
-    return json.loads(decompressed_archive)
 
+def decode_archive(archive: bytes, fields: Optional[Iterable[str]] = None) -> List[Dict]:
+    """
+    Decodes a gzipped JSON or columnar archive into a list of dictionaries
+    (row records). Only the given fields are decoded from columnar archives.
+    """
+    return list(iter_archive(archive, fields))
 
-def download_aggregates(
+
+def get_archive_pattern(prefix: str) -> str:
+    """
+    Returns the pattern of the names of archives with the given prefix, with
+    the organisation, collection, full_date and on_user_list as groups.
+    """
+
+    # The archive filenames use the following naming convention:
+    #
+    # {prefix}_{organisation}_{collection}_{full_date}_{on_user_list}.json.gz
+    #
+    # with a .columnar.gz suffix instead for columnar archives.
+    return (
+        rf"^{prefix}_([0-9]+)_([0-9]+)_([0-9]+-[0-9]{{2}}-[0-9]{{2}})_([01])"
+        + ARCHIVE_SUFFIX_PATTERN
+    )
+
+
+def find_archives(
     prefix: str,
     queryset_filter: Q,
     from_date: Optional[datetime.date] = None,
     to_date: Optional[datetime.date] = None,
 ) -> List[Dict]:
     """
-    Find and download archives needed to augment aggregate results from the DB.
+    Find the archives needed to augment aggregate results from the DB.
 
     This function tries its best to apply the passed in Django queryset to the
-    records it returns. This function supports filtering by collection, user
+    archives it returns. This function supports filtering by collection, user
     list, and date ranges.
     """
 
@@ -118,13 +238,8 @@ def download_aggregates(
         if isinstance(to_date, str):
             to_date = datetime.datetime.strptime(to_date, "%Y-%m-%d").date()
 
-    # We're only returning objects that match the following pattern. The
-    # archive filenames use the following naming convention:
-    #
-    # {prefix}_{organisation}_{collection}_{full_date}_{on_user_list}.json.gz
-    pattern = (
-        rf"^{prefix}_([0-9]+)_([0-9]+)_([0-9]+-[0-9]{{2}}-[0-9]{{2}})_([01])\.json\.gz$"
-    )
+    # We're only returning objects that follow the archive naming convention.
+    pattern = get_archive_pattern(prefix)
 
     # Identify archives that need to be downloaded from object storage
     # because they are not available in the database.
@@ -149,19 +264,168 @@ def download_aggregates(
 
         archives.append(archive)
 
+    return archives
+
+
+def download_aggregates(
+    prefix: str,
+    queryset_filter: Q,
+    from_date: Optional[datetime.date] = None,
+    to_date: Optional[datetime.date] = None,
+    totals_by: Optional[Sequence[str]] = None,
+) -> Iterator[Dict]:
+    """
+    Find and download archives needed to augment aggregate results from the DB.
+    See find_archives for the filters applied.
+
+    The records of the archives are yielded as each archive is decompressed,
+    so they should be consumed once, e.g. by calculate_totals.
+
+    If the records are only needed for their totals grouped by the fields in
+    totals_by, or overall if it's empty, the precomputed totals uploaded
+    alongside archives are yielded in place of the archives' records. Only
+    archives without usable totals are downloaded.
+    """
+
+    archives = find_archives(prefix, queryset_filter, from_date, to_date)
+
     # Bail out if there's nothing to download.
     if len(archives) == 0:
-        return []
+        return
+
+    archive_names = [archive["name"] for archive in archives]
+    hashes = get_archive_hashes(prefix)
+    if totals_by is not None:
+        totals_names = {
+            get_totals_name(name): name
+            for name in archive_names
+            if get_totals_name(name) in hashes
+        }
+        for totals_name, contents in get_archives(
+            totals_names, hashes=hashes
+        ).items():
+            records = get_totals_records(json.loads(contents), totals_by)
+            if records is not None:
+                archive_names.remove(totals_names[totals_name])
+                yield from records
+
+    # Download the archives from object storage and decompress them one at a
+    # time, letting go of each one once its records have been read.
+    for _, archive in iter_archives(archive_names, hashes=hashes):
+        for record in iter_archive(archive):
+            yield record["fields"]
+
+
+def get_sketch_name(archive_name: str) -> str:
+    """
+    Returns the name of the sketch uploaded alongside an archive.
+    """
 
-    # Download and decompress the archives from object storage.
-    unflattened_records = (
-        (record["fields"] for record in decode_archive(contents))
-        for contents in get_archives(archive["name"] for archive in archives).values()
-    )
+    return re.sub(ARCHIVE_SUFFIX_PATTERN, SKETCH_SUFFIX, archive_name)
+
+
+def get_totals_name(archive_name: str) -> str:
+    """
+    Returns the name of the precomputed totals uploaded alongside an archive.
+    """
+
+    return re.sub(ARCHIVE_SUFFIX_PATTERN, TOTALS_SUFFIX, archive_name)
+
+
+def summarise_totals(records: Iterable[Dict], group_by: Sequence[str]) -> Dict:
+    """
+    Precomputes the totals of the records of an archive, overall and grouped
+    by the given fields, for download_aggregates to use in place of the
+    archive.
+
+    Parameters
+    ----------
+    records : Iterable[Dict]
+        The fields of the archive's records.
+
+    group_by : Sequence[str]
+        The fields to group the totals by.
+    """
+
+    total = {"total_links_added": 0, "total_links_removed": 0}
+    groups = {}
+    for record in records:
+        total.setdefault("full_date", record["full_date"])
+        total["total_links_added"] += record["total_links_added"]
+        total["total_links_removed"] += record["total_links_removed"]
+
+        key = tuple(record[field] for field in group_by)
+        if key not in groups:
+            groups[key] = {field: record[field] for field in group_by}
+            groups[key].update(
+                full_date=record["full_date"],
+                total_links_added=0,
+                total_links_removed=0,
+            )
+        groups[key]["total_links_added"] += record["total_links_added"]
+        groups[key]["total_links_removed"] += record["total_links_removed"]
+
+    return {
+        "group_by": list(group_by),
+        "total": total,
+        "groups": list(groups.values()),
+    }
+
+
+def get_totals_records(
+    totals: Dict, totals_by: Sequence[str]
+) -> Optional[List[Dict]]:
+    """
+    Returns the records of precomputed totals which can be used in place of
+    an archive's records for totals grouped by totals_by, or None if the
+    archive's totals weren't grouped by those fields.
+    """
+
+    if not totals_by:
+        # Archives without records have no overall total either.
+        return [totals["total"]] if totals["groups"] else []
+    if set(totals_by) <= set(totals["group_by"]):
+        return totals["groups"]
+    return None
+
+
+def download_sketch(
+    prefix: str,
+    queryset_filter: Q,
+    field: str,
+    from_date: Optional[datetime.date] = None,
+    to_date: Optional[datetime.date] = None,
+) -> HyperLogLog:
+    """
+    Merges the sketches of the distinct values of field in the archives
+    matching the filters. Archives which were uploaded without a sketch are
+    downloaded, and their values added to it instead.
+    """
+
+    sketch = HyperLogLog()
+    archives = find_archives(prefix, queryset_filter, from_date, to_date)
+    if len(archives) == 0:
+        return sketch
+
+    hashes = get_archive_hashes(prefix)
+    sketch_names = []
+    unsketched = []
+    for archive in archives:
+        sketch_name = get_sketch_name(archive["name"])
+        if sketch_name in hashes:
+            sketch_names.append(sketch_name)
+        else:
+            unsketched.append(archive["name"])
+
+    # Sketches are small, so they're downloaded together.
+    for contents in get_archives(sketch_names, hashes=hashes).values():
+        sketch.merge(HyperLogLog.from_bytes(contents))
+    for _, contents in iter_archives(unsketched, hashes=hashes):
+        sketch.update(
+            record["fields"][field] for record in iter_archive(contents, [field])
+        )
 
-    # Each archive has its own records and are grouped together in a
-    # two-dimensional array. Merge them all together.
-    return list(itertools.chain(*unflattened_records))
+    return sketch
 
 
 def calculate_totals(
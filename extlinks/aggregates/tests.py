@@ -1,3 +1,5 @@
+import hashlib
+import io
 import os
 import shutil
 import tempfile
@@ -5,6 +7,7 @@ import time_machine
 import glob
 import gzip
 import json
+import queue
 import swiftclient
 
 from datetime import datetime, date, timedelta, timezone
@@ -12,21 +15,42 @@ from dateutil.relativedelta import relativedelta
 from unittest import mock
 
 from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.management import call_command, CommandError
-from django.test import TransactionTestCase
+from django.db.models import Q
+from django.test import SimpleTestCase, TransactionTestCase
 
 from extlinks.aggregates.management.helpers import (
+    run_in_workers,
     validate_link_aggregate_archive,
     validate_pageproject_aggregate_archive,
     validate_user_aggregate_archive,
 )
+from extlinks.aggregates.management.commands.fill_top_users_totals import (
+    Command as TopUsersTotalsCommand,
+)
 
+from . import storage
+from .archive_cache import ArchiveCache
+from .sketches import HyperLogLog
 from .factories import (
     LinkAggregateFactory,
     UserAggregateFactory,
     PageProjectAggregateFactory,
 )
-from .models import LinkAggregate, UserAggregate, PageProjectAggregate
+from .models import (
+    AggregateCheckpoint,
+    AggregationRun,
+    ChangedAggregateMonth,
+    ChangedCollectionMonth,
+    CollectionMonthlySummary,
+    LinkAggregate,
+    ProgramTopUsersTotal,
+    UserAggregate,
+    PageProjectAggregate,
+)
 from extlinks.links.factories import LinkEventFactory, URLPatternFactory
 from extlinks.organisations.factories import (
     CollectionFactory,
@@ -34,7 +58,8 @@ from extlinks.organisations.factories import (
     UserFactory,
 )
 from extlinks.organisations.models import Organisation
-from ..links.models import URLPattern, LinkEvent
+from extlinks.programs.factories import ProgramFactory
+from ..links.models import URLPattern, LinkEvent, StreamCheckpoint
 
 
 class BaseTransactionTest(TransactionTestCase):
@@ -49,6 +74,38 @@ class BaseTransactionTest(TransactionTestCase):
         super(BaseTransactionTest, cls).tearDownClass()
         cls.tenacity_patcher.stop()
 
+
+class InlineProcess:
+    """
+    Stands in for a forked process, running its target when started.
+    """
+
+    def __init__(self, target, args, name):
+        self.target = target
+        self.args = args
+        self.exitcode = None
+
+    def start(self):
+        try:
+            self.target(*self.args)
+            self.exitcode = 0
+        except Exception:
+            self.exitcode = 1
+
+    def is_alive(self):
+        return False
+
+    def join(self):
+        pass
+
+
+def inline_workers():
+    return mock.patch(
+        "multiprocessing.get_context",
+        return_value=mock.Mock(Process=InlineProcess, Queue=queue.Queue),
+    )
+
+
 class LinkAggregateCommandTest(BaseTransactionTest):
     def setUp(self):
         # Creating one Collection
@@ -698,59 +755,1005 @@ class PageProjectAggregateCommandTest(BaseTransactionTest):
             0,
         )
 
-        call_command("fill_pageproject_aggregates", collections=[new_collection.pk])
+        call_command("fill_pageproject_aggregates", collections=[new_collection.pk])
+
+        self.assertEqual(
+            PageProjectAggregate.objects.filter(collection=new_collection).count(),
+            2,
+        )
+
+    def test_pageproject_aggregate_with_argument_error(self):
+        # Calling the command with a collection that doesn't exist
+        with self.assertRaises(CommandError):
+            call_command("fill_pageproject_aggregates", collections=[9999999])
+
+    def test_pageproject_aggregate_with_argument_delete_org(self):
+        # Create a new collection and some LinkEvents associated with it
+        # Then delete the organisation
+        new_organisation = OrganisationFactory(name="Pixar")
+        new_collection = CollectionFactory(
+            name="Monsters Inc", organisation=new_organisation
+        )
+        url_pattern = URLPatternFactory(url="www.pixar.com")
+        url_pattern.collections.add(new_collection)
+        url_pattern.save()
+
+        LinkEventFactory(
+            content_object=url_pattern,
+            timestamp=datetime(2020, 1, 1, 15, 30, 35, tzinfo=timezone.utc),
+        )
+
+        LinkEventFactory(
+            content_object=url_pattern,
+            timestamp=datetime(2020, 4, 23, 8, 50, 13, tzinfo=timezone.utc),
+        )
+
+        self.assertEqual(
+            PageProjectAggregate.objects.filter(collection=new_collection).count(), 0
+        )
+
+        call_command("fill_pageproject_aggregates", collections=[new_collection.pk])
+
+        self.assertEqual(
+            PageProjectAggregate.objects.filter(collection=new_collection).count(), 2
+        )
+
+        LinkEventFactory(
+            timestamp=datetime(2020, 4, 25, 8, 50, 13, tzinfo=timezone.utc)
+        )
+
+        # Delete the organisation
+        Organisation.objects.filter(pk=new_organisation.pk).delete()
+
+        with self.assertRaises(CommandError):
+            # No collection was returned
+            call_command("fill_pageproject_aggregates", collections=[new_collection.pk])
+
+
+class DailyAggregatesCommandTest(BaseTransactionTest):
+    def setUp(self):
+        self.organisation = OrganisationFactory(name="ACME Org")
+        self.collection = CollectionFactory(name="ACME", organisation=self.organisation)
+        self.url = URLPatternFactory(url="www.google.com")
+        self.url.collections.add(self.collection)
+        self.other_url = URLPatternFactory(url="www.duckduckgo.com")
+        self.other_url.collections.add(self.collection)
+        self.user = UserFactory(username="juannieve")
+        self.user2 = UserFactory(username="jonsnow")
+
+        LinkEventFactory(
+            content_object=self.url,
+            username=self.user,
+            domain="en.wiki.org",
+            page_title="Page1",
+            timestamp=datetime(2020, 1, 1, 15, 30, 35, tzinfo=timezone.utc),
+        )
+        LinkEventFactory(
+            content_object=self.other_url,
+            username=self.user,
+            domain="en.wiki.org",
+            page_title="Page1",
+            timestamp=datetime(2020, 1, 1, 17, 40, 55, tzinfo=timezone.utc),
+        )
+        LinkEventFactory(
+            content_object=self.other_url,
+            username=self.user2,
+            domain="es.wiki.org",
+            page_title="Page2",
+            change=LinkEvent.REMOVED,
+            timestamp=datetime(2020, 1, 1, 19, 5, 42, tzinfo=timezone.utc),
+        )
+
+    def test_fills_every_daily_table(self):
+        call_command("fill_daily_aggregates")
+
+        link_aggregate = LinkAggregate.objects.get()
+        self.assertEqual(link_aggregate.full_date, date(2020, 1, 1))
+        self.assertEqual(link_aggregate.total_links_added, 2)
+        self.assertEqual(link_aggregate.total_links_removed, 1)
+
+        self.assertEqual(UserAggregate.objects.count(), 2)
+        self.assertEqual(
+            UserAggregate.objects.get(username="juannieve").total_links_added, 2
+        )
+        self.assertEqual(
+            UserAggregate.objects.get(username="jonsnow").total_links_removed, 1
+        )
+
+        self.assertEqual(PageProjectAggregate.objects.count(), 2)
+        page_aggregate = PageProjectAggregate.objects.get(
+            project_name="en.wiki.org", page_name="Page1"
+        )
+        self.assertEqual(page_aggregate.organisation, self.organisation)
+        self.assertEqual(page_aggregate.collection, self.collection)
+        self.assertEqual(page_aggregate.day, 1)
+        self.assertEqual(page_aggregate.month, 1)
+        self.assertEqual(page_aggregate.year, 2020)
+        self.assertEqual(page_aggregate.total_links_added, 2)
+
+    def test_plan_writes_nothing(self):
+        stdout = io.StringIO()
+        call_command("fill_daily_aggregates", plan=True, stdout=stdout)
+
+        self.assertFalse(LinkAggregate.objects.exists())
+        self.assertFalse(AggregateCheckpoint.objects.exists())
+        self.assertFalse(AggregationRun.objects.exists())
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(
+            lines[0].split(), ["Collection", "Events", "Groups", "Existing", "rows"]
+        )
+        # One link, two user and two page aggregates.
+        self.assertEqual(lines[1].split(), [str(self.collection.pk), "3", "5", "0"])
+        self.assertEqual(lines[2].split(), ["Total", "3", "5", "0"])
+        self.assertEqual(
+            lines[3], "No recorded runs of fill_daily_aggregates to estimate a runtime from"
+        )
+
+    def test_plan_counts_existing_aggregates(self):
+        call_command("fill_daily_aggregates")
+        self.assertEqual(
+            AggregationRun.objects.get(command="fill_daily_aggregates").events, 3
+        )
+        LinkEventFactory(
+            content_object=self.url,
+            username=self.user,
+            domain="en.wiki.org",
+            page_title="Page1",
+            timestamp=datetime(2020, 1, 1, 18, 0, 0, tzinfo=timezone.utc),
+        )
+
+        stdout = io.StringIO()
+        call_command("fill_daily_aggregates", plan=True, stdout=stdout)
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[2].split(), ["Total", "1", "3", "3"])
+        self.assertTrue(lines[3].startswith("Estimated runtime: "))
+        self.assertEqual(LinkAggregate.objects.get().total_links_added, 2)
+
+    def test_updates_existing_aggregates(self):
+        call_command("fill_daily_aggregates")
+
+        LinkEventFactory(
+            content_object=self.url,
+            username=self.user,
+            domain="en.wiki.org",
+            page_title="Page1",
+            timestamp=datetime(2020, 1, 1, 20, 0, 0, tzinfo=timezone.utc),
+        )
+        call_command("fill_daily_aggregates")
+
+        self.assertEqual(LinkAggregate.objects.get().total_links_added, 3)
+        self.assertEqual(
+            UserAggregate.objects.get(username="juannieve").total_links_added, 3
+        )
+        self.assertEqual(
+            UserAggregate.objects.get(username="jonsnow").total_links_removed, 1
+        )
+        self.assertEqual(PageProjectAggregate.objects.count(), 2)
+
+    def test_only_counts_link_events_after_checkpoint(self):
+        call_command("fill_daily_aggregates")
+        last_link_event = LinkEvent.objects.latest("pk")
+        for checkpoint in AggregateCheckpoint.objects.all():
+            self.assertEqual(checkpoint.last_link_event_id, last_link_event.pk)
+
+        # Events already counted aren't looked at again
+        LinkEvent.objects.filter(pk=last_link_event.pk).delete()
+        LinkEventFactory(
+            content_object=self.url,
+            username=self.user2,
+            domain="es.wiki.org",
+            page_title="Page2",
+            timestamp=datetime(2020, 1, 1, 20, 0, 0, tzinfo=timezone.utc),
+        )
+        call_command("fill_daily_aggregates")
+
+        link_aggregate = LinkAggregate.objects.get()
+        self.assertEqual(link_aggregate.total_links_added, 3)
+        self.assertEqual(link_aggregate.total_links_removed, 1)
+        jon_aggregate = UserAggregate.objects.get(username="jonsnow")
+        self.assertEqual(jon_aggregate.total_links_added, 1)
+        self.assertEqual(jon_aggregate.total_links_removed, 1)
+        self.assertEqual(
+            AggregateCheckpoint.objects.get(
+                aggregate="PageProjectAggregate"
+            ).last_link_event_id,
+            LinkEvent.objects.latest("pk").pk,
+        )
+
+    @mock.patch(
+        "extlinks.aggregates.management.helpers.daily_aggregate_command.time.sleep"
+    )
+    def test_waits_for_lower_link_event_ids(self, mock_sleep):
+        call_command("fill_daily_aggregates")
+        mock_sleep.assert_not_called()
+        checkpoint = LinkEvent.objects.latest("pk").pk
+
+        # A collector commits a LinkEvent while another one with a lower id
+        # is still being written, which only commits, with its collector's
+        # checkpoint, while the fill waits.
+        StreamCheckpoint.objects.create(stream="stream", last_event_id="1")
+        StreamCheckpoint.objects.update(
+            updated=datetime.now(timezone.utc) - timedelta(seconds=5)
+        )
+        LinkEventFactory(
+            pk=checkpoint + 2,
+            content_object=self.url,
+            timestamp=datetime(2020, 1, 1, 20, 0, 0, tzinfo=timezone.utc),
+        )
+
+        def commit(seconds):
+            LinkEventFactory(
+                pk=checkpoint + 1,
+                content_object=self.url,
+                timestamp=datetime(2020, 1, 1, 21, 0, 0, tzinfo=timezone.utc),
+            )
+            StreamCheckpoint.objects.get().save()
+
+        mock_sleep.side_effect = commit
+        call_command("fill_daily_aggregates")
+
+        mock_sleep.assert_called_once()
+        self.assertEqual(LinkAggregate.objects.get().total_links_added, 4)
+        self.assertEqual(
+            AggregateCheckpoint.objects.get(aggregate="LinkAggregate").last_link_event_id,
+            checkpoint + 2,
+        )
+
+    @mock.patch(
+        "extlinks.aggregates.management.helpers.daily_aggregate_command.time.sleep"
+    )
+    def test_skips_link_event_ids_never_written(self, mock_sleep):
+        call_command("fill_daily_aggregates")
+        checkpoint = LinkEvent.objects.latest("pk").pk
+
+        # An id which was never written, with no collector writing, isn't
+        # waited for.
+        StreamCheckpoint.objects.create(stream="stream", last_event_id="1")
+        StreamCheckpoint.objects.update(
+            updated=datetime.now(timezone.utc) - timedelta(hours=1)
+        )
+        LinkEventFactory(
+            pk=checkpoint + 2,
+            content_object=self.url,
+            timestamp=datetime(2020, 1, 1, 20, 0, 0, tzinfo=timezone.utc),
+        )
+        with self.assertLogs("django", level="INFO") as logs:
+            call_command("fill_daily_aggregates")
+
+        mock_sleep.assert_not_called()
+        self.assertIn(
+            f"1 LinkEvent ids up to {checkpoint + 2} were never committed",
+            "\n".join(logs.output),
+        )
+        self.assertEqual(LinkAggregate.objects.get().total_links_added, 3)
+
+    def test_collection_recount_stops_at_checkpoint(self):
+        call_command("fill_daily_aggregates")
+        LinkEventFactory(
+            content_object=self.url,
+            timestamp=datetime(2020, 1, 1, 20, 0, 0, tzinfo=timezone.utc),
+        )
+
+        # The new event is left for the next incremental run
+        LinkAggregate.objects.all().delete()
+        call_command("fill_link_aggregates", collections=[self.collection.pk])
+        self.assertEqual(LinkAggregate.objects.get().total_links_added, 2)
+
+        call_command("fill_link_aggregates")
+        self.assertEqual(LinkAggregate.objects.get().total_links_added, 3)
+
+    @mock.patch(
+        "extlinks.aggregates.management.helpers.daily_aggregate_command.COLLECTIONS_PER_CHUNK",
+        1,
+    )
+    def test_recount_keeps_link_events_followed_meanwhile(self):
+        from .management.commands.follow_daily_aggregates import (
+            Command as FollowCommand,
+        )
+        from .management.helpers import DailyAggregateCommand
+
+        other_collection = CollectionFactory(organisation=self.organisation)
+        other_url = URLPatternFactory(url="www.example.com")
+        other_url.collections.add(other_collection)
+        LinkEventFactory(
+            content_object=other_url,
+            timestamp=datetime(2020, 1, 2, 15, 30, 35, tzinfo=timezone.utc),
+        )
+        process_collections = DailyAggregateCommand._process_collections
+
+        def follow_after_first_chunk(command, *args, **kwargs):
+            process_collections(command, *args, **kwargs)
+            if LinkEvent.objects.filter(link="www.example.com/followed").exists():
+                return
+            # The follower adds a LinkEvent between two chunks of the
+            # recount, before the second collection is recounted.
+            followed = LinkEventFactory(
+                link="www.example.com/followed",
+                content_object=other_url,
+                timestamp=datetime(2020, 1, 2, 16, 0, 0, tzinfo=timezone.utc),
+            )
+            FollowCommand()._aggregate_new_link_events(followed.pk)
+
+        with mock.patch.object(
+            DailyAggregateCommand,
+            "_process_collections",
+            autospec=True,
+            side_effect=follow_after_first_chunk,
+        ):
+            call_command("fill_daily_aggregates")
+        call_command("fill_daily_aggregates")
+
+        self.assertEqual(
+            LinkAggregate.objects.get(collection=self.collection).total_links_added,
+            2,
+        )
+        self.assertEqual(
+            LinkAggregate.objects.get(collection=other_collection).total_links_added,
+            2,
+        )
+        self.assertEqual(
+            AggregateCheckpoint.objects.get(aggregate="LinkAggregate").last_link_event_id,
+            LinkEvent.objects.latest("pk").pk,
+        )
+
+    def test_follow_counts_up_to_previous_pass(self):
+        from .management.commands.follow_daily_aggregates import (
+            Command as FollowCommand,
+        )
+
+        command = FollowCommand()
+        first_pass_id = command._follow(None)
+        self.assertFalse(LinkAggregate.objects.exists())
+        self.assertEqual(first_pass_id, LinkEvent.objects.latest("pk").pk)
+
+        LinkEventFactory(
+            content_object=self.url,
+            timestamp=datetime(2020, 1, 1, 20, 0, 0, tzinfo=timezone.utc),
+        )
+        second_pass_id = command._follow(first_pass_id)
+        # Only the events seen on the previous pass are counted
+        self.assertEqual(LinkAggregate.objects.get().total_links_added, 2)
+
+        command._follow(second_pass_id)
+        self.assertEqual(LinkAggregate.objects.get().total_links_added, 3)
+        self.assertEqual(UserAggregate.objects.count(), 3)
+
+    def test_collection_url_pattern_fallback(self):
+        # Collections without URLPattern.collections use URLPattern.collection
+        legacy_collection = CollectionFactory(organisation=self.organisation)
+        legacy_url = URLPatternFactory(
+            url="www.example.com", collection=legacy_collection
+        )
+        LinkEventFactory(
+            content_object=legacy_url,
+            timestamp=datetime(2020, 1, 1, 15, 30, 35, tzinfo=timezone.utc),
+        )
+
+        call_command("fill_link_aggregates", collections=[legacy_collection.pk])
+
+        self.assertEqual(
+            LinkAggregate.objects.get(collection=legacy_collection).total_links_added,
+            1,
+        )
+
+    def test_recount_split_between_workers(self):
+        other_collection = CollectionFactory(organisation=self.organisation)
+        other_url = URLPatternFactory(url="www.example.com")
+        other_url.collections.add(other_collection)
+        LinkEventFactory(
+            content_object=other_url,
+            timestamp=datetime(2020, 1, 2, 15, 30, 35, tzinfo=timezone.utc),
+        )
+
+        with inline_workers() as mock_get_context:
+            call_command("fill_daily_aggregates", workers=2)
+
+        mock_get_context.assert_called_once_with("fork")
+        self.assertEqual(
+            LinkAggregate.objects.get(collection=self.collection).total_links_added,
+            2,
+        )
+        self.assertEqual(
+            LinkAggregate.objects.get(collection=other_collection).total_links_added,
+            1,
+        )
+        self.assertEqual(AggregateCheckpoint.objects.count(), 3)
+
+
+class RunInWorkersTest(BaseTransactionTest):
+    def test_single_worker_runs_inline(self):
+        aggregate = mock.Mock()
+        with mock.patch("multiprocessing.get_context") as mock_get_context:
+            run_in_workers(aggregate, [1, 2, 3], workers=1)
+
+        aggregate.assert_called_once_with([1, 2, 3])
+        mock_get_context.assert_not_called()
+
+    def test_collections_dealt_between_workers(self):
+        aggregated = []
+        with inline_workers():
+            run_in_workers(aggregated.append, list(range(1, 6)), workers=2)
+
+        self.assertEqual(aggregated, [[1, 3, 5], [2, 4]])
+
+    def test_failed_worker_raises(self):
+        def aggregate(chunk):
+            if 2 in chunk:
+                raise ValueError
+
+        with inline_workers():
+            with self.assertRaises(CommandError):
+                run_in_workers(aggregate, [1, 2], workers=2)
+
+
+class AggregateManagerTest(BaseTransactionTest):
+    def setUp(self):
+        self.organisation = OrganisationFactory()
+        self.collection = CollectionFactory(organisation=self.organisation)
+
+    def _aggregate(self, total_links_added, day=None, username="jonsnow"):
+        return UserAggregate(
+            organisation=self.organisation,
+            collection=self.collection,
+            username=username,
+            full_date=date(2020, 1, 31),
+            day=day,
+            on_user_list=False,
+            total_links_added=total_links_added,
+            total_links_removed=0,
+        )
+
+    def test_bulk_upsert_replaces_totals(self):
+        UserAggregate.objects.bulk_upsert([self._aggregate(2)])
+        created = UserAggregate.objects.get()
+        self.assertEqual((created.day, created.month, created.year), (31, 1, 2020))
+
+        UserAggregate.objects.bulk_upsert(
+            [self._aggregate(5), self._aggregate(1, username="juannieve")]
+        )
+        self.assertEqual(UserAggregate.objects.count(), 2)
+        updated = UserAggregate.objects.get(username="jonsnow")
+        self.assertEqual(updated.pk, created.pk)
+        self.assertEqual(updated.total_links_added, 5)
+        self.assertEqual(updated.created_at, created.created_at)
+
+    def test_bulk_upsert_increments_totals(self):
+        UserAggregate.objects.bulk_upsert([self._aggregate(2)], increment=True)
+        UserAggregate.objects.bulk_upsert([self._aggregate(3)], increment=True)
+        self.assertEqual(UserAggregate.objects.get().total_links_added, 5)
+
+    def test_bulk_upsert_keeps_monthly_aggregates_apart(self):
+        UserAggregate.objects.bulk_upsert([self._aggregate(2)])
+        UserAggregate.objects.bulk_upsert([self._aggregate(10, day=0)])
+        self.assertEqual(UserAggregate.objects.get(day=31).total_links_added, 2)
+        self.assertEqual(UserAggregate.objects.get(day=0).total_links_added, 10)
+
+    def test_rollup_monthly_adds_to_monthly_aggregates(self):
+        monthly = self._aggregate(10, day=0)
+        monthly.save()
+        daily = [self._aggregate(2), self._aggregate(1, username="juannieve")]
+        daily[0].full_date = date(2020, 1, 30)
+        UserAggregate.objects.bulk_upsert(daily + [self._aggregate(3)])
+
+        UserAggregate.objects.rollup_monthly(
+            UserAggregate.objects.exclude(day=0), date(2020, 1, 31)
+        )
+
+        # Daily aggregates are left for the caller to delete
+        self.assertEqual(UserAggregate.objects.exclude(day=0).count(), 3)
+        monthly.refresh_from_db()
+        self.assertEqual(monthly.total_links_added, 15)
+        created = UserAggregate.objects.get(day=0, username="juannieve")
+        self.assertEqual(created.total_links_added, 1)
+        self.assertEqual(
+            (created.full_date, created.month, created.year),
+            (date(2020, 1, 31), 1, 2020),
+        )
+
+    def test_duplicate_aggregate_rejected(self):
+        self._aggregate(2).save()
+        with self.assertRaises(ValidationError):
+            self._aggregate(2).save()
+
+
+class TopTotalsCommandTest(BaseTransactionTest):
+    def setUp(self):
+        self.program = ProgramFactory()
+        self.organisation = OrganisationFactory(program=(self.program,))
+        self.collection = CollectionFactory(organisation=self.organisation)
+
+    def _user_aggregate(self, full_date, total_links_added, day=None):
+        return UserAggregateFactory(
+            organisation=self.organisation,
+            collection=self.collection,
+            username="jonsnow",
+            full_date=full_date,
+            day=day,
+            total_links_added=total_links_added,
+            total_links_removed=0,
+        )
+
+    def test_only_changed_months_recomputed(self):
+        self._user_aggregate(date(2024, 1, 5), 2)
+        self._user_aggregate(date(2024, 1, 6), 3)
+        self._user_aggregate(date(2024, 2, 5), 4)
+
+        call_command("fill_top_users_totals")
+
+        self.assertFalse(ChangedAggregateMonth.objects.exists())
+        january = ProgramTopUsersTotal.objects.get(full_date=date(2024, 1, 31))
+        self.assertEqual(january.total_links_added, 5)
+        ProgramTopUsersTotal.objects.filter(pk=january.pk).update(total_links_added=0)
+
+        self._user_aggregate(date(2024, 2, 6), 1)
+        call_command("fill_top_users_totals")
+
+        self.assertEqual(
+            ProgramTopUsersTotal.objects.get(
+                full_date=date(2024, 1, 31)
+            ).total_links_added,
+            0,
+        )
+        self.assertEqual(
+            ProgramTopUsersTotal.objects.get(
+                full_date=date(2024, 2, 29)
+            ).total_links_added,
+            5,
+        )
+
+    def test_changes_committed_while_computing_kept(self):
+        self._user_aggregate(date(2024, 1, 5), 2)
+        other_organisation = OrganisationFactory(program=(self.program,))
+        command = TopUsersTotalsCommand()
+        calculate_totals = command.calculate_totals
+
+        def commit_change(*args):
+            calculate_totals(*args)
+            # A writer stamps a change before the run started, and only
+            # commits it once the changes have been read.
+            ChangedAggregateMonth.objects.create(
+                aggregate="UserAggregate",
+                organisation=other_organisation,
+                full_date=date(2024, 1, 31),
+                changed_at=datetime.now(timezone.utc) - timedelta(minutes=1),
+            )
+
+        with mock.patch.object(command, "calculate_totals", side_effect=commit_change):
+            call_command(command)
+
+        self.assertEqual(
+            list(
+                ChangedAggregateMonth.objects.values_list("organisation_id", flat=True)
+            ),
+            [other_organisation.pk],
+        )
+
+    def test_date_recomputes_every_month(self):
+        self._user_aggregate(date(2024, 1, 31), 2, day=0)
+        call_command("fill_top_users_totals")
+        ProgramTopUsersTotal.objects.update(total_links_added=0)
+
+        with time_machine.travel(date(2024, 3, 11)):
+            call_command("fill_top_users_totals", date=date(2024, 1, 1))
+
+        self.assertEqual(ProgramTopUsersTotal.objects.get().total_links_added, 2)
+
+    @mock.patch("swiftclient.Connection")
+    def test_archived_months_keep_totals(self, mock_swift_connection):
+        mock_conn = mock_swift_connection.return_value
+        mock_conn.get_account.return_value = (
+            {},
+            [{"name": "archive-aggregates-test"}],
+        )
+        mock_conn.put_container.return_value = ({}, [])
+        mock_conn.put_object.return_value = ""
+
+        self._user_aggregate(date(2024, 1, 31), 2, day=0)
+        call_command("fill_top_users_totals")
+
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        call_command(
+            "archive_user_aggregates",
+            "dump",
+            "--from",
+            "2024-01",
+            "--to",
+            "2024-01",
+            "--output",
+            output_dir,
+        )
+        self.assertFalse(UserAggregate.objects.exists())
+
+        with time_machine.travel(date(2024, 3, 11)):
+            call_command("fill_top_users_totals", date=date(2024, 1, 1))
+
+        self.assertEqual(ProgramTopUsersTotal.objects.get().total_links_added, 2)
+
+
+class AggregationRunTest(BaseTransactionTest):
+    def test_throughput_of_recent_runs(self):
+        self.assertIsNone(AggregationRun.objects.throughput("fill_link_aggregates"))
+
+        started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for _ in range(AggregationRun.objects.RECENT_RUNS + 5):
+            with time_machine.travel(started + timedelta(seconds=10), tick=False):
+                AggregationRun.objects.record("fill_link_aggregates", 100, started)
+
+        self.assertEqual(
+            AggregationRun.objects.count(), AggregationRun.objects.RECENT_RUNS
+        )
+        self.assertEqual(
+            AggregationRun.objects.throughput("fill_link_aggregates"), 10
+        )
+
+
+class HyperLogLogTest(SimpleTestCase):
+    def test_small_counts_exact(self):
+        sketch = HyperLogLog.from_values(["Jim", "Bob", "Mary", "Jim"])
+        self.assertEqual(len(sketch), 3)
+        self.assertEqual(len(HyperLogLog()), 0)
+
+    def test_large_counts_estimated(self):
+        sketch = HyperLogLog.from_values(str(value) for value in range(50_000))
+        self.assertAlmostEqual(sketch.count(), 50_000, delta=2_500)
+
+    def test_merge_counts_union(self):
+        sketch = HyperLogLog.from_values(str(value) for value in range(0, 30))
+        sketch.merge(HyperLogLog.from_values(str(value) for value in range(20, 50)))
+        self.assertEqual(sketch.count(), 50)
+
+    def test_serialization(self):
+        sketch = HyperLogLog.from_values(str(value) for value in range(1_000))
+        loaded = HyperLogLog.from_bytes(sketch.to_bytes())
+        self.assertEqual(loaded.registers, sketch.registers)
+        self.assertLess(len(HyperLogLog.from_values(["Jim"]).to_bytes()), 100)
+
+
+class CollectionMonthlySummaryTest(BaseTransactionTest):
+    def setUp(self):
+        self.organisation = OrganisationFactory()
+        self.collection = CollectionFactory(organisation=self.organisation)
+        for day, username, project_name in (
+            (1, "Jim", "en.wikipedia.org"),
+            (2, "Bob", "en.wikipedia.org"),
+            (3, "Jim", "de.wikipedia.org"),
+        ):
+            common = {
+                "organisation": self.organisation,
+                "collection": self.collection,
+                "full_date": date(2024, 1, day),
+                "total_links_added": 2,
+                "total_links_removed": 1,
+            }
+            LinkAggregateFactory(**common)
+            UserAggregateFactory(username=username, **common)
+            PageProjectAggregateFactory(project_name=project_name, **common)
+        call_command("fill_collection_summaries")
+
+    def assertSummary(self, summary):
+        self.assertEqual(summary.full_date, date(2024, 1, 31))
+        self.assertEqual(summary.total_links_added, 6)
+        self.assertEqual(summary.total_links_removed, 3)
+        self.assertEqual(len(HyperLogLog.from_bytes(summary.editors)), 2)
+        self.assertEqual(len(HyperLogLog.from_bytes(summary.projects)), 2)
+
+    def test_summary_kept_up_to_date(self):
+        self.assertSummary(CollectionMonthlySummary.objects.get())
+
+    def test_summary_kept_when_aggregates_archived(self):
+        UserAggregate.objects.all().delete()
+        self.assertSummary(CollectionMonthlySummary.objects.get())
+
+    def test_fill_all_collection_summaries(self):
+        CollectionMonthlySummary.objects.all().delete()
+        call_command("fill_collection_summaries", "--all")
+        self.assertSummary(CollectionMonthlySummary.objects.get())
+
+    def test_refresh_only_changed_fields(self):
+        CollectionMonthlySummary.objects.update(total_links_added=100)
+        UserAggregateFactory(
+            organisation=self.organisation,
+            collection=self.collection,
+            username="Mary",
+            full_date=date(2024, 1, 4),
+        )
+
+        # Writing aggregates only records the changed month.
+        summary = CollectionMonthlySummary.objects.get()
+        self.assertEqual(len(HyperLogLog.from_bytes(summary.editors)), 2)
+        self.assertEqual(
+            list(
+                ChangedCollectionMonth.objects.values_list(
+                    "aggregate", "collection_id", "full_date"
+                )
+            ),
+            [("UserAggregate", self.collection.pk, date(2024, 1, 31))],
+        )
+
+        call_command("fill_collection_summaries")
+
+        summary = CollectionMonthlySummary.objects.get()
+        self.assertEqual(summary.total_links_added, 100)
+        self.assertEqual(len(HyperLogLog.from_bytes(summary.editors)), 3)
+        self.assertFalse(ChangedCollectionMonth.objects.exists())
+
+    def test_changes_committed_while_refreshing_kept(self):
+        UserAggregateFactory(
+            organisation=self.organisation,
+            collection=self.collection,
+            username="Mary",
+            full_date=date(2024, 1, 4),
+        )
+        other_collection = CollectionFactory(organisation=self.organisation)
+        refresh = CollectionMonthlySummary.objects.refresh
+
+        def commit_change(*args, **kwargs):
+            refresh(*args, **kwargs)
+            # A writer stamps a change before the refresh started, and only
+            # commits it once the changes have been read.
+            ChangedCollectionMonth.objects.create(
+                aggregate="UserAggregate",
+                collection=other_collection,
+                full_date=date(2024, 1, 31),
+                changed_at=datetime.now(timezone.utc) - timedelta(minutes=1),
+            )
+
+        with mock.patch.object(
+            CollectionMonthlySummary.objects, "refresh", side_effect=commit_change
+        ):
+            call_command("fill_collection_summaries")
+
+        self.assertEqual(
+            list(ChangedCollectionMonth.objects.values_list("collection_id", flat=True)),
+            [other_collection.pk],
+        )
+
+
+class ArchiveStorageTest(SimpleTestCase):
+    def setUp(self):
+        self.collection = mock.Mock(pk=1)
+        self.archive_names = [
+            f"aggregates_useraggregate_1_1_2023-0{month}-01_0.json.gz"
+            for month in (1, 2)
+        ]
+
+    def get_archive_list(self, names):
+        patcher = mock.patch(
+            "extlinks.aggregates.storage.get_archive_list",
+            return_value=[{"name": name} for name in names],
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch("extlinks.aggregates.storage.get_archives")
+    def test_sketches_merged(self, mock_get_archives):
+        self.get_archive_list(
+            self.archive_names
+            + [storage.get_sketch_name(name) for name in self.archive_names]
+        )
+        mock_get_archives.side_effect = lambda names, hashes: {
+            name: HyperLogLog.from_values(["Jim", name]).to_bytes()
+            for name in names
+        }
+
+        sketch = storage.download_sketch(
+            "aggregates_useraggregate",
+            Q(collection=self.collection),
+            "username",
+        )
+
+        self.assertEqual(len(sketch), 3)
+        mock_get_archives.assert_any_call(
+            [
+                "aggregates_useraggregate_1_1_2023-01-01_0.hll",
+                "aggregates_useraggregate_1_1_2023-02-01_0.hll",
+            ],
+            hashes=mock.ANY,
+        )
+
+    @mock.patch("extlinks.aggregates.storage.get_archives")
+    def test_archives_without_sketch_downloaded(self, mock_get_archives):
+        self.get_archive_list(self.archive_names)
+        mock_get_archives.side_effect = lambda names, hashes: {
+            name: gzip.compress(
+                json.dumps(
+                    [{"fields": {"username": "Jim"}}, {"fields": {"username": name}}]
+                ).encode("utf-8")
+            )
+            for name in names
+        }
+
+        sketch = storage.download_sketch(
+            "aggregates_useraggregate",
+            Q(collection=self.collection),
+            "username",
+            to_date=date(2023, 1, 31),
+        )
+
+        self.assertEqual(len(sketch), 2)
+
+    @mock.patch("extlinks.aggregates.storage.get_archives")
+    def test_download_aggregates(self, mock_get_archives):
+        self.get_archive_list(self.archive_names)
+        mock_get_archives.return_value = {
+            name: gzip.compress(
+                json.dumps(
+                    [
+                        {
+                            "fields": {
+                                "username": username,
+                                "total_links_added": 2,
+                                "total_links_removed": 1,
+                            }
+                        }
+                        for username in ("Jim", "Mary")
+                    ]
+                ).encode("utf-8")
+            )
+            for name in self.archive_names
+        }
+
+        records = storage.download_aggregates(
+            "aggregates_useraggregate", Q(collection=self.collection)
+        )
+        totals = storage.calculate_totals(
+            records, group_by=lambda record: record["username"]
+        )
 
         self.assertEqual(
-            PageProjectAggregate.objects.filter(collection=new_collection).count(),
-            2,
+            sorted((total["username"], total["links_diff"]) for total in totals),
+            [("Jim", 2), ("Mary", 2)],
+        )
+        # Archives are downloaded one per call.
+        self.assertCountEqual(
+            [call.args[0] for call in mock_get_archives.call_args_list],
+            [[name] for name in self.archive_names],
+        )
+
+    @mock.patch("extlinks.aggregates.storage.ARCHIVE_PREFETCH", 2)
+    @mock.patch("extlinks.aggregates.storage.get_archives")
+    def test_iter_archives_prefetch(self, mock_get_archives):
+        names = [f"archive_{i}.json.gz" for i in range(6)]
+        mock_get_archives.side_effect = lambda archive_names, hashes: {
+            name: name.encode("utf-8")
+            for name in archive_names
+            if name != "archive_3.json.gz"
+        }
+
+        archives = storage.iter_archives(names)
+        self.assertEqual(next(archives), ("archive_0.json.gz", b"archive_0.json.gz"))
+        # Only the archives in the window have been requested.
+        self.assertLessEqual(mock_get_archives.call_count, 3)
+
+        # The archives come out in order, without the missing one.
+        self.assertEqual(
+            [name for name, _ in archives],
+            [name for name in names[1:] if name != "archive_3.json.gz"],
         )
+        self.assertEqual(mock_get_archives.call_count, 6)
 
-    def test_pageproject_aggregate_with_argument_error(self):
-        # Calling the command with a collection that doesn't exist
-        with self.assertRaises(CommandError):
-            call_command("fill_pageproject_aggregates", collections=[9999999])
-
-    def test_pageproject_aggregate_with_argument_delete_org(self):
-        # Create a new collection and some LinkEvents associated with it
-        # Then delete the organisation
-        new_organisation = OrganisationFactory(name="Pixar")
-        new_collection = CollectionFactory(
-            name="Monsters Inc", organisation=new_organisation
+    @mock.patch("extlinks.aggregates.storage.get_archives")
+    def test_download_aggregates_totals(self, mock_get_archives):
+        # The first archive has precomputed totals, the second doesn't.
+        self.get_archive_list(
+            self.archive_names + [storage.get_totals_name(self.archive_names[0])]
         )
-        url_pattern = URLPatternFactory(url="www.pixar.com")
-        url_pattern.collections.add(new_collection)
-        url_pattern.save()
+        records = [
+            {
+                "username": username,
+                "full_date": "2023-01-01",
+                "total_links_added": 2,
+                "total_links_removed": 1,
+            }
+            for username in ("Jim", "Mary", "Jim")
+        ]
+        contents = {
+            storage.get_totals_name(self.archive_names[0]): json.dumps(
+                storage.summarise_totals(records, ["username"])
+            ).encode("utf-8"),
+            self.archive_names[1]: gzip.compress(
+                json.dumps([{"fields": record} for record in records]).encode("utf-8")
+            ),
+        }
+        mock_get_archives.side_effect = lambda names, hashes: {
+            name: contents[name] for name in names
+        }
+
+        for totals_by, group_by, expected in (
+            (("username",), "username", [("Jim", 4), ("Mary", 2)]),
+            ((), None, [(None, 6)]),
+        ):
+            totals = storage.calculate_totals(
+                storage.download_aggregates(
+                    "aggregates_useraggregate",
+                    Q(collection=self.collection),
+                    totals_by=totals_by,
+                ),
+                group_by=group_by and (lambda record: record[group_by]),
+            )
+            self.assertEqual(
+                sorted(
+                    (group_by and total[group_by], total["links_diff"])
+                    for total in totals
+                ),
+                expected,
+            )
 
-        LinkEventFactory(
-            content_object=url_pattern,
-            timestamp=datetime(2020, 1, 1, 15, 30, 35, tzinfo=timezone.utc),
-        )
+        # Only the archive without totals was downloaded.
+        mock_get_archives.assert_called_with([self.archive_names[1]], hashes=mock.ANY)
 
-        LinkEventFactory(
-            content_object=url_pattern,
-            timestamp=datetime(2020, 4, 23, 8, 50, 13, tzinfo=timezone.utc),
+
+class ArchiveCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(cache.clear)
+        self.archives = {
+            f"archive_{index}.json.gz": bytes(100) for index in range(3)
+        }
+        self.hashes = {
+            name: hashlib.md5(contents).hexdigest()
+            for name, contents in self.archives.items()
+        }
+
+    def test_least_recently_used_evicted(self):
+        archive_cache = ArchiveCache(self.directory, 250)
+        archive_cache.set_many(dict(list(self.archives.items())[:2]))
+        os.utime(os.path.join(self.directory, "archive_0.json.gz"), (0, 0))
+        os.utime(os.path.join(self.directory, "archive_1.json.gz"), (1, 1))
+
+        # Reading the oldest archive makes the other one the least recently
+        # used, which is evicted to make room for the third.
+        archive_cache.get_many(["archive_0.json.gz"])
+        archive_cache.set_many(
+            {"archive_2.json.gz": self.archives["archive_2.json.gz"]}
         )
 
         self.assertEqual(
-            PageProjectAggregate.objects.filter(collection=new_collection).count(), 0
+            sorted(os.listdir(self.directory)),
+            ["archive_0.json.gz", "archive_2.json.gz"],
         )
 
-        call_command("fill_pageproject_aggregates", collections=[new_collection.pk])
+    def test_archives_checked_against_hashes(self):
+        archive_cache = ArchiveCache(self.directory, 1000)
+        hashes = dict(self.hashes, **{"archive_1.json.gz": "stale"})
+        archive_cache.set_many(self.archives)
 
         self.assertEqual(
-            PageProjectAggregate.objects.filter(collection=new_collection).count(), 2
+            archive_cache.get_many(self.archives, hashes),
+            {
+                "archive_0.json.gz": self.archives["archive_0.json.gz"],
+                "archive_2.json.gz": self.archives["archive_2.json.gz"],
+            },
         )
+        self.assertNotIn("archive_1.json.gz", os.listdir(self.directory))
 
-        LinkEventFactory(
-            timestamp=datetime(2020, 4, 25, 8, 50, 13, tzinfo=timezone.utc)
+        # Archives which don't match their hash aren't cached.
+        archive_cache.set_many({"archive_1.json.gz": b"corrupted"}, self.hashes)
+        self.assertNotIn("archive_1.json.gz", os.listdir(self.directory))
+
+    @mock.patch("extlinks.aggregates.storage.swift_connection")
+    @mock.patch("extlinks.aggregates.storage.batch_download_files")
+    def test_get_archives_from_disk(self, mock_download, mock_swift_connection):
+        big_archive = os.urandom(storage.MAX_CACHED_ARCHIVE_BYTES + 1)
+        archives = dict(self.archives, **{"archive_big.json.gz": big_archive})
+        hashes = dict(
+            self.hashes,
+            **{"archive_big.json.gz": hashlib.md5(big_archive).hexdigest()},
         )
+        mock_download.side_effect = lambda conn, container, names: {
+            name: archives[name] for name in names
+        }
 
-        # Delete the organisation
-        Organisation.objects.filter(pk=new_organisation.pk).delete()
+        with mock.patch.dict(os.environ, {"ARCHIVE_CACHE_DIR": self.directory}):
+            self.assertEqual(storage.get_archives(archives, hashes=hashes), archives)
+            # The big archive isn't in memcached, but is read from disk.
+            self.assertEqual(storage.get_archives(archives, hashes=hashes), archives)
 
-        with self.assertRaises(CommandError):
-            # No collection was returned
-            call_command("fill_pageproject_aggregates", collections=[new_collection.pk])
+        mock_download.assert_called_once()
+        self.assertEqual(len(os.listdir(self.directory)), 4)
 
 
 class MonthlyLinkAggregateCommandTest(BaseTransactionTest):
@@ -788,6 +1791,44 @@ class MonthlyLinkAggregateCommandTest(BaseTransactionTest):
                 self.expected_total_removed, monthly_aggregate.total_links_removed
             )
 
+    def test_aggregate_monthly_data_plan(self):
+        stdout = io.StringIO()
+        with time_machine.travel(date(2024, 2, 11)):
+            call_command("fill_monthly_link_aggregates", plan=True, stdout=stdout)
+
+        self.assertEqual(LinkAggregate.objects.filter(day=0).count(), 0)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0].split()[:3], ["Collection", "Daily", "aggregates"])
+        self.assertEqual(lines[-2].split(), ["Total", "10", "1", "0"])
+
+    def test_aggregate_monthly_data_with_workers(self):
+        other_collection = CollectionFactory(organisation=self.organisation)
+        for day in range(1, 4):
+            LinkAggregateFactory(
+                full_date=date(2024, 1, day),
+                organisation=self.organisation,
+                collection=other_collection,
+                total_links_added=1,
+                total_links_removed=0,
+            )
+
+        with time_machine.travel(date(2024, 2, 11)), inline_workers():
+            call_command("fill_monthly_link_aggregates", workers=2)
+
+        self.assertEqual(LinkAggregate.objects.exclude(day=0).count(), 0)
+        self.assertEqual(
+            LinkAggregate.objects.get(
+                collection=self.collection, day=0
+            ).total_links_added,
+            self.expected_total_added,
+        )
+        self.assertEqual(
+            LinkAggregate.objects.get(
+                collection=other_collection, day=0
+            ).total_links_added,
+            3,
+        )
+
     def test_no_aggregation_when_no_new_data(self):
         with time_machine.travel(date(2024, 2, 11)):
             call_command("fill_monthly_link_aggregates")
@@ -1435,6 +2476,73 @@ class ArchiveLinkAggregatesCommandTest(BaseTransactionTest):
             any_order=True,
         )
 
+    @mock.patch("swiftclient.Connection")
+    def test_link_aggregate_upload_totals(self, mock_swift_connection):
+        mock_conn = mock_swift_connection.return_value
+        mock_conn.head_object.side_effect = swiftclient.ClientException(
+            "Mocked ClientException",
+            http_status=404,
+            http_reason="Not Found",
+            http_response_content="Object not found",
+        )
+        mock_conn.get_account.return_value = (
+            {},
+            [{"name": "archive-aggregates-test"}],
+        )
+        totals = {}
+        mock_conn.put_object.side_effect = lambda container, name, contents, **kwargs: (
+            totals.update({name: json.loads(contents)})
+            if name.endswith(storage.TOTALS_SUFFIX)
+            else None
+        )
+
+        call_command(
+            "archive_link_aggregates",
+            "dump",
+            "--from",
+            "2023-01",
+            "--to",
+            "2023-03",
+            "--output",
+            self.output_dir,
+        )
+        filenames = os.listdir(self.output_dir)
+        call_command(
+            "archive_link_aggregates",
+            "upload",
+            "--container",
+            "fakecontainer",
+            *(os.path.join(self.output_dir, filename) for filename in filenames),
+        )
+
+        self.assertEqual(
+            set(totals),
+            {storage.get_totals_name(filename) for filename in filenames},
+        )
+        for filename in filenames:
+            with gzip.open(os.path.join(self.output_dir, filename), "rt") as archive:
+                records = [record["fields"] for record in json.load(archive)]
+            archive_totals = totals[storage.get_totals_name(filename)]
+            self.assertEqual(archive_totals["group_by"], ["year", "month"])
+            self.assertEqual(
+                archive_totals["total"]["total_links_added"],
+                sum(record["total_links_added"] for record in records),
+            )
+            self.assertEqual(
+                archive_totals["groups"],
+                [
+                    {
+                        "year": records[0]["year"],
+                        "month": records[0]["month"],
+                        "full_date": records[0]["full_date"],
+                        "total_links_added": archive_totals["total"]["total_links_added"],
+                        "total_links_removed": archive_totals["total"][
+                            "total_links_removed"
+                        ],
+                    }
+                ],
+            )
+
     @mock.patch("swiftclient.Connection")
     def test_link_aggregate_upload_with_object_storage_only(
         self, mock_swift_connection
@@ -1644,6 +2752,53 @@ class ArchiveUserAggregatesCommandTest(BaseTransactionTest):
 
         self.assertEqual(UserAggregate.objects.count(), 3)
 
+    @mock.patch("swiftclient.Connection")
+    def test_load_user_aggregates_columnar(self, mock_swift_connection):
+        mock_conn = mock_swift_connection.return_value
+        mock_conn.get_account.return_value = (
+            {},
+            [{"name": "archive-aggregates-test"}],
+        )
+        expected = json.loads(
+            serializers.serialize("json", UserAggregate.objects.order_by("pk"))
+        )
+
+        call_command(
+            "archive_user_aggregates",
+            "dump",
+            "--from",
+            "2023-01",
+            "--to",
+            "2023-03",
+            "--output",
+            self.output_dir,
+            "--format",
+            "columnar",
+        )
+
+        archives = [
+            os.path.join(self.output_dir, filename)
+            for filename in os.listdir(self.output_dir)
+        ]
+        pattern = storage.get_archive_pattern("aggregates_useraggregate")
+        for archive in archives:
+            self.assertRegex(os.path.basename(archive), pattern)
+            self.assertTrue(archive.endswith(".columnar.gz"))
+        records = []
+        for archive in archives:
+            with open(archive, "rb") as f:
+                records.extend(storage.decode_archive(f.read()))
+        self.assertEqual(sorted(records, key=lambda record: record["pk"]), expected)
+
+        call_command("archive_user_aggregates", "load", *archives)
+
+        self.assertEqual(
+            json.loads(
+                serializers.serialize("json", UserAggregate.objects.order_by("pk"))
+            ),
+            expected,
+        )
+
     @mock.patch("swiftclient.Connection")
     def test_user_aggregate_upload(self, mock_swift_connection):
         mock_conn = mock_swift_connection.return_value
@@ -1698,6 +2853,57 @@ class ArchiveUserAggregatesCommandTest(BaseTransactionTest):
             any_order=True,
         )
 
+    @mock.patch("swiftclient.Connection")
+    def test_user_aggregate_upload_sketches(self, mock_swift_connection):
+        mock_conn = mock_swift_connection.return_value
+        mock_conn.head_object.side_effect = swiftclient.ClientException(
+            "Mocked ClientException",
+            http_status=404,
+            http_reason="Not Found",
+            http_response_content="Object not found",
+        )
+        mock_conn.get_account.return_value = (
+            {},
+            [{"name": "archive-aggregates-test"}],
+        )
+        sketches = {}
+        mock_conn.put_object.side_effect = lambda container, name, contents, **kwargs: (
+            sketches.update({name: contents}) if name.endswith(".hll") else None
+        )
+
+        call_command(
+            "archive_user_aggregates",
+            "dump",
+            "--from",
+            "2023-01",
+            "--to",
+            "2023-03",
+            "--output",
+            self.output_dir,
+        )
+        filenames = os.listdir(self.output_dir)
+        call_command(
+            "archive_user_aggregates",
+            "upload",
+            "--container",
+            "fakecontainer",
+            *(os.path.join(self.output_dir, filename) for filename in filenames),
+        )
+
+        # Sketches are uploaded next to the archives but not written locally.
+        self.assertEqual(
+            set(sketches),
+            {storage.get_sketch_name(filename) for filename in filenames},
+        )
+        self.assertEqual(len(os.listdir(self.output_dir)), 3)
+        for filename in filenames:
+            with gzip.open(os.path.join(self.output_dir, filename), "rt") as archive:
+                usernames = {record["fields"]["username"] for record in json.load(archive)}
+            self.assertEqual(
+                len(HyperLogLog.from_bytes(sketches[storage.get_sketch_name(filename)])),
+                len(usernames),
+            )
+
     @mock.patch("swiftclient.Connection")
     def test_user_aggregate_upload_with_object_storage_only(
         self, mock_swift_connection
@@ -2294,6 +3500,85 @@ class FixAggregatesForOrganisationAndMonthCommandTest(BaseTransactionTest):
                 os.remove(file)
 
 
+    @mock.patch.dict(
+        os.environ,
+        {
+            "OPENSTACK_AUTH_URL": "fakeurl",
+            "SWIFT_APPLICATION_CREDENTIAL_ID": "fakecredid",
+            "SWIFT_APPLICATION_CREDENTIAL_SECRET": "fakecredsecret",
+        },
+    )
+    @mock.patch("swiftclient.Connection")
+    def test_reaggregate_link_archives_monthly_multiple_url_patterns(self, mock_swift_connection):
+        mock_conn = mock_swift_connection.return_value
+        mock_conn.get_account.return_value = (
+            {},
+            [{"name": "archive-aggregates-backup-2024-12-22"}],
+        )
+        mock_conn.get_container.return_value = ({},[])
+        other_url = URLPatternFactory(url="www.other.com")
+        other_url.collection = self.collection
+        other_url.save()
+        temp_dir = tempfile.gettempdir()
+        archive_filename = "links_linkevent_20241222_0.json.gz"
+        archive_path = os.path.join(temp_dir, archive_filename)
+
+        json_data = [
+            {
+                "model": "links.linkevent",
+                "pk": pk,
+                "fields": {
+                    "link": link,
+                    "timestamp": "2024-12-16T09:15:27.363Z",
+                    "domain": "en.wikipedia.org",
+                    "content_type": ContentType.objects.get_for_model(URLPattern).id,
+                    "object_id": self.url.id,
+                    "username": self.user.id,
+                    "rev_id": 485489,
+                    "user_id": self.user.id,
+                    "page_title": "test",
+                    "page_namespace": 0,
+                    "event_id": "",
+                    "user_is_bot": False,
+                    "hash_link_event_id": "",
+                    "change": change,
+                    "on_user_list": True,
+                    "url": []
+                }
+            }
+            for pk, link, change in (
+                (1, "https://www.test.com/1", 1),
+                (2, "https://www.test.com/2", 0),
+                (3, "https://www.other.com/3", 1),
+                # Counted once, though it matches both url patterns
+                (4, "https://www.other.com/?www.test.com", 1),
+            )
+        ]
+
+        with gzip.open(archive_path, "wt", encoding="utf-8") as f:
+            json.dump(json_data, f)
+
+        try:
+            call_command(
+                "reaggregate_link_archives",
+                "--month",
+                "202412",
+                "--organisation",
+                self.organisation.id,
+                "--dir",
+                temp_dir,
+            )
+            # the totals of every url pattern of the collection are added up
+            monthly_link_aggregate = LinkAggregate.objects.get()
+            self.assertEqual(3, monthly_link_aggregate.total_links_added)
+            self.assertEqual(1, monthly_link_aggregate.total_links_removed)
+            monthly_page_project_aggregate = PageProjectAggregate.objects.get()
+            self.assertEqual(3, monthly_page_project_aggregate.total_links_added)
+            self.assertEqual(1, monthly_page_project_aggregate.total_links_removed)
+        finally:
+            for file in glob.glob(archive_path):
+                os.remove(file)
+
     @mock.patch.dict(
         os.environ,
         {
@@ -3437,6 +4722,73 @@ class FixAggregatesForOrganisationAndMonthCommandTest(BaseTransactionTest):
             for file in glob.glob(archive_path):
                 os.remove(file)
 
+    @mock.patch.dict(
+        os.environ,
+        {
+            "OPENSTACK_AUTH_URL": "fakeurl",
+            "SWIFT_APPLICATION_CREDENTIAL_ID": "fakecredid",
+            "SWIFT_APPLICATION_CREDENTIAL_SECRET": "fakecredsecret",
+        },
+    )
+    @mock.patch("swiftclient.Connection")
+    def test_reaggregate_link_archives_daily_plan(self, mock_swift_connection):
+        mock_conn = mock_swift_connection.return_value
+        mock_conn.get_account.return_value = ({}, [])
+        mock_conn.get_container.return_value = ({}, [])
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        json_data = [
+            {
+                "model": "links.linkevent",
+                "pk": pk,
+                "fields": {
+                    "link": f"https://www.test.com/{pk}",
+                    "timestamp": timestamp,
+                    "domain": "en.wikipedia.org",
+                    "user_id": self.user.id,
+                    "page_title": "test",
+                    "change": change,
+                    "on_user_list": True,
+                },
+            }
+            for pk, timestamp, change in (
+                (1, "2024-12-16T09:15:27.363Z", 1),
+                (2, "2024-12-15T09:15:27.363Z", 1),
+                (3, "2024-12-15T09:15:27.363Z", 0),
+            )
+        ]
+        with gzip.open(
+            os.path.join(temp_dir, "links_linkevent_20241222_0.json.gz"),
+            "wt",
+            encoding="utf-8",
+        ) as f:
+            json.dump(json_data, f)
+        LinkAggregateFactory(
+            organisation=self.organisation,
+            collection=self.collection,
+            full_date=date(2024, 12, 15),
+            on_user_list=True,
+        )
+
+        stdout = io.StringIO()
+        call_command(
+            "reaggregate_link_archives",
+            "--day",
+            "20241215",
+            "--organisation",
+            self.organisation.id,
+            "--dir",
+            temp_dir,
+            "--plan",
+            stdout=stdout,
+        )
+
+        self.assertEqual(1, LinkAggregate.objects.count())
+        self.assertEqual(0, UserAggregate.objects.count())
+        self.assertEqual(0, PageProjectAggregate.objects.count())
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), [str(self.collection.pk), "2", "3", "1"])
+
 
     @mock.patch.dict(
         os.environ,
@@ -0,0 +1,268 @@
+import gzip
+import io
+import json
+import re
+
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from django.core import serializers
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+# The formats archives can be written in. Both are gzipped, and readers
+# detect which one an archive uses from its contents.
+ARCHIVE_FORMATS = ("json", "columnar")
+
+# The suffix of the archives in each format, so they can be told apart by
+# name without reading them.
+ARCHIVE_SUFFIXES = {"json": ".json.gz", "columnar": ".columnar.gz"}
+
+# Matches the suffix of archives in any of the ARCHIVE_FORMATS.
+ARCHIVE_SUFFIX_PATTERN = r"\.(?:json|columnar)\.gz$"
+
+# The first line of columnar archives.
+COLUMNAR_MAGIC = "#extlinks-columnar-v1"
+
+# How many records write_columnar holds before writing them as a row group.
+ROW_GROUP_SIZE = 10_000
+
+# How much of an archive iter_records reads at a time.
+READ_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+def is_archive_name(filename: str) -> bool:
+    """
+    Returns whether filename has the suffix of one of the ARCHIVE_FORMATS.
+    """
+    return re.search(ARCHIVE_SUFFIX_PATTERN, filename) is not None
+
+
+def write_columnar(
+    archive: TextIO, records: Iterable[Dict], row_group_size=ROW_GROUP_SIZE
+):
+    """
+    Writes records in the format of Django's python serializer to archive,
+    column by column.
+
+    The first line of the archive is COLUMNAR_MAGIC, the second a header
+    with the model and the names of the columns, which are "pk" and the
+    names of the fields. The records follow in row groups of up to
+    row_group_size records, so only one group is held in memory. Each
+    line of a row group holds the JSON encoded values of a column, in the
+    order of the header. Columns of strings that repeat are dictionary
+    encoded, as a list of the distinct values and the index of each row's
+    value in it, so each field name is written once and readers only
+    decode the columns they need.
+
+    Parameters
+    ----------
+    archive : TextIO
+        The file to write to.
+
+    records : Iterable[Dict]
+        Records of a single model, as returned by
+        serializers.serialize("python", ...).
+
+    row_group_size : int
+        The number of records per row group.
+    """
+    columns = None
+    for record in records:
+        if columns is None:
+            columns = {"pk": [], **{name: [] for name in record["fields"]}}
+            _write_header(archive, record["model"], list(columns))
+        columns["pk"].append(record["pk"])
+        for name, value in record["fields"].items():
+            columns[name].append(value)
+        if len(columns["pk"]) >= row_group_size:
+            _write_row_group(archive, columns)
+
+    if columns is None:
+        _write_header(archive, None, ["pk"])
+    elif columns["pk"]:
+        _write_row_group(archive, columns)
+
+
+def _write_header(archive: TextIO, model: Optional[str], columns: List[str]):
+    archive.write(COLUMNAR_MAGIC + "\n")
+    archive.write(json.dumps({"model": model, "columns": columns}) + "\n")
+
+
+def _write_row_group(archive: TextIO, columns: Dict[str, List]):
+    for values in columns.values():
+        archive.write(json.dumps(_encode_column(values), cls=DjangoJSONEncoder) + "\n")
+        values.clear()
+
+
+def _encode_column(values: List):
+    if not all(isinstance(value, str) for value in values):
+        return values
+    dictionary = {}
+    indexes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+    if len(dictionary) * 2 > len(values):
+        return values
+    return {"dictionary": list(dictionary), "indexes": indexes}
+
+
+def is_columnar(contents: str) -> bool:
+    return contents.startswith(COLUMNAR_MAGIC)
+
+
+def decode_records(contents: str, fields: Optional[Iterable[str]] = None) -> List[Dict]:
+    """
+    Decodes the contents of an archive, in either of the ARCHIVE_FORMATS,
+    into records in the format of Django's python serializer.
+
+    Parameters
+    ----------
+    contents : str
+        The decompressed archive.
+
+    fields : Iterable[str], optional
+        The fields to decode. Columnar archives only decode the columns of
+        these fields, JSON archives always decode every field.
+    """
+    if not is_columnar(contents):
+        return json.loads(contents)
+
+    archive = io.StringIO(contents)
+    archive.readline()
+    return list(_iter_columnar(archive, fields))
+
+
+def iter_records(
+    archive: TextIO, fields: Optional[Iterable[str]] = None
+) -> Iterator[Dict]:
+    """
+    Reads records from an archive, in either of the ARCHIVE_FORMATS, as
+    it is read rather than decoding all of it at once like decode_records.
+
+    JSON archives are parsed a record at a time, so only the record being
+    parsed and a READ_SIZE buffer are held in memory. Columnar archives
+    hold the columns of the given fields for one row group at a time.
+
+    Parameters
+    ----------
+    archive : TextIO
+        The decompressed archive, e.g. opened with gzip.open(..., "rt").
+
+    fields : Iterable[str], optional
+        The fields to decode. Columnar archives only decode the columns of
+        these fields, JSON archives always decode every field.
+    """
+    buffer = archive.read(len(COLUMNAR_MAGIC))
+    if is_columnar(buffer):
+        archive.readline()
+        yield from _iter_columnar(archive, fields)
+    else:
+        yield from _iter_json_array(archive, buffer)
+
+
+def _iter_columnar(
+    archive: TextIO, fields: Optional[Iterable[str]] = None
+) -> Iterator[Dict]:
+    # The archive has been read up to the end of the COLUMNAR_MAGIC line.
+    header = json.loads(archive.readline())
+    fields = set(header["columns"] if fields is None else fields) | {"pk"}
+
+    while True:
+        columns = {}
+        for position, name in enumerate(header["columns"]):
+            line = archive.readline()
+            if not line:
+                if position == 0:
+                    return
+                raise ValueError("The archive ends in the middle of a row group")
+            if name not in fields:
+                continue
+            column = json.loads(line)
+            if isinstance(column, dict):
+                dictionary = column["dictionary"]
+                column = [dictionary[index] for index in column["indexes"]]
+            columns[name] = column
+
+        pks = columns.pop("pk")
+        for index, pk in enumerate(pks):
+            yield {
+                "model": header["model"],
+                "pk": pk,
+                "fields": {name: column[index] for name, column in columns.items()},
+            }
+
+
+def _iter_json_array(archive: TextIO, buffer: str = "") -> Iterator[Dict]:
+    """
+    Yields the elements of the JSON array read from archive, which starts
+    with buffer, one at a time. An empty archive has no elements.
+    """
+    decoder = json.JSONDecoder()
+    position = 0
+    # What's expected next: the opening bracket, the first element or the
+    # closing bracket, an element, or a separator or the closing bracket.
+    expected = "start"
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if position < len(buffer):
+            char = buffer[position]
+            if expected == "start":
+                if char != "[":
+                    raise ValueError("The archive isn't a JSON array")
+                position += 1
+                expected = "first"
+                continue
+            if expected == "separator" or (expected == "first" and char == "]"):
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError(f"Expected ',' in the archive, found {char!r}")
+                position += 1
+                expected = "element"
+                continue
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                end = len(buffer)
+            # An element that ends the buffer may continue in the next read,
+            # e.g. a number, so there must be something after it.
+            if end < len(buffer):
+                position = end
+                expected = "separator"
+                yield element
+                continue
+
+        chunk = archive.read(READ_SIZE)
+        if not chunk:
+            if expected == "start":
+                return
+            if position < len(buffer):
+                # Raises the error of the element that couldn't be decoded.
+                decoder.raw_decode(buffer, position)
+            raise ValueError("The archive ends in the middle of its JSON array")
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def load_archive(filename: str, using=DEFAULT_DB_ALIAS):
+    """
+    Imports a gzipped archive, in either of the ARCHIVE_FORMATS, into the
+    database. JSON archives are loaded with loaddata, which can't read
+    columnar archives, so those are deserialized the same way loaddata
+    would.
+    """
+    with gzip.open(filename, "rt", encoding="utf-8") as archive:
+        contents = archive.read(len(COLUMNAR_MAGIC))
+        if is_columnar(contents):
+            contents += archive.read()
+
+    if not is_columnar(contents):
+        call_command("loaddata", filename, database=using)
+        return
+
+    with transaction.atomic(using=using):
+        for obj in serializers.deserialize(
+            "python", decode_records(contents), using=using
+        ):
+            obj.save(using=using)
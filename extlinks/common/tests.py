@@ -1,3 +1,5 @@
+import io
+import json
 import os
 import shutil
 import tempfile
@@ -8,10 +10,12 @@ from unittest import mock
 import swiftclient
 import time_machine
 
-from django.test import TestCase
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import SimpleTestCase, TestCase
 
 import extlinks.common.swift as swift
 
+from extlinks.common.columnar import decode_records, iter_records, write_columnar
 from extlinks.common.forms import FilterForm
 from extlinks.common.helpers import get_linksearchtotal_data_by_time
 from extlinks.links.factories import LinkSearchTotalFactory, URLPatternFactory
@@ -93,6 +97,92 @@ class LinkSearchDataByTimeTest(TestCase):
             self.assertEqual("February 2020", as_of_date)
 
 
+class ColumnarArchiveTest(SimpleTestCase):
+    def setUp(self):
+        self.records = [
+            {
+                "model": "links.linkevent",
+                "pk": pk,
+                "fields": {
+                    "domain": "en.wikipedia.org",
+                    "page_title": f"Page_{pk}",
+                    "timestamp": datetime(2021, 1, 16, 0, 0, pk, tzinfo=timezone.utc),
+                    "url": [pk],
+                },
+            }
+            for pk in range(1, 4)
+        ]
+
+    def write(self, records, **kwargs):
+        archive = io.StringIO()
+        write_columnar(archive, records, **kwargs)
+        return archive.getvalue()
+
+    def test_round_trip(self):
+        contents = self.write(self.records)
+
+        self.assertEqual(contents.count("en.wikipedia.org"), 1)
+        self.assertEqual(
+            decode_records(contents),
+            json.loads(json.dumps(self.records, cls=DjangoJSONEncoder)),
+        )
+
+    def test_row_groups(self):
+        contents = self.write(iter(self.records), row_group_size=2)
+
+        # The header, then two row groups of a line per column.
+        self.assertEqual(len(contents.splitlines()), 2 + 2 * 5)
+        self.assertEqual(
+            list(iter_records(io.StringIO(contents))),
+            json.loads(json.dumps(self.records, cls=DjangoJSONEncoder)),
+        )
+        self.assertEqual(decode_records(self.write([])), [])
+
+    def test_decode_fields(self):
+        records = decode_records(self.write(self.records), fields=["page_title"])
+
+        self.assertEqual(
+            records[0],
+            {"model": "links.linkevent", "pk": 1, "fields": {"page_title": "Page_1"}},
+        )
+
+    def test_decode_json(self):
+        contents = json.dumps(self.records, cls=DjangoJSONEncoder)
+
+        self.assertEqual(decode_records(contents), json.loads(contents))
+
+    @mock.patch("extlinks.common.columnar.READ_SIZE", 7)
+    def test_iter_json(self):
+        # Records, numbers and strings are split across reads.
+        contents = json.dumps(self.records, cls=DjangoJSONEncoder, indent=1)
+
+        self.assertEqual(
+            list(iter_records(io.StringIO(contents))), json.loads(contents)
+        )
+        self.assertEqual(list(iter_records(io.StringIO("[1, 22, null]"))), [1, 22, None])
+        self.assertEqual(list(iter_records(io.StringIO(" [ ] "))), [])
+        self.assertEqual(list(iter_records(io.StringIO(""))), [])
+
+    @mock.patch("extlinks.common.columnar.READ_SIZE", 7)
+    def test_iter_json_truncated(self):
+        contents = json.dumps(self.records, cls=DjangoJSONEncoder)
+
+        with self.assertRaises(ValueError):
+            list(iter_records(io.StringIO(contents[:-10])))
+        with self.assertRaises(ValueError):
+            list(iter_records(io.StringIO(contents[:-1])))
+
+    def test_iter_columnar(self):
+        records = iter_records(
+            io.StringIO(self.write(self.records)), fields=["page_title"]
+        )
+
+        self.assertEqual(
+            list(records),
+            decode_records(self.write(self.records), fields=["page_title"]),
+        )
+
+
 class FilterFormTest(TestCase):
 
     def test_valid_data(self):
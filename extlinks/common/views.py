@@ -104,6 +104,7 @@ class CSVPageTotals(_CSVDownloadView):
                 prefix="aggregates_pageprojectaggregate",
                 queryset_filter=queryset_filter,
                 to_date=to_date,
+                totals_by=("project_name", "page_name"),
             ),
             group_by=lambda record: (record["project_name"], record["page_name"]),
         )
@@ -184,6 +185,7 @@ class CSVProjectTotals(_CSVDownloadView):
                     prefix="aggregates_pageprojectaggregate",
                     queryset_filter=queryset_filter,
                     to_date=to_date,
+                    totals_by=("project_name",),
                 ),
                 group_by=lambda record: record["project_name"],
             )
@@ -261,6 +263,7 @@ class CSVUserTotals(_CSVDownloadView):
                     prefix="aggregates_useraggregate",
                     queryset_filter=queryset_filter,
                     to_date=to_date,
+                    totals_by=("username",),
                 ),
                 group_by=lambda record: record["username"],
             )
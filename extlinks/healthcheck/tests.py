@@ -20,6 +20,8 @@ from extlinks.aggregates.factories import (
 )
 from extlinks.healthcheck.views import (
     AggregatesCronHealthCheckView,
+    CollectorLagHealthCheckView,
+    CollectorMetricsView,
     CommonCronHealthCheckView,
     LinkEventHealthCheckView,
     LinksCronHealthCheckView,
@@ -27,6 +29,11 @@ from extlinks.healthcheck.views import (
     OrganizationsCronHealthCheckView,
 )
 from extlinks.links.factories import LinkEventFactory, LinkSearchTotalFactory
+from extlinks.links.metrics import (
+    METRICS_CACHE_KEY,
+    CollectorMetrics,
+    set_metrics_workers,
+)
 from extlinks.organisations.factories import OrganisationFactory
 from extlinks.organisations.models import Organisation
 
@@ -579,3 +586,112 @@ class TestOrganizationsCronHealthCheckView(TestCase):
 
         content = json.loads(response.content)
         self.assertEqual(content["status"], "out of date")
+
+
+class TestCollectorLagHealthCheckView(TestCase):
+    def setUp(self):
+        self.url = reverse("healthcheck:collector_lag")
+
+        # Clear the view cache between tests so tests don't affect each other.
+        cache.clear()
+
+    def _publish(self, lag_seconds, updated=None):
+        set_metrics_workers(["main"])
+        metrics = CollectorMetrics()
+        metrics.observe_write(
+            [LinkEventFactory(timestamp=now() - datetime.timedelta(seconds=lag_seconds))],
+            0.01,
+        )
+        metrics.publish()
+        if updated is not None:
+            published = cache.get(METRICS_CACHE_KEY.format(worker="main"))
+            published["updated"] = updated
+            cache.set(METRICS_CACHE_KEY.format(worker="main"), published)
+
+    def _get(self):
+        factory = RequestFactory()
+        request = factory.get(self.url)
+        view = CollectorLagHealthCheckView.as_view()
+        return typing.cast(JsonResponse, view(request))
+
+    def test_successful_health_check(self):
+        """
+        Verify that the healthcheck passes if the collector is keeping up.
+        """
+
+        self._publish(lag_seconds=30)
+
+        response = self._get()
+
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(response.content)
+        self.assertEqual(content["status"], "ok")
+        self.assertAlmostEqual(content["lag_seconds"]["main"], 30, delta=5)
+
+    def test_missing_health_check(self):
+        """
+        Verify that the healthcheck fails if no collector published metrics.
+        """
+
+        response = self._get()
+
+        self.assertEqual(response.status_code, 404)
+        content = json.loads(response.content)
+        self.assertEqual(content["status"], "not found")
+
+    def test_lagging_health_check(self):
+        """
+        Verify that the healthcheck fails if the collector is far behind.
+        """
+
+        self._publish(lag_seconds=2 * 60 * 60)
+
+        response = self._get()
+
+        self.assertEqual(response.status_code, 500)
+        content = json.loads(response.content)
+        self.assertEqual(content["status"], "out of date")
+
+    def test_stale_health_check(self):
+        """
+        Verify that the healthcheck fails if the collector stopped publishing.
+        """
+
+        self._publish(lag_seconds=30, updated=0)
+
+        response = self._get()
+
+        self.assertEqual(response.status_code, 500)
+        content = json.loads(response.content)
+        self.assertEqual(content["status"], "out of date")
+
+
+class TestCollectorMetricsView(TestCase):
+    def setUp(self):
+        self.url = reverse("healthcheck:collector_metrics")
+        cache.clear()
+
+    def test_metrics(self):
+        """
+        Verify that published collector metrics are served to Prometheus.
+        """
+
+        set_metrics_workers(["0", "1"])
+        for worker in ("0", "1"):
+            metrics = CollectorMetrics(worker=worker)
+            metrics.stats.frames_read = 10
+            metrics.observe_write([LinkEventFactory()], 0.02)
+            metrics.publish()
+
+        factory = RequestFactory()
+        request = factory.get(self.url)
+        response = CollectorMetricsView.as_view()(request)
+
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('linkevents_collect_frames_read{worker="0"} 10', content)
+        self.assertIn('linkevents_collect_frames_read{worker="1"} 10', content)
+        self.assertIn(
+            'linkevents_collect_write_seconds_bucket{worker="1",le="0.025"} 1', content
+        )
+        self.assertIn('linkevents_collect_write_batch_size_count{worker="0"} 1', content)
@@ -2,6 +2,8 @@ from django.urls import path
 
 from .views import (
     AggregatesCronHealthCheckView,
+    CollectorLagHealthCheckView,
+    CollectorMetricsView,
     CommonCronHealthCheckView,
     LinksCronHealthCheckView,
     OrganizationsCronHealthCheckView,
@@ -15,5 +17,7 @@ urlpatterns = [
     path("common_crons", CommonCronHealthCheckView.as_view(), name="common_crons"),
     path("link_crons", LinksCronHealthCheckView.as_view(), name="link_crons"),
     path("org_crons", OrganizationsCronHealthCheckView.as_view(), name="org_crons"),
+    path("collector_lag", CollectorLagHealthCheckView.as_view(), name="collector_lag"),
+    path("collector_metrics", CollectorMetricsView.as_view(), name="collector_metrics"),
     path("month_agg_crons", MonthlyAggregatesCronHealthCheckView.as_view(), name="month_agg_crons"),
 ]
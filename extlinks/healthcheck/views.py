@@ -1,10 +1,11 @@
 import datetime
 import os
 import glob
+import time
 
 from datetime import timedelta
 
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views import View
 from django.utils.decorators import method_decorator
 from django.utils.timezone import now
@@ -15,6 +16,8 @@ from extlinks.aggregates.models import (
     UserAggregate,
     PageProjectAggregate,
 )
+from extlinks.common.columnar import ARCHIVE_SUFFIXES
+from extlinks.links.metrics import get_published_metrics, render_prometheus
 from extlinks.links.models import LinkEvent, LinkSearchTotal
 from extlinks.organisations.models import Organisation
 
@@ -136,10 +139,15 @@ class CommonCronHealthCheckView(View):
 
         for i in range(3):
             date = now() - timedelta(days=i)
-            filename = "links_linkevent_{}_*.json.gz".format(date.strftime("%Y%m%d"))
-            filepath = os.path.join(os.environ["HOST_BACKUP_DIR"], filename)
+            filepaths = [
+                os.path.join(
+                    os.environ["HOST_BACKUP_DIR"],
+                    "links_linkevent_{}_*{}".format(date.strftime("%Y%m%d"), suffix),
+                )
+                for suffix in ARCHIVE_SUFFIXES.values()
+            ]
 
-            if bool(glob.glob(filepath)):
+            if any(glob.glob(filepath) for filepath in filepaths):
                 status_code = 200
                 status_msg = "ok"
                 break
@@ -199,3 +207,51 @@ class OrganizationsCronHealthCheckView(View):
         response = JsonResponse({"status": status_msg})
         response.status_code = status_code
         return response
+
+
+@method_decorator(cache_page(60 * 1), name="dispatch")
+class CollectorLagHealthCheckView(View):
+    """
+    Healthcheck that passes only if every linkevents_collect worker has
+    published metrics in the last 5 minutes and is less than an hour behind
+    the EventStream
+    """
+
+    def get(self, request, *args, **kwargs):
+        status_code = 500
+        status_msg = "error"
+        published_metrics = get_published_metrics()
+        lag = {
+            metrics["worker"]: metrics["last_lag_seconds"]
+            for metrics in published_metrics
+        }
+        if not published_metrics:
+            status_code = 404
+            status_msg = "not found"
+        elif any(
+            metrics["updated"] < time.time() - 5 * 60
+            for metrics in published_metrics
+        ):
+            status_msg = "out of date"
+        elif any(
+            seconds is not None and seconds > 60 * 60 for seconds in lag.values()
+        ):
+            status_msg = "out of date"
+        else:
+            status_code = 200
+            status_msg = "ok"
+        response = JsonResponse({"status": status_msg, "lag_seconds": lag})
+        response.status_code = status_code
+        return response
+
+
+class CollectorMetricsView(View):
+    """
+    linkevents_collect throughput and latency metrics, for Prometheus
+    """
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(
+            render_prometheus(get_published_metrics()),
+            content_type="text/plain; version=0.0.4",
+        )
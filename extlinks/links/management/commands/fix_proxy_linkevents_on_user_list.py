@@ -7,6 +7,7 @@ from extlinks.aggregates.models import (
     UserAggregate,
 )
 from extlinks.links.models import LinkEvent
+from extlinks.organisations.models import Organisation
 
 
 class Command(BaseCommand):
@@ -31,11 +32,14 @@ class Command(BaseCommand):
                     for collection in collections:
                         collection_list.add(collection.id)
                         organisation = collection.organisation
-                        username_list = organisation.username_list
-                        if username_list:
-                            if linkevent.username in username_list.all():
-                                linkevent.on_user_list = True
-                                linkevent.save()
+                        if organisation is None:
+                            continue
+                        user_list_ids = Organisation.objects.user_list_ids(
+                            organisation.id
+                        )
+                        if linkevent.username_id in user_list_ids:
+                            linkevent.on_user_list = True
+                            linkevent.save()
 
             if collection_list:
                 LinkAggregate.objects.filter(
@@ -48,6 +52,4 @@ class Command(BaseCommand):
                     collection__in=collection_list, full_date__gte=earliest_link_date
                 ).delete()
 
-                call_command("fill_link_aggregates", collections=collection_list)
-                call_command("fill_pageproject_aggregates", collections=collection_list)
-                call_command("fill_user_aggregates", collections=collection_list)
+                call_command("fill_daily_aggregates", collections=collection_list)
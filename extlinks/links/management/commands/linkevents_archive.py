@@ -1,13 +1,20 @@
-import gzip, datetime, logging, os
+import gzip, datetime, json, logging, os
 
 from swiftclient import ClientException
 
-from typing import List, Optional
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
 from extlinks.common import swift
+from extlinks.common.columnar import (
+    ARCHIVE_FORMATS,
+    ARCHIVE_SUFFIXES,
+    load_archive,
+    write_columnar,
+)
 from extlinks.common.management.commands import BaseCommand
-from django.core.management import call_command
 from django.db import close_old_connections
 
 from extlinks.links.models import LinkEvent
@@ -49,10 +56,11 @@ class Command(BaseCommand):
         date: Optional[datetime.date] = None,
         output: Optional[str] = None,
         object_storage_only=False,
+        archive_format="json",
     ):
         """
-        Export LinkEvents to gzipped JSON files that are grouped by day, and
-        then delete them from the database.
+        Export LinkEvents to gzipped JSON or columnar files that are grouped
+        by day, and then delete them from the database.
 
         This command only archives LinkEvents that have been aggregated by
         checking the cron job log. Optionally a date (YYYY-MM-DD) can be passed
@@ -86,51 +94,118 @@ class Command(BaseCommand):
 
         start = archive_start_time - datetime.timedelta(days=1)
         total = 0
-        iteration = 0
+        dumped = []
 
-        # Page through LinkEvents for all days prior to the day that all of the
-        # most recent aggregation jobs have started. This should be yesterday's
+        # Dump LinkEvents for all days prior to the day that all of the most
+        # recent aggregation jobs have started. This should be yesterday's
         # date, but if the jobs haven't all been completed yet then it will
         # probably be the day before yesterday.
         while True:
-            limit = (iteration + 1) * CHUNK_SIZE
-            offset = iteration * CHUNK_SIZE
-
-            # Paginate through LinkEvents in chunks of 10k at a time. Overfetch
-            # an extra record so we can determine if we need to paginate more.
-            results = list(
-                LinkEvent.objects.filter(
-                    timestamp__gte=start,
-                    timestamp__lt=start + datetime.timedelta(days=1),
-                ).all()[offset : limit + 1]
+            id_ranges = self.dump_day(
+                start, output_dir, object_storage_only, archive_format
             )
 
             # For scenario when a date is not given in the command and one day has no results:
             # if there are more days remaining to be processed, decrease the start date and continue
             if (
                 date is None
-                and len(results) == 0
+                and len(id_ranges) == 0
                 and earliest_date is not None
                 and earliest_date < start
             ):
                 start -= datetime.timedelta(days=1)
                 continue
 
-            if len(results) == 0:
+            if len(id_ranges) == 0:
                 break
 
-            # Remove the overfetched record before saving the archive.
-            linkevents_by_date = results[:CHUNK_SIZE]
+            total += sum(count for _, _, count in id_ranges)
+            dumped.extend((start, after_id, last_id) for after_id, last_id, _ in id_ranges)
+            start -= datetime.timedelta(days=1)
 
-            filename = f"links_linkevent_{start.strftime('%Y%m%d')}_{iteration}.json.gz"
-            local_filepath = os.path.join(output_dir, filename)
-            logger.info(
-                "Dumping %d LinkEvents into %s", len(linkevents_by_date), local_filepath
+        logger.info(
+            "Deleting %d LinkEvents before %s from the database",
+            total,
+            archive_start_time.strftime("%Y-%m-%d"),
+        )
+
+        # Delete the objects from the database after all passes are complete,
+        # one archive's id range at a time, as this has the possibility of
+        # failing when dealing with a lot of records.
+        for day, after_id, last_id in dumped:
+            self.get_linkevents_for_day(day).filter(
+                pk__gt=after_id, pk__lte=last_id
+            ).delete()
+
+    @staticmethod
+    def get_linkevents_for_day(day: datetime.date) -> QuerySet:
+        return LinkEvent.objects.filter(
+            timestamp__gte=day,
+            timestamp__lt=day + datetime.timedelta(days=1),
+        ).order_by("pk")
+
+    def dump_day(
+        self,
+        day: datetime.date,
+        output_dir: str,
+        object_storage_only=False,
+        archive_format="json",
+    ) -> List[Tuple[int, int, int]]:
+        """
+        Export a day's LinkEvents to gzipped JSON or columnar files of up to
+        CHUNK_SIZE LinkEvents each, without deleting them.
+
+        The LinkEvents are paged through by primary key rather than with
+        offsets, so every page is read by a range scan, and are streamed
+        into the archives without loading the models.
+
+        Parameters
+        ----------
+        day : datetime.date
+            The day to export.
+
+        output_dir : str
+            The directory to write the archives to.
+
+        object_storage_only : bool
+            If True, archives are deleted after they are uploaded to Swift.
+
+        archive_format : str
+            One of ARCHIVE_FORMATS.
+
+        Returns
+        -------
+        List[Tuple[int, int, int]]
+            For each archive, the id after which its LinkEvents start, the id
+            of its last LinkEvent and the number of LinkEvents in it.
+        """
+        linkevents = self.get_linkevents_for_day(day)
+        id_ranges = []
+        last_id = 0
+
+        while True:
+            ids = list(
+                linkevents.filter(pk__gt=last_id).values_list("pk", flat=True)[
+                    :CHUNK_SIZE
+                ]
             )
+            if len(ids) == 0:
+                break
+
+            filename = (
+                f"links_linkevent_{day.strftime('%Y%m%d')}_{len(id_ranges)}"
+                + ARCHIVE_SUFFIXES[archive_format]
+            )
+            local_filepath = os.path.join(output_dir, filename)
+            logger.info("Dumping %d LinkEvents into %s", len(ids), local_filepath)
 
             # Serialize the records directly in the writer to conserve memory.
             with gzip.open(local_filepath, "wt", encoding="utf-8") as archive:
-                archive.write(serializers.serialize("json", linkevents_by_date))
+                self.write_archive(
+                    archive,
+                    linkevents.filter(pk__gt=last_id, pk__lte=ids[-1]),
+                    archive_format,
+                )
 
             # Try to upload to Swift, remove local archive if flag is on and upload was successful
             if (
@@ -140,31 +215,69 @@ class Command(BaseCommand):
                 os.remove(local_filepath)
                 logger.info(f"Deleted local file {local_filepath} after upload")
 
-            if len(results) > CHUNK_SIZE:
-                iteration += 1
-            else:
-                start -= datetime.timedelta(days=1)
-                iteration = 0
+            id_ranges.append((last_id, ids[-1], len(ids)))
+            last_id = ids[-1]
 
-            total += len(linkevents_by_date)
+            if len(ids) < CHUNK_SIZE:
+                break
 
-        logger.info(
-            "Deleting %d LinkEvents before %s from the database",
-            total,
-            archive_start_time.strftime("%Y-%m-%d"),
-        )
+        return id_ranges
 
-        # Delete the objects from the database after all passes are complete.
-        # Do this in batches of 10k as well as this has the possibility of
-        # failing when dealing with a lot of records.
-        query_set = LinkEvent.objects.filter(timestamp__lt=archive_start_time)
-        while query_set.exists():
-            delete_query_set = query_set.values_list("id", flat=True)[:CHUNK_SIZE]
-            LinkEvent.objects.filter(pk__in=list(delete_query_set)).delete()
+    def write_archive(self, archive, linkevents: QuerySet, archive_format="json"):
+        """
+        Writes the given LinkEvents to archive in the format of Django's
+        JSON serializer, so archives can be loaded with loaddata, or in
+        columns.
+        """
+        if archive_format == "columnar":
+            write_columnar(archive, self.serialize_linkevents(linkevents))
+            return
+
+        archive.write("[")
+        for index, record in enumerate(self.serialize_linkevents(linkevents)):
+            if index > 0:
+                archive.write(", ")
+            json.dump(record, archive, cls=DjangoJSONEncoder)
+        archive.write("]")
+
+    @staticmethod
+    def serialize_linkevents(linkevents: QuerySet) -> Iterator[Dict]:
+        """
+        Yields the given LinkEvents as the records Django's serializers
+        would, reading their values rather than model instances.
+        """
+        opts = LinkEvent._meta
+        fields = [field for field in opts.local_fields if field.serialize]
+        pks = linkevents.values_list("pk", flat=True)
+
+        # The primary keys of the related objects, per LinkEvent.
+        many_to_many = {}
+        for field in opts.local_many_to_many:
+            if not field.serialize:
+                continue
+            through = field.remote_field.through
+            source = through._meta.get_field(field.m2m_field_name()).attname
+            target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+            related = defaultdict(list)
+            for linkevent_id, related_id in (
+                through.objects.filter(**{f"{source}__in": pks})
+                .values_list(source, target)
+                .iterator()
+            ):
+                related[linkevent_id].append(related_id)
+            many_to_many[field.name] = related
+
+        for row in linkevents.values(
+            "pk", *(field.attname for field in fields)
+        ).iterator():
+            record = {field.name: row[field.attname] for field in fields}
+            for name, related in many_to_many.items():
+                record[name] = related.get(row["pk"], [])
+            yield {"model": opts.label_lower, "pk": row["pk"], "fields": record}
 
     def load(self, filenames: List[str]):
         """
-        Import LinkEvents from gzipped JSON files.
+        Import LinkEvents from gzipped JSON or columnar files.
         """
 
         if not filenames:
@@ -173,8 +286,7 @@ class Command(BaseCommand):
 
         for filename in sorted(filenames):
             logger.info("Loading " + filename)
-            # loaddata supports gzipped fixtures and handles relationships properly
-            call_command("loaddata", filename)
+            load_archive(filename)
 
     def upload_to_swift(self, local_filepath, container_name):
         """
@@ -307,6 +419,12 @@ class Command(BaseCommand):
             action="store_true",
             help="If enabled, archives will only be stored in Swift and deleted from local storage after upload.",
         )
+        parser.add_argument(
+            "--format",
+            choices=ARCHIVE_FORMATS,
+            default="json",
+            help="The format dumped archives are written in. Archives in either format can be loaded.",
+        )
 
     def _handle(self, *args, **options):
         action = options["action"][0]
@@ -315,6 +433,7 @@ class Command(BaseCommand):
                 date=options["date"],
                 output=options["output"],
                 object_storage_only=options["object_storage_only"],
+                archive_format=options["format"],
             )
         if action == "load":
             self.load(filenames=options["filenames"])
@@ -1,10 +1,15 @@
 # Based heavily on
 # https://github.com/Samwalton9/hashtags/blob/master/scripts/collect_hashtags.py
-import hashlib
 from datetime import datetime
-import json
 import logging
+import multiprocessing
+import multiprocessing.connection
 import sys
+import time
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.management.base import CommandError
+from django.db import connections
 from sseclient import SSEClient as EventSource
 from urllib.parse import unquote
 from zoneinfo import ZoneInfo
@@ -12,12 +17,45 @@ from zoneinfo import ZoneInfo
 from extlinks.common.management.commands import BaseCommand
 
 from extlinks.links.helpers import link_is_tracked
-from extlinks.links.models import LinkEvent, URLPattern
-from extlinks.organisations.models import User
+from extlinks.links.metrics import CollectorMetrics, set_metrics_workers
+from extlinks.links.models import LinkEvent, StreamCheckpoint, URLPattern
+from extlinks.links.writer import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CHECKPOINT_INTERVAL,
+    DEFAULT_FLUSH_INTERVAL,
+    DEFAULT_SEED_HOURS,
+    LinkEventWriter,
+    PendingLinkEvent,
+)
+from extlinks.links.stream import (
+    DEFAULT_QUEUE_SIZE,
+    SHARD_BY_DOMAIN,
+    SHARD_BY_ID,
+    STATS_LOG_INTERVAL,
+    AsyncEventStreamConsumer,
+    Shard,
+    decode_message,
+)
 
 logger = logging.getLogger("django")
 
 
+class FlushingEventSource(EventSource):
+    """
+    EventSource that calls on_connect before (re)connecting to the stream,
+    so buffered events are written before we sit out a retry delay.
+    """
+
+    def __init__(self, url, on_connect=None, **kwargs):
+        self.on_connect = on_connect
+        super().__init__(url, **kwargs)
+
+    def _connect(self):
+        if self.on_connect is not None:
+            self.on_connect()
+        super()._connect()
+
+
 class Command(BaseCommand):
     help = "Monitors page-links-change for link events"
 
@@ -25,7 +63,7 @@ class Command(BaseCommand):
         parser.add_argument(
             "--historical",
             action="store_true",
-            help="Parse event stream from last logged event",
+            help="Parse event stream from the last checkpoint, or last logged event",
         )
 
         parser.add_argument(
@@ -34,40 +72,191 @@ class Command(BaseCommand):
             help="Test the command without having to access the stream. Passes a json event",
         )
 
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Number of LinkEvents to buffer before writing them to the database",
+        )
+
+        parser.add_argument(
+            "--flush-interval",
+            type=int,
+            default=int(DEFAULT_FLUSH_INTERVAL * 1000),
+            help="Maximum time in milliseconds a LinkEvent is buffered before being written",
+        )
+
+        parser.add_argument(
+            "--seed-hours",
+            type=float,
+            default=DEFAULT_SEED_HOURS,
+            help="Hours of recent LinkEvents to load into the duplicate check on startup",
+        )
+
+        parser.add_argument(
+            "--checkpoint-interval",
+            type=int,
+            default=DEFAULT_CHECKPOINT_INTERVAL,
+            help="Number of stream messages between saving the stream position",
+        )
+
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="use_async",
+            help="Read, parse and write events in separate stages so slow writes don't stall the stream",
+        )
+
+        parser.add_argument(
+            "--queue-size",
+            type=int,
+            default=DEFAULT_QUEUE_SIZE,
+            help="Maximum number of events waiting between stages in --async mode",
+        )
+
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes to split the stream between",
+        )
+
+        parser.add_argument(
+            "--shard-by",
+            choices=[SHARD_BY_ID, SHARD_BY_DOMAIN],
+            default=SHARD_BY_ID,
+            help="Split the stream between workers by message id or by wiki domain",
+        )
+
     def _handle(self, *args, **options):
+        if options["workers"] > 1 and not options["test"]:
+            set_metrics_workers([str(index) for index in range(options["workers"])])
+            self._supervise(options)
+        else:
+            if not options["test"]:
+                set_metrics_workers(["main"])
+            self._collect(options)
+
+    def _supervise(self, options):
+        """
+        Runs one collector process per shard of the stream, and gives up on
+        all of them as soon as one stops so the command can be retried.
+        """
+        workers = options["workers"]
+        context = multiprocessing.get_context("fork")
+        # Forked workers must open their own database and cache connections.
+        connections.close_all()
+        caches.close_all()
+
+        processes = [
+            context.Process(
+                target=self._collect,
+                args=(options, Shard(index, workers, options["shard_by"])),
+                name="linkevents_collect-{}".format(index),
+            )
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        logger.info(
+            "Started %d linkevents_collect workers sharded by %s",
+            workers,
+            options["shard_by"],
+        )
+
+        try:
+            multiprocessing.connection.wait(
+                [process.sentinel for process in processes]
+            )
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join()
+
+        raise CommandError(
+            "linkevents_collect workers stopped with exit codes {}".format(
+                [process.exitcode for process in processes]
+            )
+        )
+
+    def _collect(self, options, shard=None):
         base_stream_url = "https://stream.wikimedia.org/v2/stream/page-links-change"
+        # Each worker keeps its own place in the stream.
+        checkpoint_stream = base_stream_url
+        if shard is not None:
+            checkpoint_stream = shard.checkpoint_stream(base_stream_url)
+
+        self.shard = shard
+        self.metrics = CollectorMetrics(
+            worker="main" if shard is None else str(shard.index)
+        )
+        self.writer = LinkEventWriter(
+            batch_size=options["batch_size"],
+            flush_interval=options["flush_interval"] / 1000,
+            checkpoint_stream=checkpoint_stream,
+            metrics=self.metrics,
+        )
+        self.checkpoint_interval = options["checkpoint_interval"]
+        seeded = self.writer.recent_hashes.seed(options["seed_hours"])
+        logger.info("Seeded duplicate check with %d recent LinkEvents", seeded)
 
         if options["test"]:
             event_data = options["test"]
             self._evaluate_link(event_data)
+            self.writer.flush()
             # Since we are not testing the EventStream functionality, we finish
             # execution here
             sys.exit(0)
 
-        # Every time this script is started, find the latest entry in the
-        # database, and start the eventstream from there. This ensures that in
-        # the event of any downtime, we always maintain 100% data coverage (up
-        # to the ~7 days that the EventStream historical data is kept anyway).
+        # Every time this script is started, resume the eventstream from the
+        # last message we checkpointed, or failing that the latest entry in
+        # the database. This ensures that in the event of any downtime, we
+        # always maintain 100% data coverage (up to the ~7 days that the
+        # EventStream historical data is kept anyway).
+        last_event_id = None
+        url = base_stream_url
         if options["historical"]:
+            checkpoints = dict(
+                StreamCheckpoint.objects.filter(
+                    stream__in=[checkpoint_stream, base_stream_url]
+                ).values_list("stream", "last_event_id")
+            )
+            # A worker without a checkpoint of its own yet picks up from
+            # where the unsharded collector stopped.
+            last_event_id = checkpoints.get(checkpoint_stream) or checkpoints.get(
+                base_stream_url
+            )
             all_events = LinkEvent.objects.all()
-            if all_events.exists():
+            if last_event_id:
+                logger.info("Resuming from Last-Event-ID %s", last_event_id)
+            elif all_events.exists():
                 latest_datetime = all_events.latest().timestamp
                 latest_date_formatted = latest_datetime.strftime("%Y-%m-%dT%H:%M:%SZ")
 
                 url = base_stream_url + "?since={date}".format(
                     date=latest_date_formatted
                 )
-            else:
-                url = base_stream_url
-        else:
-            url = base_stream_url
 
-        self._process_events(url)
+        try:
+            if options["use_async"]:
+                self._process_events_async(url, last_event_id, options["queue_size"])
+            else:
+                self._process_events(url, last_event_id)
+        finally:
+            # Don't lose buffered events when the stream gives up.
+            self.writer.flush()
+            self.metrics.publish()
 
-    def _process_events(self, url):
+    def _event_source(self, url, last_event_id=None, on_connect=None):
         # Eventsource should fail if it can't read data after a while.
-        for event in EventSource(
+        return FlushingEventSource(
             url,
+            on_connect=on_connect,
+            # Sent as the Last-Event-ID header, and kept up to date by the
+            # client when it reconnects.
+            last_id=last_event_id,
             # The retry argument sets the delay between retries in milliseconds.
             # We're setting this to 5 minutes.
             # There's no way to set the max_retries value with this library,
@@ -83,14 +272,49 @@ class Command(BaseCommand):
             headers={
                 "User-Agent": 'Wikilink'
             }
+        )
+
+    def _process_events(self, url, last_event_id=None):
+        stats = self.metrics.stats
+        stats_logged_at = time.monotonic()
+        for event in self._event_source(
+            url, last_event_id=last_event_id, on_connect=self.writer.flush
         ):
             if event.event == "message":
-                try:
-                    event_data = json.loads(event.data)
-                except ValueError:
-                    continue
+                stats.frames_read += 1
+                event_data = decode_message(
+                    event.id,
+                    event.data,
+                    URLPattern.objects.matcher(),
+                    stats,
+                    self.shard,
+                )
+                if event_data is not None:
+                    self._evaluate_link(event_data)
+                self.writer.set_position(event.id)
+
+                if stats.frames_read % self.checkpoint_interval == 0:
+                    self.writer.flush()
 
-                self._evaluate_link(event_data)
+            self.writer.flush_if_due()
+
+            if time.monotonic() - stats_logged_at >= STATS_LOG_INTERVAL:
+                logger.info("EventStream stats: %s", stats)
+                stats_logged_at = time.monotonic()
+
+    def _process_events_async(self, url, last_event_id, queue_size):
+        # The writer isn't thread safe, so rather than flushing from the
+        # reader thread on reconnect the persist stage flushes when idle.
+        consumer = AsyncEventStreamConsumer(
+            event_source=lambda: self._event_source(url, last_event_id=last_event_id),
+            process_event=self._evaluate_link,
+            writer=self.writer,
+            queue_size=queue_size,
+            checkpoint_interval=self.checkpoint_interval,
+            shard=self.shard,
+            stats=self.metrics.stats,
+        )
+        async_to_sync(consumer.run)()
 
     def _evaluate_link(self, event_data):
         if "added_links" in event_data:
@@ -108,25 +332,32 @@ class Command(BaseCommand):
         Change = 1: Added
         """
 
+        stats = self.metrics.stats
         for link in link_list:
             if link["external"]:
+                stats.links_seen += 1
                 if link_is_tracked(link["link"]):
+                    stats.links_tracked += 1
                     # URLs in the stream are encoded (e.g. %3D instead of =)
                     unquoted_url = unquote(link["link"])
 
                     event_id = event_dict["meta"]["id"]
-                    link_event_id = unquoted_url + event_id
-                    hash = hashlib.sha256()
-                    hash.update(link_event_id.encode("utf-8"))
-                    event_objects = LinkEvent.objects.filter(
-                        hash_link_event_id=hash.hexdigest()
+                    hash_link_event_id = LinkEvent.get_hash_link_event_id(
+                        unquoted_url, event_id
                     )
+                    # Older duplicates than the writer remembers are
+                    # rejected by the database when they are written.
+                    if self.writer.is_duplicate(hash_link_event_id):
+                        stats.duplicates_skipped += 1
+                        continue
 
                     # We skip the URL if the length is greater than 2083
-                    if not event_objects.exists() and len(unquoted_url) < 2084:
-                        self._add_linkevent_to_db(unquoted_url, change, event_dict)
+                    if len(unquoted_url) < 2084:
+                        self._add_linkevent_to_db(
+                            unquoted_url, change, event_dict, hash_link_event_id
+                        )
 
-    def _add_linkevent_to_db(self, link, change, event_data):
+    def _add_linkevent_to_db(self, link, change, event_data, hash_link_event_id=""):
         if "." in event_data["meta"]["dt"]:
             string_format = "%Y-%m-%dT%H:%M:%S.%fZ"
         elif "Z" in event_data["meta"]["dt"]:
@@ -147,34 +378,30 @@ class Command(BaseCommand):
             )
             return
 
-        # Find the db object for this user, or create it if we haven't logged
-        # an edit from them before now.
-        username_object, created = User.objects.get_or_create(username=username)
-
         url_patterns = URLPattern.objects.matches(link)
+        if not url_patterns:
+            return
 
         # We make a hard assumption here that a given link, despite
         # potentially being associated with multiple url patterns, should
         # ultimately only be associated with a single organisation.
         # I can't think of any situation when this wouldn't be the
         # case, but I can't wait to find out why I'm wrong.
-        on_user_list = False
+        # Whether the user is on the organisation's user list is resolved
+        # when the buffered events are written.
+        this_link_org = None
         this_link_collection = url_patterns[0].collection
 
         if hasattr(this_link_collection, "organisation"):
             this_link_org = url_patterns[0].collection.organisation
-            if hasattr(this_link_org, "username_list"):
-                username_list = this_link_org.username_list
-                if username_list:
-                    if username_object in username_list.all():
-                        on_user_list = True
-            else:
+            if not hasattr(this_link_org, "username_list"):
                 logger.error(
                     "Collection {this_link_collection}, Organization {this_link_org} has no username list.".format(
                         this_link_collection=this_link_collection,
                         this_link_org=this_link_org,
                     )
                 )
+                this_link_org = None
         else:
             logger.error(
                 "Collection {this_link_collection} has no organisation.".format(
@@ -195,21 +422,27 @@ class Command(BaseCommand):
             # IPs have no user_id
             user_id = None
 
-        link_event = LinkEvent.objects.create(
+        link_event = LinkEvent(
             link=link,
             timestamp=datetime_object.replace(tzinfo=ZoneInfo("UTC")),
             domain=event_data["meta"]["domain"],
-            username=username_object,
             rev_id=revision_id,
             user_id=user_id,
             page_title=event_data["page_title"],
             page_namespace=event_data["page_namespace"],
             event_id=event_data["meta"]["id"],
             change=change,
-            on_user_list=on_user_list,
             user_is_bot=event_data["performer"]["user_is_bot"],
+            hash_link_event_id=hash_link_event_id,
+        )
+        # The user is found or created, and the event written, when the
+        # writer flushes its buffer.
+        self.writer.add(
+            PendingLinkEvent(
+                link_event=link_event,
+                username=username,
+                url_patterns=url_patterns,
+                collection=this_link_collection,
+                organisation=this_link_org,
+            )
         )
-        for url_pattern in url_patterns:
-            url_pattern.link_events.add(link_event)
-            url_pattern.collections.add(this_link_collection)
-            url_pattern.save()
@@ -147,6 +147,4 @@ class Command(BaseCommand):
                 PageProjectAggregate.objects.filter(collection=collection).delete()
                 UserAggregate.objects.filter(collection=collection).delete()
 
-                call_command("fill_link_aggregates", collections=[collection.pk])
-                call_command("fill_pageproject_aggregates", collections=[collection.pk])
-                call_command("fill_user_aggregates", collections=[collection.pk])
+                call_command("fill_daily_aggregates", collections=[collection.pk])
@@ -1,5 +1,6 @@
 import os
 
+from extlinks.common.columnar import is_archive_name
 from extlinks.common.management.commands import BaseCommand
 from django.core.management import call_command
 
@@ -17,7 +18,7 @@ class Command(BaseCommand):
     def _handle(self, *args, **options):
         path = options['dir']
         for filename in os.listdir(path):
-            if filename.endswith('.json.gz') and filename.startswith('links_linkevent_'):
+            if is_archive_name(filename) and filename.startswith('links_linkevent_'):
                 file_path = os.path.join(path, filename)
                 if os.path.isfile(file_path):
                     call_command("linkevents_archive", "upload", file_path)
@@ -0,0 +1,172 @@
+import re
+
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+# Only links through The Wikipedia Library's proxy are matched against the
+# proxied ("www-example-com") form of a URL pattern.
+TWL_PROXY_HOST = "wikipedialibrary.idm.oclc"
+
+# JSON escapes of characters, such as those in non-ASCII URL patterns.
+UNICODE_ESCAPE = re.compile(r"\\u([0-9a-fA-F]{4})")
+
+PLAIN = "url"
+PROXIED = "proxied"
+
+
+class URLPatternMatcher:
+    """
+    A multi-pattern (Aho-Corasick) automaton compiled from URLPattern.url
+    values and their proxied variants.
+
+    Searching a link walks the automaton once, so the cost of matching is
+    proportional to the length of the link rather than to the number of
+    URL patterns, and no database queries are issued once it is built.
+    """
+
+    def __init__(self, url_patterns: Iterable):
+        # needle -> set of kinds (PLAIN and/or PROXIED) it was compiled from
+        self._kinds: Dict[str, Set[str]] = {}
+        # needle -> URLPatterns whose url or proxied url is that needle
+        self._patterns: Dict[str, List] = {}
+        # URLPattern -> position it was compiled in
+        self._order: Dict[object, int] = {}
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+
+        for url_pattern in url_patterns:
+            self._order.setdefault(url_pattern, len(self._order))
+            for needle, kind in (
+                (url_pattern.url, PLAIN),
+                (url_pattern.get_proxied_url, PROXIED),
+            ):
+                if not needle:
+                    continue
+                if needle not in self._kinds:
+                    self._kinds[needle] = set()
+                    self._patterns[needle] = []
+                    self._add(needle)
+                self._kinds[needle].add(kind)
+                if url_pattern not in self._patterns[needle]:
+                    self._patterns[needle].append(url_pattern)
+
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def _add(self, needle: str):
+        state = 0
+        for char in needle:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(needle)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state].extend(
+                    self._output[self._fail[next_state]]
+                )
+
+    def search(self, link: str) -> Iterator[Tuple[int, str]]:
+        """
+        Yields (start index, needle) for every needle occurring in the link.
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for index, char in enumerate(link):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for needle in output[state]:
+                yield index - len(needle) + 1, needle
+
+    def matches(self, link: str) -> List:
+        """
+        Returns every URLPattern whose url or proxied url is contained in
+        the link, in the order the patterns were compiled.
+        """
+        url_patterns = []
+        for _, needle in self.search(link):
+            for url_pattern in self._patterns[needle]:
+                if url_pattern not in url_patterns:
+                    url_patterns.append(url_pattern)
+        url_patterns.sort(key=self._order.__getitem__)
+        return url_patterns
+
+    def might_contain_tracked(self, text: str) -> bool:
+        """
+        Returns False if no link in the text (such as an undecoded stream
+        message) can be tracked. The whole text is searched once with the
+        same rule as is_tracked, which is much cheaper than decoding it and
+        checking every link separately.
+        """
+        # JSON encoders may escape slashes, and non-ASCII characters.
+        if "\\/" in text:
+            text = text.replace("\\/", "/")
+        if "\\u" in text:
+            text = (
+                UNICODE_ESCAPE.sub(lambda match: chr(int(match[1], 16)), text)
+                # Characters outside the BMP are escaped as surrogate pairs,
+                # which this joins.
+                .encode("utf-16", "surrogatepass")
+                .decode("utf-16", "surrogatepass")
+            )
+
+        proxied_url = TWL_PROXY_HOST in text
+        return any(
+            self._is_match(text, start, needle, proxied_url)
+            for start, needle in self.search(text)
+        )
+
+    def is_tracked(self, link: str) -> bool:
+        """
+        Returns True if the link points at a tracked URL pattern.
+        """
+        # We want to avoid link additions from e.g. InternetArchive
+        # where the URL takes the structure
+        # https://web.archive.org/https://test.com/
+        if link.count("//") >= 2:
+            return False
+
+        # If this looks like a TWL proxied URL we also need to match it
+        # against the proxied form of every URL pattern.
+        proxied_url = TWL_PROXY_HOST in link
+
+        return any(
+            self._is_match(link, start, needle, proxied_url)
+            for start, needle in self.search(link)
+        )
+
+    def _is_match(self, link: str, start: int, needle: str, proxied_url: bool):
+        """
+        Returns True if the needle found at start in the link is a tracked
+        URL pattern rather than part of another host.
+        """
+        if PLAIN not in self._kinds[needle] and not proxied_url:
+            return False
+
+        # If we track apa.org, we don't want to match iaapa.org
+        # so we make sure the URL is actually pointing at apa.org
+        if link[start - 2 : start] == "//" or link[start - 1 : start] == ".":
+            return True
+        # Proxy URLs may contain //www- not //www.
+        return proxied_url and link[start - 1 : start] == "-"
@@ -0,0 +1,184 @@
+import bisect
+import logging
+import time
+
+from typing import Iterable, List, Optional
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .stream import ConsumerStats
+
+logger = logging.getLogger("django")
+
+METRICS_CACHE_KEY = "linkevents_collect_metrics:{worker}"
+# Names of the collector workers currently publishing metrics.
+METRICS_WORKERS_CACHE_KEY = "linkevents_collect_metrics_workers"
+# Seconds between publishing the collector's metrics to the cache.
+METRICS_PUBLISH_INTERVAL = 15
+
+WRITE_BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+WRITE_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_SECONDS_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+
+# ConsumerStats values which go up and down rather than only up.
+GAUGES = ("frame_queue_high_water", "event_queue_high_water")
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets, Prometheus style.
+    """
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        # The last count is for observations above every bucket.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class CollectorMetrics:
+    """
+    Counters and histograms describing a linkevents_collect worker, which
+    are published to the cache so the web app can serve and check them.
+    """
+
+    def __init__(self, worker: str = "main", stats: Optional[ConsumerStats] = None):
+        self.worker = worker
+        self.stats = stats if stats is not None else ConsumerStats()
+        self.write_batch_size = Histogram(WRITE_BATCH_SIZE_BUCKETS)
+        self.write_seconds = Histogram(WRITE_SECONDS_BUCKETS)
+        self.lag_seconds = Histogram(LAG_SECONDS_BUCKETS)
+        # Seconds between the newest event written and writing it.
+        self.last_lag_seconds: Optional[float] = None
+        self.published_at: Optional[float] = None
+
+    def observe_write(self, link_events, seconds: float):
+        """
+        Records a batch of LinkEvents written in the given number of seconds.
+        """
+        self.write_batch_size.observe(len(link_events))
+        self.write_seconds.observe(seconds)
+        written_at = timezone.now()
+        for link_event in link_events:
+            self.lag_seconds.observe(
+                (written_at - link_event.timestamp).total_seconds()
+            )
+        if link_events:
+            newest = max(link_event.timestamp for link_event in link_events)
+            self.last_lag_seconds = (written_at - newest).total_seconds()
+
+    def as_dict(self):
+        return {
+            "worker": self.worker,
+            "updated": time.time(),
+            "last_lag_seconds": self.last_lag_seconds,
+            "counters": self.stats.as_dict(),
+            "histograms": {
+                "write_batch_size": self.write_batch_size.as_dict(),
+                "write_seconds": self.write_seconds.as_dict(),
+                "lag_seconds": self.lag_seconds.as_dict(),
+            },
+        }
+
+    def publish(self):
+        cache.set(METRICS_CACHE_KEY.format(worker=self.worker), self.as_dict(), None)
+        self.published_at = time.monotonic()
+
+    def publish_if_due(self):
+        if (
+            self.published_at is None
+            or time.monotonic() - self.published_at >= METRICS_PUBLISH_INTERVAL
+        ):
+            self.publish()
+
+
+def set_metrics_workers(workers: List[str]):
+    """
+    Records which workers' metrics should be read back, replacing any left
+    over from a previous run.
+    """
+    cache.set(METRICS_WORKERS_CACHE_KEY, list(workers), None)
+
+
+def get_published_metrics() -> List[dict]:
+    """
+    Returns the metrics last published by each collector worker.
+    """
+    workers = cache.get(METRICS_WORKERS_CACHE_KEY) or []
+    keys = [METRICS_CACHE_KEY.format(worker=worker) for worker in workers]
+    published = cache.get_many(keys)
+    return [published[key] for key in keys if key in published]
+
+
+def render_prometheus(published_metrics: List[dict]) -> str:
+    """
+    Renders published collector metrics in the Prometheus text format.
+    """
+    lines = []
+
+    def add(name, kind, samples):
+        metric = "linkevents_collect_" + name
+        lines.append("# TYPE {} {}".format(metric, kind))
+        for suffix, labels, value in samples:
+            lines.append(
+                "{}{}{{{}}} {}".format(
+                    metric,
+                    suffix,
+                    ",".join('{}="{}"'.format(key, val) for key, val in labels),
+                    value,
+                )
+            )
+
+    if not published_metrics:
+        return ""
+
+    for name in published_metrics[0]["counters"]:
+        add(
+            name,
+            "gauge" if name in GAUGES else "counter",
+            [
+                ("", [("worker", m["worker"])], m["counters"].get(name, 0))
+                for m in published_metrics
+            ],
+        )
+
+    for name in ("last_lag_seconds", "updated"):
+        add(
+            name,
+            "gauge",
+            [
+                ("", [("worker", m["worker"])], m[name])
+                for m in published_metrics
+                if m[name] is not None
+            ],
+        )
+
+    for name in published_metrics[0]["histograms"]:
+        samples = []
+        for m in published_metrics:
+            histogram = m["histograms"][name]
+            labels = [("worker", m["worker"])]
+            cumulative = 0
+            for le, count in zip(histogram["buckets"] + ["+Inf"], histogram["counts"]):
+                cumulative += count
+                samples.append(("_bucket", labels + [("le", le)], cumulative))
+            samples.append(("_sum", labels, histogram["sum"]))
+            samples.append(("_count", labels, histogram["count"]))
+        add(name, "histogram", samples)
+
+    return "\n".join(lines) + "\n"
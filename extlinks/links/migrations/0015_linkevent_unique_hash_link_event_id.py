@@ -0,0 +1,58 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_link_events(apps, schema_editor):
+    """
+    Clears empty hashes so older events are left out of the unique
+    constraint, then keeps the oldest LinkEvent for every remaining
+    hash_link_event_id.
+    """
+    LinkEvent = apps.get_model("links", "LinkEvent")
+    LinkEvent.objects.filter(hash_link_event_id="").update(hash_link_event_id=None)
+
+    duplicates = (
+        LinkEvent.objects.filter(hash_link_event_id__isnull=False)
+        .values("hash_link_event_id")
+        .annotate(count=Count("id"), first_id=Min("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        LinkEvent.objects.filter(
+            hash_link_event_id=duplicate["hash_link_event_id"]
+        ).exclude(id=duplicate["first_id"]).delete()
+
+
+def null_hash_link_event_id_to_blank(apps, schema_editor):
+    LinkEvent = apps.get_model("links", "LinkEvent")
+    LinkEvent.objects.filter(hash_link_event_id__isnull=True).update(
+        hash_link_event_id=""
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("links", "0014_migrate_url_pattern_relationships"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="linkevent",
+            name="hash_link_event_id",
+            field=models.CharField(blank=True, max_length=256, null=True),
+        ),
+        migrations.RunPython(
+            delete_duplicate_link_events, null_hash_link_event_id_to_blank
+        ),
+        migrations.RemoveIndex(
+            model_name="linkevent",
+            name="links_linke_hash_li_594ad2_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="linkevent",
+            constraint=models.UniqueConstraint(
+                fields=("hash_link_event_id",), name="unique_hash_link_event_id"
+            ),
+        ),
+    ]
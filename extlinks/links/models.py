@@ -1,37 +1,108 @@
 import hashlib
 import logging
+import time
 from datetime import date
 
 from django.contrib.contenttypes.fields import GenericRelation, GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils.functional import cached_property
 
+from .matcher import URLPatternMatcher
+
 logger = logging.getLogger("django")
 
+URL_PATTERN_VERSION_KEY = "url_pattern_cache_version"
+# Seconds a process trusts its URL pattern snapshot before checking the
+# shared version number for changes made by other processes.
+URL_PATTERN_VERSION_CHECK_INTERVAL = 5
+
+
+def get_url_pattern_version():
+    """
+    Returns the shared URL pattern version number, initialising it if it
+    isn't in the cache yet (or was evicted).
+    """
+    # Seeding from the clock keeps the version increasing even when the
+    # key was evicted and has to be recreated.
+    cache.add(URL_PATTERN_VERSION_KEY, time.time_ns(), None)
+    return cache.get(URL_PATTERN_VERSION_KEY)
+
+
+def bump_url_pattern_version():
+    """
+    Invalidates every process' URL pattern snapshot.
+    """
+    URLPatternManager.invalidate_snapshot()
+    try:
+        version = cache.incr(URL_PATTERN_VERSION_KEY)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(URL_PATTERN_VERSION_KEY, version, None)
+    logger.info("bump url_pattern_cache_version to %s", version)
 
 
 class URLPatternManager(models.Manager):
     models.CharField.register_lookup(models.functions.Length)
+
+    # Process-local snapshot of every URLPattern, shared by all managers.
+    _snapshot_version = None
+    _snapshot_patterns = None
+    _snapshot_matcher = None
+    _snapshot_checked_at = 0.0
+
+    def _load_snapshot(self):
+        manager = URLPatternManager
+        now = time.monotonic()
+        if (
+            manager._snapshot_patterns is not None
+            and now - manager._snapshot_checked_at < URL_PATTERN_VERSION_CHECK_INTERVAL
+        ):
+            return
+
+        version = get_url_pattern_version()
+        manager._snapshot_checked_at = now
+        if (
+            manager._snapshot_patterns is not None
+            and version is not None
+            and version == manager._snapshot_version
+        ):
+            return
+
+        patterns = list(self.select_related("collection__organisation"))
+        manager._snapshot_version = version
+        manager._snapshot_patterns = patterns
+        manager._snapshot_matcher = URLPatternMatcher(patterns)
+        logger.info("loaded url pattern snapshot version %s", version)
+
+    @staticmethod
+    def invalidate_snapshot():
+        URLPatternManager._snapshot_patterns = None
+        URLPatternManager._snapshot_matcher = None
+
     def cached(self):
-        cached_patterns = cache.get('url_pattern_cache')
-        if not cached_patterns:
-            cached_patterns = self.all()
-            logger.info('set url_pattern_cache')
-            cache.set('url_pattern_cache', cached_patterns, None)
-        return cached_patterns
+        """
+        Returns every URLPattern, with its collection and organisation
+        already loaded, from this process' snapshot. The snapshot is only
+        reloaded when the shared version number changes.
+        """
+        self._load_snapshot()
+        return URLPatternManager._snapshot_patterns
+
+    def matcher(self):
+        """
+        Returns a URLPatternMatcher compiled from the current snapshot.
+        """
+        self._load_snapshot()
+        return URLPatternManager._snapshot_matcher
 
     def matches(self, link):
         # All URL patterns matching this link
-        tracked_urls = self.cached()
-        return [
-            pattern
-            for pattern in tracked_urls
-            if pattern.url in link or pattern.get_proxied_url in link
-        ]
+        return self.matcher().matches(link)
+
 
 class URLPattern(models.Model):
     class Meta:
@@ -69,9 +140,21 @@ class URLPattern(models.Model):
 
 
 @receiver(post_save, sender=URLPattern)
+@receiver(post_delete, sender=URLPattern)
 def delete_url_pattern_cache(sender, instance, **kwargs):
-    if cache.delete("url_pattern_cache"):
-        logger.info("delete url_pattern_cache")
+    bump_url_pattern_version()
+
+
+@receiver(m2m_changed, sender=URLPattern.collections.through)
+def delete_url_pattern_cache_on_collections_change(
+    sender, instance, action, pk_set, **kwargs
+):
+    # Adding relations that already exist sends an empty pk_set, which
+    # doesn't change anything we have cached.
+    if action == "post_clear" or (
+        action in ("post_add", "post_remove") and pk_set
+    ):
+        bump_url_pattern_version()
 
 
 class LinkSearchTotal(models.Model):
@@ -90,6 +173,23 @@ class LinkSearchTotal(models.Model):
     total = models.PositiveIntegerField()
 
 
+class StreamCheckpoint(models.Model):
+    """
+    The id (Last-Event-ID) of the last EventStream message the collector
+    has processed and written everything for, so it can resume from there.
+    """
+
+    class Meta:
+        app_label = "links"
+
+    stream = models.CharField(max_length=255, unique=True)
+    last_event_id = models.TextField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.stream
+
+
 class LinkEvent(models.Model):
     """
     Stores data from the page-links-change EventStream
@@ -100,12 +200,13 @@ class LinkEvent(models.Model):
     class Meta:
         app_label = "links"
         get_latest_by = "timestamp"
+        # The same link in the same stream event must only be stored once.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hash_link_event_id"], name="unique_hash_link_event_id"
+            )
+        ]
         indexes = [
-            models.Index(
-                fields=[
-                    "hash_link_event_id",
-                ]
-            ),
             models.Index(
                 fields=[
                     "timestamp",
@@ -136,7 +237,9 @@ class LinkEvent(models.Model):
     page_namespace = models.IntegerField()
     event_id = models.CharField(max_length=36)
     user_is_bot = models.BooleanField(default=False)
-    hash_link_event_id = models.CharField(max_length=256, blank=True)
+    # Events collected before the hash was introduced don't have one, and
+    # are left out of the unique constraint by storing NULL.
+    hash_link_event_id = models.CharField(max_length=256, blank=True, null=True)
 
     # Were links added or removed?
     REMOVED = 0
@@ -161,9 +264,23 @@ class LinkEvent(models.Model):
             if self in link_events:
                 return url_pattern.collection.organisation
 
-    def save(self, **kwargs):
-        link_event_id = self.link + self.event_id
+    @staticmethod
+    def get_hash_link_event_id(link, event_id):
+        link_event_id = link + event_id
         hash = hashlib.sha256()
         hash.update(link_event_id.encode("utf-8"))
-        self.hash_link_event_id = hash.hexdigest()
+        return hash.hexdigest()
+
+    def save(self, **kwargs):
+        self.hash_link_event_id = self.get_hash_link_event_id(
+            self.link, self.event_id
+        )
         super().save(**kwargs)
+
+
+@receiver(pre_save, sender=LinkEvent)
+def blank_hash_link_event_id_to_null(sender, instance, **kwargs):
+    # Archived events loaded back in with loaddata skip LinkEvent.save(), and
+    # older ones have an empty hash which would collide with each other.
+    if not instance.hash_link_event_id:
+        instance.hash_link_event_id = None
@@ -0,0 +1,388 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+import zlib
+
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+
+from .models import URL_PATTERN_VERSION_CHECK_INTERVAL, URLPattern
+from .writer import DEFAULT_CHECKPOINT_INTERVAL
+
+logger = logging.getLogger("django")
+
+DEFAULT_QUEUE_SIZE = 1000
+# Ways of partitioning the stream between collector workers.
+SHARD_BY_ID = "id"
+SHARD_BY_DOMAIN = "domain"
+# Seconds between logging the consumer's stats.
+STATS_LOG_INTERVAL = 60
+
+
+def has_tracked_link(event_data, matcher):
+    """
+    Returns True if any external link added or removed in the event is
+    tracked by one of the matcher's URL patterns.
+    """
+    for key in ("added_links", "removed_links"):
+        for link in event_data.get(key, []):
+            if link.get("external") and matcher.is_tracked(link["link"]):
+                return True
+    return False
+
+
+def decode_message(event_id, data, matcher, stats, shard=None):
+    """
+    Returns the decoded event of a stream message, or None if it belongs to
+    another shard, has no link which might be tracked, or isn't valid JSON.
+    Messages are ruled out before decoding wherever possible.
+    """
+    if shard is not None and shard.contains_message(event_id) is False:
+        stats.frames_other_shard += 1
+        return None
+
+    if not matcher.might_contain_tracked(data):
+        stats.frames_skipped += 1
+        return None
+
+    try:
+        event_data = json.loads(data)
+    except ValueError:
+        stats.decode_errors += 1
+        return None
+    stats.events_decoded += 1
+
+    if shard is not None and not shard.contains_message(event_id, event_data):
+        stats.frames_other_shard += 1
+        return None
+    return event_data
+
+
+class Shard(NamedTuple):
+    """
+    One of count hash partitions of the stream, keyed either on the SSE id
+    of each message or on the wiki domain of the event.
+    """
+
+    index: int
+    count: int
+    key: str = SHARD_BY_ID
+
+    def contains(self, value) -> bool:
+        # crc32 rather than hash() so every worker agrees on the partition.
+        return zlib.crc32((value or "").encode("utf-8")) % self.count == self.index
+
+    def contains_message(self, event_id, event_data=None):
+        """
+        Returns whether the message belongs to this shard. When sharding by
+        domain, returns None until the decoded event_data is given.
+        """
+        if self.key == SHARD_BY_ID:
+            return self.contains(event_id)
+        if event_data is None:
+            return None
+        return self.contains(event_data.get("meta", {}).get("domain"))
+
+    def checkpoint_stream(self, stream):
+        return "{stream}#{key}:{index}/{count}".format(stream=stream, **self._asdict())
+
+
+class ConsumerStats:
+    """
+    Counters describing how events move through AsyncEventStreamConsumer.
+
+    frames_skipped counts messages which weren't decoded because they had
+    no link which might be tracked. links_* count the external links in
+    decoded events, and duplicates_skipped tracked links which had already
+    been collected. The *_waits and *_wait_seconds counters
+    record how often, and for how long, a stage was held up because the
+    next stage's queue was full.
+    """
+
+    def __init__(self):
+        self.frames_read = 0
+        self.frames_other_shard = 0
+        self.frames_skipped = 0
+        self.decode_errors = 0
+        self.events_decoded = 0
+        self.events_tracked = 0
+        self.events_processed = 0
+        self.links_seen = 0
+        self.links_tracked = 0
+        self.duplicates_skipped = 0
+        self.reader_waits = 0
+        self.reader_wait_seconds = 0.0
+        self.parser_waits = 0
+        self.parser_wait_seconds = 0.0
+        self.frame_queue_high_water = 0
+        self.event_queue_high_water = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return ", ".join(
+            "{}={}".format(key, round(value, 3)) for key, value in self.as_dict().items()
+        )
+
+
+class AsyncEventStreamConsumer:
+    """
+    Consumes the EventStream in three decoupled stages:
+
+    - a reader thread iterating the (blocking) SSE client and handing raw
+      message data to the event loop,
+    - a parse stage decoding the JSON and dropping events which don't touch
+      a tracked link, with a URL pattern matcher refreshed in the background
+      every URL_PATTERN_VERSION_CHECK_INTERVAL seconds,
+    - a persist stage handing tracked events to process_event and the
+      LinkEventWriter, and recording the stream position reached.
+
+    Stages are connected by bounded queues, so a slow database write only
+    holds up reading the stream once both queues are full.
+    """
+
+    def __init__(
+        self,
+        event_source,
+        process_event,
+        writer,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+        shard=None,
+        stats=None,
+    ):
+        """
+        Parameters
+        ----------
+        event_source : callable
+            Returns an iterable of SSE events. It is called from the reader
+            thread, so connecting doesn't block the event loop.
+
+        process_event : callable
+            Called with each decoded, tracked event. Runs in the thread
+            owning the database connection.
+
+        writer : LinkEventWriter
+            Flushed when it is due and once the consumer stops.
+
+        queue_size : int
+            Maximum number of items waiting between two stages.
+
+        checkpoint_interval : int
+            Number of stream messages between flushing the writer so the
+            stream position is saved, even when nothing is tracked.
+
+        shard : Shard
+            If given, only messages in this partition of the stream are
+            processed.
+
+        stats : ConsumerStats
+            Counters to update, so they can be shared with the caller.
+        """
+        self.event_source = event_source
+        self.process_event = process_event
+        self.writer = writer
+        self.queue_size = queue_size
+        self.checkpoint_interval = checkpoint_interval
+        self.shard = shard
+        self.stats = stats if stats is not None else ConsumerStats()
+        self._stopping = threading.Event()
+        self._finished = threading.Event()
+
+    def stop(self):
+        """
+        Asks the consumer to stop once the reader sees its next frame.
+        Everything read up to then is still processed and written.
+        """
+        self._stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.frames = asyncio.Queue(self.queue_size)
+        self.events = asyncio.Queue(self.queue_size)
+
+        # The matcher is fetched on the thread owning the database
+        # connection, like the persist stage's writes.
+        self.get_matcher = sync_to_async(URLPattern.objects.matcher)
+        self.matcher = await self.get_matcher()
+
+        reader_done = loop.create_future()
+        threading.Thread(
+            target=self._read_frames,
+            args=(loop, reader_done),
+            name="linkevents-reader",
+            daemon=True,
+        ).start()
+
+        stages = [
+            reader_done,
+            loop.create_task(self._parse()),
+            loop.create_task(self._persist()),
+        ]
+        stats_logger = loop.create_task(self._log_stats())
+        matcher_refresher = loop.create_task(self._refresh_matcher())
+        try:
+            done, pending = await asyncio.wait(
+                stages, return_when=asyncio.FIRST_EXCEPTION
+            )
+            for stage in done:
+                stage.result()
+        finally:
+            self.stop()
+            self._finished.set()
+            stats_logger.cancel()
+            matcher_refresher.cancel()
+            for stage in stages:
+                stage.cancel()
+            self._log_stats_once()
+
+    def _read_frames(self, loop, reader_done):
+        try:
+            for event in self.event_source():
+                if self._stopping.is_set():
+                    break
+                # Heartbeats and other non-message events carry no data.
+                if event.event != "message" or not event.data:
+                    continue
+                self.stats.frames_read += 1
+                if not self._put_from_thread(
+                    loop, (event.id, event.data), self._stopping
+                ):
+                    return
+            # Once stopping, still wait for room for the end marker so the
+            # later stages drain what was read, unless run() has given up.
+            self._put_from_thread(loop, None, self._finished)
+        except BaseException as e:
+            loop.call_soon_threadsafe(self._set_exception, reader_done, e)
+        else:
+            loop.call_soon_threadsafe(self._set_result, reader_done)
+
+    def _put_from_thread(self, loop, data, abandon):
+        """
+        Blocks the reader until the parse stage has room for the frame.
+        Returns False if the abandon event was set while waiting.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._put_frame(data), loop)
+        while True:
+            try:
+                future.result(timeout=1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if abandon.is_set():
+                    future.cancel()
+                    return False
+
+    async def _put_frame(self, frame):
+        if self.frames.full():
+            self.stats.reader_waits += 1
+            started = time.monotonic()
+            await self.frames.put(frame)
+            self.stats.reader_wait_seconds += time.monotonic() - started
+        else:
+            await self.frames.put(frame)
+        self.stats.frame_queue_high_water = max(
+            self.stats.frame_queue_high_water, self.frames.qsize()
+        )
+
+    async def _refresh_matcher(self):
+        # Refreshed outside the parse stage, so parsing is never held up
+        # behind the writer, and keeps the current matcher if this fails.
+        while True:
+            await asyncio.sleep(URL_PATTERN_VERSION_CHECK_INTERVAL)
+            try:
+                self.matcher = await self.get_matcher()
+            except Exception:
+                logger.exception("Unable to refresh the URL pattern matcher")
+
+    async def _parse(self):
+        messages = 0
+        while True:
+            frame = await self.frames.get()
+            if frame is None:
+                await self.events.put(None)
+                return
+            event_id, data = frame
+            messages += 1
+
+            matcher = self.matcher
+            event_data = decode_message(
+                event_id, data, matcher, self.stats, self.shard
+            )
+            if event_data is not None and has_tracked_link(event_data, matcher):
+                self.stats.events_tracked += 1
+            elif messages % self.checkpoint_interval == 0:
+                # Untracked messages only pass through to move the
+                # checkpoint along.
+                event_data = None
+            else:
+                continue
+
+            item = (event_id, event_data)
+            if self.events.full():
+                self.stats.parser_waits += 1
+                started = time.monotonic()
+                await self.events.put(item)
+                self.stats.parser_wait_seconds += time.monotonic() - started
+            else:
+                await self.events.put(item)
+            self.stats.event_queue_high_water = max(
+                self.stats.event_queue_high_water, self.events.qsize()
+            )
+
+    async def _persist(self):
+        process_event = sync_to_async(self._process_event)
+        flush_if_due = sync_to_async(self.writer.flush_if_due)
+        while True:
+            try:
+                item = await asyncio.wait_for(
+                    self.events.get(), timeout=self.writer.flush_interval or None
+                )
+            except asyncio.TimeoutError:
+                # Nothing tracked came in for a while; don't sit on the
+                # events we already have.
+                await flush_if_due()
+                continue
+
+            if item is None:
+                await sync_to_async(self.writer.flush)()
+                return
+            await process_event(*item)
+
+    def _process_event(self, event_id, event_data):
+        if event_data is None:
+            self.writer.set_position(event_id)
+            self.writer.flush()
+            return
+
+        self.process_event(event_data)
+        self.stats.events_processed += 1
+        self.writer.set_position(event_id)
+        self.writer.flush_if_due()
+
+    async def _log_stats(self):
+        while True:
+            await asyncio.sleep(STATS_LOG_INTERVAL)
+            self._log_stats_once()
+
+    def _log_stats_once(self):
+        logger.info(
+            "EventStream consumer stats: %s, frame queue %d, event queue %d",
+            self.stats,
+            self.frames.qsize(),
+            self.events.qsize(),
+        )
+
+    @staticmethod
+    def _set_result(future):
+        if not future.done():
+            future.set_result(None)
+
+    @staticmethod
+    def _set_exception(future, exception):
+        if not future.done():
+            future.set_exception(exception)
@@ -1,27 +1,51 @@
-import json, tempfile, glob, gzip, os
+import json, tempfile, glob, gzip, os, shutil, threading, time
+
+from asgiref.sync import async_to_sync
 
 from datetime import datetime, date, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+from django.core import serializers
+from django.core.cache import cache
 from django.core.management import call_command
-from django.test import TestCase, TransactionTestCase
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 
 from unittest import mock
 
 import swiftclient
+from sseclient import Event
 
 from extlinks.aggregates.models import (
     LinkAggregate,
     PageProjectAggregate,
     UserAggregate,
 )
+from extlinks.common.columnar import is_columnar
 from extlinks.organisations.factories import (
     OrganisationFactory,
     CollectionFactory,
     UserFactory,
 )
+from extlinks.organisations.models import Organisation
 from .factories import LinkEventFactory, URLPatternFactory
 from .helpers import link_is_tracked, reverse_host
-from .models import URLPattern, LinkEvent
+from .management.commands.linkevents_collect import (
+    Command as LinkEventsCollectCommand,
+    FlushingEventSource,
+)
+from .matcher import URLPatternMatcher
+from .metrics import CollectorMetrics, Histogram, render_prometheus
+from .stream import AsyncEventStreamConsumer, Shard
+from .writer import LinkEventWriter, PendingLinkEvent, RecentHashes
+from .models import (
+    URL_PATTERN_VERSION_KEY,
+    URLPattern,
+    URLPatternManager,
+    LinkEvent,
+    StreamCheckpoint,
+)
 
 class BaseTest(TestCase):
     @classmethod
@@ -134,6 +158,182 @@ class LinksTrackedTest(BaseTest):
         )
 
 
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class URLPatternMatcherTest(BaseTest):
+    def setUp(self):
+        self.jstor = URLPatternFactory(url="www.jstor.org")
+        self.apa = URLPatternFactory(url="apa.org")
+        self.gale = URLPatternFactory(url="gale.com")
+
+    def test_matcher_does_not_query_database(self):
+        """
+        Test that once the matcher is compiled, matching links doesn't hit
+        the database
+        """
+        URLPattern.objects.matcher()
+        with self.assertNumQueries(0):
+            self.assertTrue(link_is_tracked("https://www.jstor.org/stable/1"))
+            self.assertFalse(link_is_tracked("https://iaapa.org/"))
+            self.assertEqual(
+                URLPattern.objects.matches("https://gale.com/a"), [self.gale]
+            )
+
+    def test_matcher_overlapping_patterns(self):
+        """
+        Test that the matcher finds every pattern contained in a link, even
+        when patterns overlap one another
+        """
+        matcher = URLPatternMatcher([self.apa, URLPatternFactory(url="papa.org")])
+        self.assertEqual(len(matcher.matches("https://papa.org/")), 2)
+        self.assertEqual(len(matcher.matches("https://apa.org/")), 1)
+
+    def test_might_contain_tracked(self):
+        matcher = URLPattern.objects.matcher()
+        self.assertTrue(
+            matcher.might_contain_tracked(
+                '{"link": "https://www.jstor.org/stable/1", "external": true}'
+            )
+        )
+        # Subdomains of a tracked host, and JSON escaped slashes
+        self.assertTrue(
+            matcher.might_contain_tracked('{"link": "https:\\/\\/search.gale.com\\/a"}')
+        )
+        self.assertTrue(
+            matcher.might_contain_tracked(
+                '{"link": "https://www-jstor-org.wikipedialibrary.idm.oclc.org/"}'
+            )
+        )
+        self.assertFalse(
+            matcher.might_contain_tracked(
+                '{"uri": "https://en.wikipedia.org/wiki/Page", '
+                '"link": "https://iaapa.org/", "other": "//scholar.google.com/"}'
+            )
+        )
+
+    def test_might_contain_tracked_unicode_escapes(self):
+        """
+        Test that the pre-filter matches non-ASCII URL patterns in messages
+        escaping non-ASCII characters
+        """
+        URLPatternFactory(url="bücher.example.de")
+        URLPatternFactory(url="example.org/𝔸")
+        matcher = URLPattern.objects.matcher()
+
+        self.assertTrue(
+            matcher.might_contain_tracked(
+                '{"link": "https:\\/\\/b\\u00fccher.example.de\\/a"}'
+            )
+        )
+        self.assertTrue(
+            matcher.might_contain_tracked(
+                '{"link": "https://example.org/\\ud835\\udd38/b"}'
+            )
+        )
+        self.assertFalse(
+            matcher.might_contain_tracked(
+                '{"link": "https://b\\u00e4cher.example.de/a"}'
+            )
+        )
+
+    def test_might_contain_tracked_path_pattern(self):
+        """
+        Test that the pre-filter accepts every link is_tracked accepts, for
+        URL patterns which include a path
+        """
+        URLPatternFactory(url="example.com/foo")
+        matcher = URLPattern.objects.matcher()
+        link = "https://www.example.com/foo/bar"
+
+        self.assertTrue(matcher.is_tracked(link))
+        self.assertTrue(
+            matcher.might_contain_tracked(
+                '{"link": "https:\\/\\/www.example.com\\/foo\\/bar"}'
+            )
+        )
+        # is_tracked matches the pattern after the host too.
+        link = "https://mirror.org/cache.example.com/foo"
+        self.assertTrue(matcher.is_tracked(link))
+        self.assertTrue(matcher.might_contain_tracked(f'{{"link": "{link}"}}'))
+
+    def test_matcher_matches_proxied_url(self):
+        """
+        Test that URLPatternManager.matches returns the patterns of proxied
+        links
+        """
+        self.assertEqual(
+            URLPattern.objects.matches(
+                "https://www-jstor-org.wikipedialibrary.idm.oclc.org/stable/1"
+            ),
+            [self.jstor],
+        )
+
+    def test_matcher_rebuilt_on_save(self):
+        """
+        Test that saving a URLPattern invalidates the compiled matcher
+        """
+        self.assertFalse(link_is_tracked("https://www.example.com/"))
+        URLPatternFactory(url="example.com")
+        self.assertTrue(link_is_tracked("https://www.example.com/"))
+
+    def test_matcher_rebuilt_on_delete(self):
+        """
+        Test that deleting a URLPattern invalidates the compiled matcher
+        """
+        self.assertTrue(link_is_tracked("https://gale.com/"))
+        self.gale.delete()
+        self.assertFalse(link_is_tracked("https://gale.com/"))
+
+    def test_snapshot_reloaded_on_collections_change(self):
+        """
+        Test that adding a collection to a URLPattern bumps the shared
+        version so the snapshot is reloaded
+        """
+        URLPattern.objects.cached()
+        version = cache.get(URL_PATTERN_VERSION_KEY)
+        self.jstor.collections.add(CollectionFactory())
+        self.assertGreater(cache.get(URL_PATTERN_VERSION_KEY), version)
+        self.assertIsNone(URLPatternManager._snapshot_patterns)
+
+    def test_snapshot_reloaded_on_version_bump(self):
+        """
+        Test that a version bump from another process is picked up once the
+        check interval has elapsed, and not before
+        """
+        URLPattern.objects.matcher()
+        # Simulate another process adding a pattern and bumping the version.
+        URLPattern.objects.bulk_create([URLPattern(url="example.com")])
+        cache.incr(URL_PATTERN_VERSION_KEY)
+
+        self.assertFalse(link_is_tracked("https://www.example.com/"))
+        URLPatternManager._snapshot_checked_at = 0.0
+        self.assertTrue(link_is_tracked("https://www.example.com/"))
+
+    def test_snapshot_not_reloaded_without_version_bump(self):
+        """
+        Test that the snapshot isn't reloaded from the database when the
+        version hasn't changed
+        """
+        URLPattern.objects.cached()
+        URLPatternManager._snapshot_checked_at = 0.0
+        with self.assertNumQueries(0):
+            URLPattern.objects.cached()
+
+    def test_snapshot_resolves_organisation(self):
+        """
+        Test that snapshot patterns carry their collection's organisation
+        """
+        collection = CollectionFactory()
+        self.jstor.collection = collection
+        self.jstor.save()
+        pattern = URLPattern.objects.matches("https://www.jstor.org/")[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                pattern.collection.organisation.pk, collection.organisation.pk
+            )
+
+
 class URLPatternModelTest(BaseTest):
     def test_get_proxied_url_1(self):
         """
@@ -318,6 +518,515 @@ class LinkEventsCollectCommandTest(BaseTest):
         self.assertEqual(LinkEvent.objects.count(), 2)
         self.assertEqual("JSTOR", URLPattern.objects.first().collections.first().name)
 
+    @mock.patch.object(LinkEventsCollectCommand, "_process_events")
+    def test_management_command_historical_resumes_from_checkpoint(
+        self, mock_process_events
+    ):
+        """
+        Test that --historical sends the checkpointed Last-Event-ID rather
+        than looking up the latest LinkEvent
+        """
+        stream_url = "https://stream.wikimedia.org/v2/stream/page-links-change"
+        StreamCheckpoint.objects.create(
+            stream=stream_url, last_event_id="[{\"offset\": 1}]"
+        )
+        call_command("linkevents_collect", historical=True)
+        mock_process_events.assert_called_once_with(
+            stream_url, "[{\"offset\": 1}]"
+        )
+
+    @mock.patch.object(LinkEventsCollectCommand, "_process_events")
+    def test_management_command_historical_without_checkpoint(
+        self, mock_process_events
+    ):
+        LinkEventFactory(
+            link="https://www.jstor.org/stable/1",
+            timestamp=datetime(2020, 8, 20, 21, 22, 46, tzinfo=timezone.utc),
+        )
+        call_command("linkevents_collect", historical=True)
+        mock_process_events.assert_called_once_with(
+            "https://stream.wikimedia.org/v2/stream/page-links-change"
+            "?since=2020-08-20T21:22:46Z",
+            None,
+        )
+
+    def test_management_command_skips_already_collected_events(self):
+        """
+        Test that replaying an event after a restart doesn't duplicate it
+        """
+        with self.assertRaises(SystemExit):
+            call_command("linkevents_collect", test=self.event_data2)
+        # The event is from 2020, so it is only seeded into the duplicate
+        # check with a long enough window; otherwise the unique constraint
+        # rejects the replayed rows.
+        with self.assertRaises(SystemExit):
+            call_command("linkevents_collect", test=self.event_data2, seed_hours=0)
+        with self.assertRaises(SystemExit):
+            call_command(
+                "linkevents_collect", test=self.event_data2, seed_hours=24 * 365 * 100
+            )
+        self.assertEqual(LinkEvent.objects.count(), 2)
+
+class LinkEventWriterTest(BaseTest):
+    def setUp(self):
+        self.organisation = OrganisationFactory(name="JSTOR")
+        self.collection = CollectionFactory(
+            name="JSTOR", organisation=self.organisation
+        )
+        self.url_pattern = URLPatternFactory(
+            url="www.jstor.org", collection=self.collection
+        )
+        self.user = UserFactory(username="User1")
+        self.organisation.username_list.add(self.user)
+
+    def _pending(self, event_id, username="User1"):
+        return PendingLinkEvent(
+            link_event=LinkEvent(
+                link="https://www.jstor.org/stable/" + event_id,
+                timestamp=datetime(2020, 8, 20, tzinfo=timezone.utc),
+                domain="en.wikipedia.org",
+                page_title="Page1",
+                page_namespace=0,
+                event_id=event_id,
+                change=LinkEvent.ADDED,
+            ),
+            username=username,
+            url_patterns=[self.url_pattern],
+            collection=self.collection,
+            organisation=self.organisation,
+        )
+
+    def test_writer_buffers_until_batch_size(self):
+        """
+        Test that events are only written once the batch is full
+        """
+        writer = LinkEventWriter(batch_size=3, flush_interval=60)
+        writer.add(self._pending("1"))
+        writer.add(self._pending("2"))
+        self.assertEqual(LinkEvent.objects.count(), 0)
+        self.assertEqual(len(writer), 2)
+
+        writer.add(self._pending("3"))
+        self.assertEqual(LinkEvent.objects.count(), 3)
+        self.assertEqual(len(writer), 0)
+
+    def test_writer_flushes_when_due(self):
+        """
+        Test that pending events are written once the flush interval passes
+        """
+        writer = LinkEventWriter(batch_size=100, flush_interval=0)
+        writer.add(self._pending("1"))
+        self.assertEqual(LinkEvent.objects.count(), 1)
+
+    def test_writer_skips_duplicates_in_buffer(self):
+        """
+        Test that the same link and event id is only buffered once
+        """
+        writer = LinkEventWriter(batch_size=100, flush_interval=60)
+        writer.add(self._pending("1"))
+        writer.add(self._pending("1"))
+        self.assertEqual(writer.flush(), 1)
+
+    def test_writer_flush_fills_relations(self):
+        """
+        Test that flushing creates users, sets the user list flag, the
+        event's url pattern and the pattern's collections
+        """
+        writer = LinkEventWriter(batch_size=100, flush_interval=60)
+        writer.add(self._pending("1"))
+        writer.add(self._pending("2", username="NewUser"))
+        writer.flush()
+
+        on_list = LinkEvent.objects.get(event_id="1")
+        self.assertTrue(on_list.on_user_list)
+        self.assertEqual(on_list.username, self.user)
+        self.assertEqual(on_list.content_object, self.url_pattern)
+        self.assertEqual(
+            on_list.hash_link_event_id,
+            LinkEvent.get_hash_link_event_id(on_list.link, on_list.event_id),
+        )
+
+        not_on_list = LinkEvent.objects.get(event_id="2")
+        self.assertFalse(not_on_list.on_user_list)
+        self.assertEqual(not_on_list.username.username, "NewUser")
+
+        self.assertEqual(
+            list(self.url_pattern.collections.all()), [self.collection]
+        )
+
+    def test_writer_flush_query_count_independent_of_batch(self):
+        """
+        Test that a flush issues the same number of queries however many
+        events are buffered
+        """
+        writer = LinkEventWriter(batch_size=100, flush_interval=60)
+        for event_id in range(20):
+            writer.add(self._pending(str(event_id)))
+        # User lists come from the organisation's cached snapshot
+        Organisation.objects.user_list_ids(self.organisation.pk)
+        # SAVEPOINT/RELEASE, users, events, collections
+        with self.assertNumQueries(5):
+            writer.flush()
+        self.assertEqual(LinkEvent.objects.count(), 20)
+
+    def test_writer_saves_checkpoint_on_flush(self):
+        """
+        Test that the stream position is only saved along with the events
+        before it
+        """
+        writer = LinkEventWriter(
+            batch_size=100, flush_interval=60, checkpoint_stream="stream"
+        )
+        writer.add(self._pending("1"))
+        writer.set_position("[{\"offset\": 1}]")
+        self.assertFalse(StreamCheckpoint.objects.exists())
+
+        writer.flush()
+        self.assertEqual(LinkEvent.objects.count(), 1)
+        self.assertEqual(
+            StreamCheckpoint.objects.get(stream="stream").last_event_id,
+            "[{\"offset\": 1}]",
+        )
+        # Nothing to write if the position hasn't moved
+        with self.assertNumQueries(0):
+            writer.flush()
+
+    def test_writer_skips_recently_written_events(self):
+        """
+        Test that events written by an earlier flush aren't buffered again
+        """
+        writer = LinkEventWriter(batch_size=100, flush_interval=60)
+        writer.add(self._pending("1"))
+        writer.flush()
+        writer.add(self._pending("1"))
+        self.assertEqual(len(writer), 0)
+
+    def test_writer_ignores_events_already_in_database(self):
+        """
+        Test that the unique constraint catches duplicates the writer
+        doesn't remember
+        """
+        LinkEventWriter().add(self._pending("1"))
+        LinkEventWriter(batch_size=1).add(self._pending("1"))
+        writer = LinkEventWriter(batch_size=100, flush_interval=60)
+        writer.add(self._pending("1"))
+        writer.add(self._pending("2"))
+        writer.flush()
+        self.assertEqual(LinkEvent.objects.count(), 2)
+
+    def test_writer_records_metrics(self):
+        """
+        Test that each write is recorded in the collector's metrics
+        """
+        metrics = CollectorMetrics()
+        writer = LinkEventWriter(batch_size=100, flush_interval=60, metrics=metrics)
+        writer.add(self._pending("1"))
+        writer.add(self._pending("2"))
+        writer.flush()
+        self.assertEqual(metrics.write_batch_size.count, 1)
+        self.assertEqual(metrics.write_batch_size.sum, 2)
+        self.assertEqual(metrics.write_seconds.count, 1)
+        self.assertEqual(metrics.lag_seconds.count, 2)
+        self.assertGreater(metrics.last_lag_seconds, 0)
+
+    def test_duplicate_hash_rejected(self):
+        LinkEventFactory(link="https://www.jstor.org/stable/1", event_id="1")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LinkEventFactory(link="https://www.jstor.org/stable/1", event_id="1")
+
+
+class CollectorMetricsTest(TestCase):
+    def test_histogram_buckets(self):
+        histogram = Histogram([1, 10])
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 56.5)
+
+    def test_render_prometheus(self):
+        metrics = CollectorMetrics(worker="0")
+        metrics.stats.frames_read = 3
+        metrics.write_seconds.observe(0.02)
+        rendered = render_prometheus([metrics.as_dict()])
+        self.assertIn("# TYPE linkevents_collect_frames_read counter", rendered)
+        self.assertIn('linkevents_collect_frames_read{worker="0"} 3', rendered)
+        self.assertIn(
+            "# TYPE linkevents_collect_frame_queue_high_water gauge", rendered
+        )
+        # No writes, so no lag yet
+        self.assertNotIn("linkevents_collect_last_lag_seconds{", rendered)
+        self.assertIn(
+            'linkevents_collect_write_seconds_bucket{worker="0",le="0.01"} 0',
+            rendered,
+        )
+        self.assertIn(
+            'linkevents_collect_write_seconds_bucket{worker="0",le="+Inf"} 1',
+            rendered,
+        )
+        self.assertIn('linkevents_collect_write_seconds_count{worker="0"} 1', rendered)
+        self.assertEqual(render_prometheus([]), "")
+
+
+class RecentHashesTest(TestCase):
+    def test_evicts_least_recently_seen(self):
+        recent_hashes = RecentHashes(max_size=2)
+        recent_hashes.add("a")
+        recent_hashes.add("b")
+        # Seeing "a" again keeps it over "b"
+        self.assertIn("a", recent_hashes)
+        recent_hashes.add("c")
+        self.assertEqual(len(recent_hashes), 2)
+        self.assertIn("a", recent_hashes)
+        self.assertNotIn("b", recent_hashes)
+
+    def test_seed_loads_recent_link_events(self):
+        recent = LinkEventFactory(
+            link="https://www.jstor.org/stable/1",
+            timestamp=datetime.now(timezone.utc),
+        )
+        old = LinkEventFactory(
+            link="https://www.jstor.org/stable/2",
+            timestamp=datetime(2020, 1, 1, tzinfo=timezone.utc),
+        )
+        recent_hashes = RecentHashes()
+        self.assertEqual(recent_hashes.seed(hours=3), 1)
+        self.assertIn(recent.hash_link_event_id, recent_hashes)
+        self.assertNotIn(old.hash_link_event_id, recent_hashes)
+
+
+class SSEStandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves the server's frames as an event stream, then heartbeats until
+    the server is stopped.
+    """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for frame in self.server.frames:
+            self.wfile.write(frame.encode("utf-8"))
+        while not self.server.stopping.is_set():
+            self.wfile.write(b":\n\n")
+            self.wfile.flush()
+            time.sleep(0.05)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class AsyncEventStreamConsumerTest(BaseTest):
+    def setUp(self):
+        self.organisation = OrganisationFactory(name="JSTOR")
+        self.collection = CollectionFactory(
+            name="JSTOR", organisation=self.organisation
+        )
+        self.url_pattern = URLPatternFactory(
+            url="www.jstor.org", collection=self.collection
+        )
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SSEStandInHandler)
+        self.server.frames = []
+        self.server.stopping = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.stopping.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _frame(self, event_id, link):
+        event_data = {
+            "meta": {
+                "id": event_id,
+                "dt": "2020-08-20T21:22:46Z",
+                "domain": "en.wikipedia.org",
+            },
+            "page_title": "Page1",
+            "page_namespace": 0,
+            "rev_id": 974060045,
+            "performer": {
+                "user_text": "User1",
+                "user_is_bot": False,
+                "user_id": 32001896,
+            },
+            "added_links": [{"link": link, "external": True}],
+        }
+        return "id: {}\ndata: {}\n\n".format(event_id, json.dumps(event_data))
+
+    def _consume(self, expected_events, queue_size=10, delay=0):
+        command = LinkEventsCollectCommand()
+        command.metrics = CollectorMetrics()
+        command.writer = LinkEventWriter(
+            batch_size=100, flush_interval=60, checkpoint_stream=self.url
+        )
+        processed = []
+
+        def process_event(event_data):
+            time.sleep(delay)
+            command._evaluate_link(event_data)
+            processed.append(event_data)
+            if len(processed) == expected_events:
+                consumer.stop()
+
+        consumer = AsyncEventStreamConsumer(
+            event_source=lambda: FlushingEventSource(self.url),
+            process_event=process_event,
+            writer=command.writer,
+            queue_size=queue_size,
+        )
+        async_to_sync(consumer.run)()
+        return consumer.stats
+
+    def test_consumer_writes_tracked_events(self):
+        """
+        Test that only decodable events with tracked links reach the writer
+        """
+        self.server.frames = [
+            "data: not json\n\n",
+            'data: {"link": "https://www.jstor.org/stable/0"\n\n',
+            self._frame("1", "https://www.example.com/1"),
+            self._frame("2", "https://www.jstor.org/stable/2"),
+            self._frame("3", "https://www.jstor.org/stable/3"),
+        ]
+        with mock.patch("extlinks.links.stream.URLPattern") as mock_url_pattern:
+            mock_url_pattern.objects.matcher.side_effect = URLPattern.objects.matcher
+            stats = self._consume(expected_events=2)
+
+        # The matcher is kept between frames rather than fetched for each.
+        self.assertEqual(mock_url_pattern.objects.matcher.call_count, 1)
+        self.assertEqual(stats.frames_read, 5)
+        # Messages without a candidate link aren't decoded at all
+        self.assertEqual(stats.frames_skipped, 2)
+        self.assertEqual(stats.decode_errors, 1)
+        self.assertEqual(stats.events_decoded, 2)
+        self.assertEqual(stats.events_tracked, 2)
+        self.assertEqual(stats.events_processed, 2)
+        self.assertEqual(
+            sorted(LinkEvent.objects.values_list("event_id", flat=True)),
+            ["2", "3"],
+        )
+        self.assertEqual(
+            StreamCheckpoint.objects.get(stream=self.url).last_event_id, "3"
+        )
+
+    def test_consumer_records_backpressure(self):
+        """
+        Test that a slow persist stage holds up parsing rather than losing
+        events
+        """
+        self.server.frames = [
+            self._frame(str(event_id), "https://www.jstor.org/stable/{}".format(event_id))
+            for event_id in range(5)
+        ]
+        stats = self._consume(expected_events=5, queue_size=1, delay=0.05)
+
+        self.assertGreater(stats.parser_waits, 0)
+        self.assertLessEqual(stats.event_queue_high_water, 1)
+        self.assertEqual(LinkEvent.objects.count(), 5)
+
+
+class ShardedCollectorTest(BaseTest):
+    def setUp(self):
+        self.organisation = OrganisationFactory(name="JSTOR")
+        self.collection = CollectionFactory(
+            name="JSTOR", organisation=self.organisation
+        )
+        self.url_pattern = URLPatternFactory(
+            url="www.jstor.org", collection=self.collection
+        )
+
+    def _event(self, event_id, domain="en.wikipedia.org"):
+        event_data = {
+            "meta": {
+                "id": event_id,
+                "dt": "2020-08-20T21:22:46Z",
+                "domain": domain,
+            },
+            "page_title": "Page1",
+            "page_namespace": 0,
+            "performer": {
+                "user_text": "User1",
+                "user_is_bot": False,
+                "user_id": 32001896,
+            },
+            "added_links": [
+                {"link": "https://www.jstor.org/stable/" + event_id, "external": True}
+            ],
+        }
+        return Event(data=json.dumps(event_data), id=event_id)
+
+    def test_shards_partition_messages(self):
+        shards = [Shard(index, 3) for index in range(3)]
+        for event_id in map(str, range(100)):
+            self.assertEqual(
+                sum(shard.contains_message(event_id) for shard in shards), 1
+            )
+
+    def test_domain_shard_needs_event_data(self):
+        shard = Shard(0, 2, "domain")
+        self.assertIsNone(shard.contains_message("1"))
+        self.assertEqual(
+            shard.contains_message("1", {"meta": {"domain": "en.wikipedia.org"}}),
+            shard.contains("en.wikipedia.org"),
+        )
+
+    def test_worker_only_collects_its_shard(self):
+        shard = Shard(0, 2)
+        events = [self._event(str(event_id)) for event_id in range(10)]
+        command = LinkEventsCollectCommand()
+        command.metrics = CollectorMetrics()
+        command.shard = shard
+        command.checkpoint_interval = 1000
+        command.writer = LinkEventWriter(
+            checkpoint_stream=shard.checkpoint_stream("stream")
+        )
+        with mock.patch.object(command, "_event_source", return_value=events):
+            command._process_events("stream")
+        command.writer.flush()
+
+        self.assertEqual(
+            set(LinkEvent.objects.values_list("event_id", flat=True)),
+            {event.id for event in events if shard.contains_message(event.id)},
+        )
+        stats = command.metrics.stats
+        self.assertEqual(stats.frames_read, 10)
+        self.assertEqual(stats.frames_other_shard + stats.events_decoded, 10)
+        self.assertEqual(stats.links_tracked, LinkEvent.objects.count())
+        # The worker's position still moves past messages it skipped
+        self.assertEqual(
+            StreamCheckpoint.objects.get(stream="stream#id:0/2").last_event_id, "9"
+        )
+
+    @mock.patch("multiprocessing.connection.wait")
+    @mock.patch("multiprocessing.get_context")
+    def test_supervisor_starts_and_stops_workers(self, mock_get_context, mock_wait):
+        processes = [mock.Mock(exitcode=1), mock.Mock(exitcode=None)]
+        processes[0].is_alive.return_value = False
+        processes[1].is_alive.return_value = True
+        mock_get_context.return_value.Process.side_effect = processes
+
+        command = LinkEventsCollectCommand()
+        with self.assertRaises(CommandError):
+            command._supervise({"workers": 2, "shard_by": "domain"})
+
+        shards = [
+            call.kwargs["args"][1]
+            for call in mock_get_context.return_value.Process.call_args_list
+        ]
+        self.assertEqual(shards, [Shard(0, 2, "domain"), Shard(1, 2, "domain")])
+        for process in processes:
+            process.start.assert_called_once()
+            process.join.assert_called_once()
+        processes[0].terminate.assert_not_called()
+        processes[1].terminate.assert_called_once()
+
+
 class LinkEventsArchiveCommandTest(TransactionTestCase):
     def setUp(self):
         self.user = UserFactory(username="jonsnow")
@@ -833,6 +1542,110 @@ class LinkEventsArchiveCommandTest(TransactionTestCase):
             for file in glob.glob(pattern):
                 os.remove(file)
 
+    @mock.patch(
+        "extlinks.links.management.commands.linkevents_archive.CHUNK_SIZE", 2
+    )
+    @mock.patch("swiftclient.Connection")
+    def test_dump_in_pages(self, mock_swift_connection):
+        """
+        Test that a day's LinkEvents are dumped into archives of CHUNK_SIZE
+        LinkEvents in the format of Django's serializers, and that only the
+        dumped LinkEvents are deleted.
+        """
+        mock_conn = mock_swift_connection.return_value
+        mock_conn.get_account.return_value = ({}, [])
+
+        for day, count in ((15, 1), (16, 5), (17, 1)):
+            for i in range(count):
+                LinkEventFactory(
+                    content_object=self.jstor_url_pattern,
+                    link=f"www.jstor.org/something_{day}_{i}",
+                    timestamp=datetime(2021, 1, day, 0, 0, i, tzinfo=timezone.utc),
+                    page_title=f"Page_{i}",
+                    username=self.user,
+                )
+        LinkEvent.objects.first().url.add(self.jstor_url_pattern)
+        expected = json.loads(
+            serializers.serialize(
+                "json", LinkEvent.objects.filter(timestamp__day__lt=17).order_by("pk")
+            )
+        )
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            call_command(
+                "linkevents_archive",
+                "dump",
+                date=date(year=2021, month=1, day=16),
+                output=temp_dir,
+            )
+
+            filenames = [
+                "links_linkevent_20210115_0.json.gz",
+                "links_linkevent_20210116_0.json.gz",
+                "links_linkevent_20210116_1.json.gz",
+                "links_linkevent_20210116_2.json.gz",
+            ]
+            self.assertEqual(sorted(os.listdir(temp_dir)), filenames)
+            records = []
+            for filename in filenames:
+                with gzip.open(os.path.join(temp_dir, filename), "rt") as archive:
+                    records.extend(json.load(archive))
+            self.assertEqual(
+                sorted(records, key=lambda record: record["pk"]), expected
+            )
+
+            self.assertEqual(LinkEvent.objects.get().timestamp.day, 17)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @mock.patch("swiftclient.Connection")
+    def test_dump_and_load_columnar(self, mock_swift_connection):
+        """
+        Test that LinkEvents dumped in the columnar format can be loaded.
+        """
+        mock_conn = mock_swift_connection.return_value
+        mock_conn.get_account.return_value = ({}, [])
+
+        for i in range(5):
+            LinkEventFactory(
+                content_object=self.jstor_url_pattern,
+                link=f"www.jstor.org/something_16_{i}",
+                timestamp=datetime(2021, 1, 16, 0, 0, i, tzinfo=timezone.utc),
+                page_title=f"Page_{i}",
+                username=self.user,
+            )
+        LinkEvent.objects.first().url.add(self.jstor_url_pattern)
+        expected = json.loads(
+            serializers.serialize("json", LinkEvent.objects.order_by("pk"))
+        )
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            call_command(
+                "linkevents_archive",
+                "dump",
+                "--format",
+                "columnar",
+                date=date(year=2021, month=1, day=16),
+                output=temp_dir,
+            )
+            self.assertEqual(LinkEvent.objects.count(), 0)
+
+            archive = os.path.join(temp_dir, "links_linkevent_20210116_0.columnar.gz")
+            with gzip.open(archive, "rt") as f:
+                self.assertTrue(is_columnar(f.read()))
+            call_command("linkevents_archive", "load", archive)
+
+            self.assertEqual(
+                json.loads(
+                    serializers.serialize("json", LinkEvent.objects.order_by("pk"))
+                ),
+                expected,
+            )
+        finally:
+            shutil.rmtree(temp_dir)
+
     @mock.patch.dict(
         os.environ,
         {
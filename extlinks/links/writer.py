@@ -0,0 +1,282 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from django.db import transaction
+from django.utils import timezone
+
+from extlinks.organisations.models import Organisation, User
+from .models import LinkEvent, StreamCheckpoint, URLPattern
+
+logger = logging.getLogger("django")
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+# Roughly a few hours of tracked links from the EventStream.
+DEFAULT_RECENT_HASHES_SIZE = 100000
+DEFAULT_SEED_HOURS = 3
+# Stream messages between checkpoint updates.
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+
+
+class RecentHashes:
+    """
+    Bounded set of recently written hash_link_event_ids, evicting the least
+    recently seen hash once max_size is reached.
+
+    The collector checks this instead of querying the database for every
+    link. Anything older than the window is caught by the unique constraint
+    on LinkEvent.hash_link_event_id when it is inserted.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_RECENT_HASHES_SIZE):
+        self.max_size = max_size
+        self._hashes: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, hash_link_event_id: str) -> bool:
+        if hash_link_event_id in self._hashes:
+            self._hashes.move_to_end(hash_link_event_id)
+            return True
+        return False
+
+    def add(self, hash_link_event_id: str):
+        self._hashes[hash_link_event_id] = None
+        self._hashes.move_to_end(hash_link_event_id)
+        if len(self._hashes) > self.max_size:
+            self._hashes.popitem(last=False)
+
+    def update(self, hash_link_event_ids: Iterable[str]):
+        for hash_link_event_id in hash_link_event_ids:
+            self.add(hash_link_event_id)
+
+    def seed(self, hours: float = DEFAULT_SEED_HOURS) -> int:
+        """
+        Loads the hashes of LinkEvents from the last few hours, oldest
+        first, so a restarted collector doesn't rewrite events it replays.
+        Returns the number of hashes loaded.
+        """
+        since = timezone.now() - timedelta(hours=hours)
+        hash_link_event_ids = (
+            LinkEvent.objects.filter(
+                timestamp__gte=since, hash_link_event_id__isnull=False
+            )
+            .order_by("timestamp")
+            .values_list("hash_link_event_id", flat=True)
+        )
+        before = len(self)
+        self.update(hash_link_event_ids.iterator())
+        return len(self) - before
+
+
+class PendingLinkEvent(NamedTuple):
+    """
+    A LinkEvent waiting to be written, along with what is needed to fill
+    in its user and user list flag when it is flushed.
+    """
+
+    link_event: LinkEvent
+    username: str
+    url_patterns: List[URLPattern]
+    collection: Optional[object] = None
+    organisation: Optional[Organisation] = None
+
+
+class LinkEventWriter:
+    """
+    Write-behind buffer for LinkEvents collected from the EventStream.
+
+    Events are accumulated until either batch_size events are pending or
+    flush_interval seconds have passed since the oldest pending event, and
+    are then written in a single transaction with a handful of bulk
+    queries rather than several round trips per link.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        recent_hashes: Optional[RecentHashes] = None,
+        checkpoint_stream: Optional[str] = None,
+        metrics=None,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.recent_hashes = (
+            recent_hashes if recent_hashes is not None else RecentHashes()
+        )
+        self.pending: List[PendingLinkEvent] = []
+        self.pending_hashes: Set[str] = set()
+        self.oldest_pending_at: Optional[float] = None
+        # Stream position of the last message processed, and the one last
+        # saved to the StreamCheckpoint.
+        self.checkpoint_stream = checkpoint_stream
+        self.last_event_id: Optional[str] = None
+        self.saved_event_id: Optional[str] = None
+        # CollectorMetrics recording each write, if any
+        self.metrics = metrics
+
+    def __len__(self):
+        return len(self.pending)
+
+    def is_pending(self, hash_link_event_id: str) -> bool:
+        return hash_link_event_id in self.pending_hashes
+
+    def is_duplicate(self, hash_link_event_id: str) -> bool:
+        """
+        Returns True if the LinkEvent is already buffered or was recently
+        written.
+        """
+        return (
+            self.is_pending(hash_link_event_id)
+            or hash_link_event_id in self.recent_hashes
+        )
+
+    def add(self, pending_link_event: PendingLinkEvent):
+        """
+        Buffers a LinkEvent, flushing the buffer if it is full or due.
+        """
+        link_event = pending_link_event.link_event
+        if not link_event.hash_link_event_id:
+            link_event.hash_link_event_id = LinkEvent.get_hash_link_event_id(
+                link_event.link, link_event.event_id
+            )
+        if self.is_duplicate(link_event.hash_link_event_id):
+            return
+
+        if self.oldest_pending_at is None:
+            self.oldest_pending_at = time.monotonic()
+        self.pending.append(pending_link_event)
+        self.pending_hashes.add(link_event.hash_link_event_id)
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def set_position(self, last_event_id: Optional[str]):
+        """
+        Records the id of the last stream message processed. It is saved
+        with the next flush, once everything before it has been written.
+        """
+        if last_event_id:
+            self.last_event_id = last_event_id
+
+    def flush_if_due(self):
+        # Called regularly whatever the stream is doing, so it is also where
+        # metrics get published.
+        if self.metrics is not None:
+            self.metrics.publish_if_due()
+        if (
+            self.oldest_pending_at is not None
+            and time.monotonic() - self.oldest_pending_at >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes every pending LinkEvent, and the stream checkpoint, to the
+        database and empties the buffer. Returns the number of LinkEvents
+        written.
+        """
+        save_checkpoint = (
+            self.checkpoint_stream is not None
+            and self.last_event_id != self.saved_event_id
+        )
+        if not self.pending and not save_checkpoint:
+            return 0
+
+        pending = self.pending
+        started = time.monotonic()
+        with transaction.atomic():
+            if save_checkpoint:
+                # Saved in the same transaction so the checkpoint never gets
+                # ahead of the events written.
+                StreamCheckpoint.objects.update_or_create(
+                    stream=self.checkpoint_stream,
+                    defaults={"last_event_id": self.last_event_id},
+                )
+            if pending:
+                self._write(pending)
+
+        if save_checkpoint:
+            self.saved_event_id = self.last_event_id
+        if self.metrics is not None and pending:
+            self.metrics.observe_write(
+                [p.link_event for p in pending], time.monotonic() - started
+            )
+        self.recent_hashes.update(self.pending_hashes)
+        logger.info("Flushed %d LinkEvents", len(pending))
+        self.pending = []
+        self.pending_hashes = set()
+        self.oldest_pending_at = None
+
+        return len(pending)
+
+    def _write(self, pending: List[PendingLinkEvent]):
+        users = self._get_or_create_users({p.username for p in pending})
+
+        link_events = []
+        collection_rows = set()
+        for pending_link_event in pending:
+            link_event = pending_link_event.link_event
+            user = users[pending_link_event.username]
+            organisation = pending_link_event.organisation
+            link_event.username = user
+            link_event.on_user_list = (
+                organisation is not None
+                and user.pk in Organisation.objects.user_list_ids(organisation.pk)
+            )
+            # Mirrors adding the event to each pattern's link_events in
+            # turn: the generic relation ends up on the last one.
+            link_event.content_object = pending_link_event.url_patterns[-1]
+            link_events.append(link_event)
+
+            if pending_link_event.collection is not None:
+                for url_pattern in pending_link_event.url_patterns:
+                    collection_rows.add(
+                        (url_pattern.pk, pending_link_event.collection.pk)
+                    )
+
+        # Events written by an earlier run, or by another collector, are
+        # rejected by the unique constraint on hash_link_event_id.
+        LinkEvent.objects.bulk_create(link_events, ignore_conflicts=True)
+
+        if collection_rows:
+            Through = URLPattern.collections.through
+            Through.objects.bulk_create(
+                [
+                    Through(urlpattern_id=url_pattern_id, collection_id=collection_id)
+                    for url_pattern_id, collection_id in collection_rows
+                ],
+                ignore_conflicts=True,
+            )
+
+    def _get_or_create_users(self, usernames: Set[str]) -> Dict[str, User]:
+        users = {
+            user.username: user
+            for user in User.objects.filter(username__in=usernames)
+        }
+        missing = usernames - users.keys()
+        if missing:
+            User.objects.bulk_create(
+                [User(username=username) for username in missing],
+                ignore_conflicts=True,
+            )
+            users.update(
+                {
+                    user.username: user
+                    for user in User.objects.filter(username__in=missing)
+                }
+            )
+        # Usernames the database collates onto another user's row won't
+        # come back under the same key, so fall back to a lookup for them.
+        for username in usernames - users.keys():
+            users[username], _ = User.objects.get_or_create(username=username)
+
+        return users
@@ -5,7 +5,11 @@ from extlinks.common.management.commands import BaseCommand
 from django.db import close_old_connections
 from django.utils.timezone import now
 
-from extlinks.organisations.models import Organisation, User
+from extlinks.organisations.models import (
+    Organisation,
+    User,
+    bump_user_list_version,
+)
 
 
 class Command(BaseCommand):
@@ -28,17 +32,22 @@ class Command(BaseCommand):
             else:
                 continue
 
-            # If we got a valid response, clear the previous username list
-            organisation.username_list.clear()
-
+            user_objects = []
             for result in json_response:
                 username = result["wp_username"]
 
                 user_object, _ = User.objects.get_or_create(username=username)
 
-                organisation.username_list.add(user_object)
+                user_objects.append(user_object)
+
+            # If we got a valid response, replace the previous username list.
+            # Doing it in one go only invalidates cached user lists once.
+            organisation.username_list.set(user_objects)
             # Useful for health check
             organisation.username_list_updated = now()
             organisation.save()
 
+        # Make sure every process picks up the new lists, even if the
+        # signals above were skipped because nothing changed.
+        bump_user_list_version()
         close_old_connections()
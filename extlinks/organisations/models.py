@@ -1,7 +1,42 @@
+import logging
+import time
+
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from extlinks.links.models import LinkEvent, URLPattern, bump_url_pattern_version
+
+logger = logging.getLogger("django")
+
+USER_LIST_VERSION_KEY = "organisation_user_list_version"
+# Seconds a process trusts its user list snapshot before checking the
+# shared version number for changes made by other processes.
+USER_LIST_VERSION_CHECK_INTERVAL = 5
+
+
+def get_user_list_version():
+    """
+    Returns the shared user list version number, initialising it if it
+    isn't in the cache yet (or was evicted).
+    """
+    cache.add(USER_LIST_VERSION_KEY, time.time_ns(), None)
+    return cache.get(USER_LIST_VERSION_KEY)
+
 
-from extlinks.links.models import LinkEvent, URLPattern
+def bump_user_list_version():
+    """
+    Invalidates every process' organisation user list snapshot.
+    """
+    OrganisationManager.invalidate_user_lists()
+    try:
+        version = cache.incr(USER_LIST_VERSION_KEY)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(USER_LIST_VERSION_KEY, version, None)
+    logger.info("bump organisation_user_list_version to %s", version)
 
 
 class User(models.Model):
@@ -14,11 +49,63 @@ class User(models.Model):
         return self.username
 
 
+class OrganisationManager(models.Manager):
+    # Process-local snapshot of organisation id -> frozenset of the ids of
+    # users on its user list, shared by all managers.
+    _user_lists_version = None
+    _user_lists = None
+    _user_lists_checked_at = 0.0
+
+    def _load_user_lists(self):
+        manager = OrganisationManager
+        now = time.monotonic()
+        if (
+            manager._user_lists is not None
+            and now - manager._user_lists_checked_at < USER_LIST_VERSION_CHECK_INTERVAL
+        ):
+            return
+
+        version = get_user_list_version()
+        manager._user_lists_checked_at = now
+        if (
+            manager._user_lists is not None
+            and version is not None
+            and version == manager._user_lists_version
+        ):
+            return
+
+        members = {}
+        Through = Organisation.username_list.through
+        rows = Through.objects.values_list("organisation_id", "user_id")
+        for organisation_id, user_id in rows.iterator():
+            members.setdefault(organisation_id, set()).add(user_id)
+        manager._user_lists_version = version
+        manager._user_lists = {
+            organisation_id: frozenset(user_ids)
+            for organisation_id, user_ids in members.items()
+        }
+        logger.info("loaded organisation user list snapshot version %s", version)
+
+    @staticmethod
+    def invalidate_user_lists():
+        OrganisationManager._user_lists = None
+
+    def user_list_ids(self, organisation_id):
+        """
+        Returns a frozenset of the ids of the users on the organisation's
+        user list, from this process' snapshot. The snapshot is only
+        reloaded when the shared version number changes.
+        """
+        self._load_user_lists()
+        return OrganisationManager._user_lists.get(organisation_id, frozenset())
+
+
 class Organisation(models.Model):
     class Meta:
         app_label = "organisations"
         ordering = ["name"]
 
+    objects = OrganisationManager()
     name = models.CharField(max_length=40)
 
     # programs.Program syntax required to avoid circular import.
@@ -58,3 +145,20 @@ class Collection(models.Model):
 
     def get_url_patterns(self):
         return URLPattern.objects.filter(collections__name__contains=self.name)
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def delete_url_pattern_cache(sender, instance, **kwargs):
+    # URL pattern snapshots carry their collection's organisation.
+    bump_url_pattern_version()
+
+
+@receiver(m2m_changed, sender=Organisation.username_list.through)
+def delete_user_list_cache(sender, instance, action, pk_set, **kwargs):
+    # Adding users who are already on the list sends an empty pk_set, which
+    # doesn't change anything we have cached.
+    if action == "post_clear" or (
+        action in ("post_add", "post_remove") and pk_set
+    ):
+        bump_user_list_version()
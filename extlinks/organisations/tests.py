@@ -2,11 +2,23 @@ from datetime import datetime, timezone
 import json
 from unittest import mock
 
+from django.core.cache import cache
 from django.core.management import call_command
-from django.test import TestCase, RequestFactory, TransactionTestCase
+from django.test import (
+    TestCase,
+    RequestFactory,
+    TransactionTestCase,
+    override_settings,
+)
 from django.urls import reverse
 from django.utils.http import urlencode
 
+from extlinks.aggregates.models import (
+    CollectionMonthlySummary,
+    LinkAggregate,
+    UserAggregate,
+)
+from extlinks.aggregates.sketches import HyperLogLog
 from extlinks.common.views import (
     CSVPageTotals,
     CSVProjectTotals,
@@ -16,6 +28,7 @@ from extlinks.links.factories import LinkEventFactory, URLPatternFactory
 from extlinks.links.models import LinkEvent
 from extlinks.programs.factories import ProgramFactory
 from .factories import UserFactory, OrganisationFactory, CollectionFactory
+from .models import USER_LIST_VERSION_KEY, Organisation, OrganisationManager
 from .views import OrganisationListView, OrganisationDetailView
 
 
@@ -50,6 +63,83 @@ class OrganisationListTest(TestCase):
         self.assertContains(response, self.organisation_two.name)
 
 
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class OrganisationUserListCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        OrganisationManager.invalidate_user_lists()
+        self.organisation = OrganisationFactory()
+        self.user1 = UserFactory(username="User1")
+        self.user2 = UserFactory(username="User2")
+        self.organisation.username_list.add(self.user1)
+
+    def test_user_list_ids(self):
+        self.assertEqual(
+            Organisation.objects.user_list_ids(self.organisation.pk),
+            frozenset([self.user1.pk]),
+        )
+        self.assertEqual(
+            Organisation.objects.user_list_ids(OrganisationFactory().pk), frozenset()
+        )
+
+    def test_user_list_ids_cached(self):
+        Organisation.objects.user_list_ids(self.organisation.pk)
+        with self.assertNumQueries(0):
+            Organisation.objects.user_list_ids(self.organisation.pk)
+
+    def test_user_list_ids_reloaded_on_change(self):
+        Organisation.objects.user_list_ids(self.organisation.pk)
+        self.organisation.username_list.add(self.user2)
+        self.assertEqual(
+            Organisation.objects.user_list_ids(self.organisation.pk),
+            frozenset([self.user1.pk, self.user2.pk]),
+        )
+        self.organisation.username_list.clear()
+        self.assertEqual(
+            Organisation.objects.user_list_ids(self.organisation.pk), frozenset()
+        )
+
+    def test_user_list_ids_reloaded_on_version_bump(self):
+        """
+        Test that a change made by another process is picked up once the
+        snapshot is next checked
+        """
+        Organisation.objects.user_list_ids(self.organisation.pk)
+        Organisation.username_list.through.objects.create(
+            organisation=self.organisation, user=self.user2
+        )
+        cache.incr(USER_LIST_VERSION_KEY)
+        OrganisationManager._user_lists_checked_at = 0.0
+        self.assertIn(
+            self.user2.pk, Organisation.objects.user_list_ids(self.organisation.pk)
+        )
+
+    @mock.patch.dict("os.environ", {"TWL_API_TOKEN": "token"})
+    @mock.patch("requests.get")
+    def test_users_update_lists_refreshes_cache(self, mock_get):
+        self.organisation.username_list_url = "https://example.com/users"
+        self.organisation.save()
+        Organisation.objects.user_list_ids(self.organisation.pk)
+
+        mock_get.return_value = mock.Mock(
+            status_code=200,
+            json=mock.Mock(
+                return_value=[{"wp_username": "User2"}, {"wp_username": "User3"}]
+            ),
+        )
+        call_command("users_update_lists")
+
+        user_list_ids = Organisation.objects.user_list_ids(self.organisation.pk)
+        self.assertEqual(
+            set(self.organisation.username_list.values_list("pk", flat=True)),
+            user_list_ids,
+        )
+        self.assertNotIn(self.user1.pk, user_list_ids)
+        self.assertIn(self.user2.pk, user_list_ids)
+
+
 class OrganisationDetailTest(TransactionTestCase):
     """
     Mostly the same tests as for programs, at least for now.
@@ -190,6 +280,92 @@ class OrganisationDetailTest(TransactionTestCase):
 
         self.assertEqual(json.loads(response.content)["editor_count"], 3)
 
+    @mock.patch("extlinks.aggregates.storage.download_sketch")
+    @mock.patch("extlinks.aggregates.storage.find_archives")
+    @mock.patch("swiftclient.Connection")
+    def test_organisation_detail_counts_from_summaries(
+        self, mock_swift_connection, mock_find_archives, mock_download_sketch
+    ):
+        """
+        Test that counts are read from the monthly summaries, which are kept
+        when the aggregates are archived.
+        """
+
+        mock_swift_connection.side_effect = RuntimeError("Swift is disabled")
+        mock_find_archives.return_value = [
+            {
+                "name": "aggregates_useraggregate_{}_{}_2019-01-01_0.json.gz".format(
+                    self.organisation1.pk, self.collection1.pk
+                )
+            }
+        ]
+        mock_download_sketch.return_value = HyperLogLog()
+        call_command("fill_collection_summaries")
+        UserAggregate.objects.all().delete()
+        LinkAggregate.objects.all().delete()
+
+        params = "collection={}&form_data={{}}".format(self.collection1.id)
+        response = self.client.get(
+            reverse("organisations:editor_count") + "?" + params
+        )
+        mock_find_archives.return_value = []
+        self.assertEqual(json.loads(response.content)["editor_count"], 3)
+
+        response = self.client.get(reverse("organisations:links_count") + "?" + params)
+        self.assertEqual(json.loads(response.content)["links_added"], 3)
+
+    @mock.patch("swiftclient.Connection")
+    def test_organisation_detail_counts_pending_changes(self, mock_swift_connection):
+        """
+        Test that counts are read from the aggregates while changes to them
+        haven't been refreshed in the monthly summaries yet.
+        """
+
+        mock_swift_connection.side_effect = RuntimeError("Swift is disabled")
+        call_command("fill_collection_summaries")
+        LinkEventFactory(
+            link=self.linkevent1.link,
+            content_object=self.linkevent1.content_object,
+            change=LinkEvent.ADDED,
+            username=UserFactory(username="Ann"),
+            timestamp=datetime(2019, 4, 2, tzinfo=timezone.utc),
+        )
+        call_command("fill_link_aggregates")
+
+        params = "collection={}&form_data={{}}".format(self.collection1.id)
+        response = self.client.get(reverse("organisations:links_count") + "?" + params)
+        self.assertEqual(json.loads(response.content)["links_added"], 4)
+
+        call_command("fill_collection_summaries")
+        response = self.client.get(reverse("organisations:links_count") + "?" + params)
+        self.assertEqual(json.loads(response.content)["links_added"], 4)
+
+    @mock.patch("swiftclient.Connection")
+    def test_organisation_detail_exact_counts_without_archives(
+        self, mock_swift_connection
+    ):
+        """
+        Test that editor and project counts are read from the aggregates,
+        not from the summaries' sketches, when no month is archived.
+        """
+
+        mock_swift_connection.side_effect = RuntimeError("Swift is disabled")
+        call_command("fill_collection_summaries")
+        CollectionMonthlySummary.objects.update(
+            editors=HyperLogLog().to_bytes(), projects=HyperLogLog().to_bytes()
+        )
+
+        params = "collection={}&form_data={{}}".format(self.collection1.id)
+        response = self.client.get(
+            reverse("organisations:editor_count") + "?" + params
+        )
+        self.assertEqual(json.loads(response.content)["editor_count"], 3)
+
+        response = self.client.get(
+            reverse("organisations:project_count") + "?" + params
+        )
+        self.assertEqual(json.loads(response.content)["project_count"], 1)
+
     @mock.patch("swiftclient.Connection")
     def test_organisation_detail_date_form(self, mock_swift_connection):
         """
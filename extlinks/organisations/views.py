@@ -13,15 +13,13 @@ from django.views.generic import ListView, DetailView
 import extlinks.aggregates.storage as storage
 
 from extlinks.aggregates.models import (
+    ChangedCollectionMonth,
+    CollectionMonthlySummary,
     LinkAggregate,
     PageProjectAggregate,
     UserAggregate,
 )
-from extlinks.aggregates.storage import (
-    find_unique,
-    calculate_totals,
-    download_aggregates,
-)
+from extlinks.aggregates.sketches import HyperLogLog
 from extlinks.common.forms import FilterForm
 from extlinks.common.helpers import (
     get_linksearchtotal_data_by_time,
@@ -229,20 +227,6 @@ class OrganisationDetailView(DetailView):
 
         links_aggregated_date = []
 
-        # Download aggregates from object storage and calculate totals grouped
-        # by year and month.
-        totals = calculate_totals(
-            download_aggregates(
-                prefix="aggregates_linkaggregate",
-                queryset_filter=queryset_filter,
-                to_date=to_date,
-            ),
-            group_by=lambda record: (record["year"], record["month"]),
-        )
-        links_aggregated_date.extend(totals)
-
-        links_aggregated_date = []
-
         # Download aggregates from object storage and calculate totals grouped
         # by year and month.
         totals = storage.calculate_totals(
@@ -250,6 +234,7 @@ class OrganisationDetailView(DetailView):
                 prefix="aggregates_linkaggregate",
                 queryset_filter=queryset_filter,
                 to_date=to_date,
+                totals_by=("year", "month"),
             ),
             group_by=lambda record: (record["year"], record["month"]),
         )
@@ -303,6 +288,112 @@ class OrganisationDetailView(DetailView):
         return context
 
 
+def get_collection_summaries(queryset_filter, aggregates):
+    """
+    Returns the CollectionMonthlySummary rows matching queryset_filter, or
+    None if they don't cover every month of the given aggregates yet, or
+    are behind them, in which case the aggregates should be read instead.
+    """
+    # Summaries are refreshed from the changed months by
+    # fill_collection_summaries, and are stale until then.
+    if ChangedCollectionMonth.objects.matching(
+        queryset_filter, aggregates.model
+    ).exists():
+        return None
+
+    summaries = CollectionMonthlySummary.objects.matching(queryset_filter)
+    earliest_summary = summaries.order_by("full_date").first()
+    if earliest_summary is None:
+        return None
+    if aggregates.filter(
+        full_date__lt=earliest_summary.full_date.replace(day=1)
+    ).exists():
+        return None
+    return summaries
+
+
+def merge_sketches(sketches):
+    """
+    Merges serialized HyperLogLog sketches into one, which can be updated
+    and counted like a set of the values.
+    """
+    merged = HyperLogLog()
+    for sketch in sketches:
+        merged.merge(HyperLogLog.from_bytes(sketch))
+    return merged
+
+
+def merge_archived_sketch(values, archived):
+    """
+    Merges the sketch of archived values into values, a set or a sketch.
+    """
+    if not any(archived.registers):
+        return values
+    if not isinstance(values, HyperLogLog):
+        values = HyperLogLog.from_values(values)
+    values.merge(archived)
+    return values
+
+
+def count_distinct(aggregates, queryset_filter, prefix, field, summary_field):
+    """
+    Counts the distinct values of field in the aggregates matching
+    queryset_filter and in their archives. The count is exact when none of
+    the months are archived. Otherwise it's estimated from the sketches of
+    the monthly summaries and of the archives.
+
+    Parameters
+    ----------
+    aggregates : QuerySet
+        The aggregates matching queryset_filter.
+
+    queryset_filter : Q
+        The filter built by build_queryset_filters.
+
+    prefix : str
+        The prefix of the aggregates' archives.
+
+    field : str
+        The aggregate field to count the distinct values of.
+
+    summary_field : str
+        The CollectionMonthlySummary field with the sketch of field.
+
+    Returns
+    -------
+    int
+    """
+    if not storage.find_archives(prefix, queryset_filter):
+        return aggregates.values(field).distinct().order_by().count()
+
+    summaries = get_collection_summaries(queryset_filter, aggregates)
+    if summaries is not None:
+        values = merge_sketches(summaries.values_list(summary_field, flat=True))
+        aggregates = summaries
+    else:
+        values = set(aggregates.values_list(field, flat=True).distinct())
+    to_date = None
+
+    # Create a filter to only download archives for missing months.
+    if aggregates.exists():
+        earliest_aggregate_date = aggregates.earliest("full_date").full_date
+        to_date = earliest_aggregate_date - relativedelta(months=1)
+        to_date = to_date.replace(day=last_day(to_date))
+
+    # Add unique values from the sketches of the archived aggregates.
+    values = merge_archived_sketch(
+        values,
+        storage.download_sketch(
+            prefix=prefix,
+            queryset_filter=queryset_filter,
+            field=field,
+            to_date=to_date,
+        ),
+    )
+
+    return len(values)
+
+
 def get_editor_count(request):
     """
     request : dict
@@ -315,29 +406,15 @@ def get_editor_count(request):
     collection = Collection.objects.get(id=int(collection_id))
 
     queryset_filter = build_queryset_filters(form_data, {"collection": collection})
-    aggregates = UserAggregate.objects.filter(queryset_filter)
-    usernames = set(aggregates.values_list("username", flat=True).distinct())
-    to_date = None
-
-    # Create a filter to only download archives for missing months.
-    if aggregates.exists():
-        earliest_aggregate_date = aggregates.earliest("full_date").full_date
-        to_date = earliest_aggregate_date - relativedelta(months=1)
-        to_date = to_date.replace(day=last_day(to_date))
-
-    # Add unique usernames from the archived aggregates.
-    usernames.update(
-        storage.find_unique(
-            storage.download_aggregates(
-                prefix="aggregates_useraggregate",
-                queryset_filter=queryset_filter,
-                to_date=to_date,
-            ),
-            group_by=lambda record: (record["username"]),
-        )
+    editor_count = count_distinct(
+        UserAggregate.objects.filter(queryset_filter),
+        queryset_filter,
+        prefix="aggregates_useraggregate",
+        field="username",
+        summary_field="editors",
     )
 
-    response = {"editor_count": len(usernames)}
+    response = {"editor_count": editor_count}
 
     return JsonResponse(response)
 
@@ -354,29 +431,15 @@ def get_project_count(request):
     collection = Collection.objects.get(id=int(collection_id))
 
     queryset_filter = build_queryset_filters(form_data, {"collection": collection})
-    aggregates = PageProjectAggregate.objects.filter(queryset_filter)
-    projects = set(aggregates.values_list("project_name", flat=True).distinct())
-    to_date = None
-
-    # Create a filter to only download archives for missing months.
-    if aggregates.exists():
-        earliest_aggregate_date = aggregates.earliest("full_date").full_date
-        to_date = earliest_aggregate_date - relativedelta(months=1)
-        to_date = to_date.replace(day=last_day(to_date))
-
-    # Add unique project names from the archived aggregates.
-    projects.update(
-        storage.find_unique(
-            storage.download_aggregates(
-                prefix="aggregates_pageprojectaggregate",
-                queryset_filter=queryset_filter,
-                to_date=to_date,
-            ),
-            group_by=lambda record: (record["project_name"]),
-        )
+    project_count = count_distinct(
+        PageProjectAggregate.objects.filter(queryset_filter),
+        queryset_filter,
+        prefix="aggregates_pageprojectaggregate",
+        field="project_name",
+        summary_field="projects",
     )
 
-    response = {"project_count": len(projects)}
+    response = {"project_count": project_count}
 
     return JsonResponse(response)
 
@@ -394,6 +457,9 @@ def get_links_count(request):
 
     queryset_filter = build_queryset_filters(form_data, {"collection": collection})
     aggregates = LinkAggregate.objects.filter(queryset_filter)
+    summaries = get_collection_summaries(queryset_filter, aggregates)
+    if summaries is not None:
+        aggregates = summaries
     links_added_removed = aggregates.aggregate(
         links_added=Sum("total_links_added"),
         links_removed=Sum("total_links_removed"),
@@ -416,6 +482,7 @@ def get_links_count(request):
             prefix="aggregates_linkaggregate",
             queryset_filter=queryset_filter,
             to_date=to_date,
+            totals_by=(),
         ),
     )
     if len(totals) > 0:
@@ -469,6 +536,7 @@ def get_top_pages(request):
             prefix="aggregates_pageprojectaggregate",
             queryset_filter=queryset_filter,
             to_date=to_date,
+            totals_by=("project_name", "page_name"),
         ),
         group_by=lambda record: (record["project_name"], record["page_name"]),
     )
@@ -528,6 +596,7 @@ def get_top_projects(request):
             prefix="aggregates_pageprojectaggregate",
             queryset_filter=queryset_filter,
             to_date=to_date,
+            totals_by=("project_name",),
         ),
         group_by=lambda record: record["project_name"],
     )
@@ -589,6 +658,7 @@ def get_top_users(request):
             prefix="aggregates_useraggregate",
             queryset_filter=queryset_filter,
             to_date=to_date,
+            totals_by=("username",),
         ),
         group_by=lambda record: record["username"],
     )